@@ -1,8 +1,50 @@
 from django.contrib import admin
-from .models import Reader, Book, Borrow, BorrowHistory, UserProfile
+from .models import Reader, ArchivedBorrow, Book, Borrow, BorrowHistory, FineAccrualRun, FineLedgerEntry, Hold, OutboxEmail, UserProfile
 
 admin.site.register(Reader)
 admin.site.register(Book)
 admin.site.register(Borrow)
-admin.site.register(BorrowHistory)
 admin.site.register(UserProfile)
+
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('subject',)
+
+
+@admin.register(Hold)
+class HoldAdmin(admin.ModelAdmin):
+    list_display = ('book', 'user', 'status', 'created_at', 'expires_at')
+    list_filter = ('status',)
+    raw_id_fields = ('book', 'user')
+
+
+@admin.register(FineLedgerEntry)
+class FineLedgerEntryAdmin(admin.ModelAdmin):
+    list_display = ('borrow', 'user', 'kind', 'amount', 'days', 'created_at')
+    list_filter = ('kind',)
+    raw_id_fields = ('borrow', 'user')
+
+
+@admin.register(FineAccrualRun)
+class FineAccrualRunAdmin(admin.ModelAdmin):
+    list_display = ('started_at', 'finished_at', 'entries', 'amount')
+
+
+@admin.register(BorrowHistory)
+class BorrowHistoryAdmin(admin.ModelAdmin):
+    list_display = ('book', 'user', 'status', 'borrow_date', 'recorded_at')
+    list_filter = ('status',)
+    raw_id_fields = ('book', 'user', 'borrow')
+
+    def has_change_permission(self, request, obj=None):
+        # Append-only log.
+        return False
+
+
+@admin.register(ArchivedBorrow)
+class ArchivedBorrowAdmin(admin.ModelAdmin):
+    list_display = ('id', 'book', 'user', 'borrowed_at', 'returned_at', 'archived_at')
+    raw_id_fields = ('book', 'user')
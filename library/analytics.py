@@ -0,0 +1,166 @@
+from datetime import timedelta
+
+import numpy as np
+from django.core.cache import cache
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from .expressions import EpochSeconds
+from .models import ArchivedBorrow, Book, Borrow, ReportSnapshot
+
+
+CHUNK_SIZE = 50000
+PERCENTILES = (50, 75, 90, 95, 99)
+# Lower edges of the fine bands; the last band is open-ended.
+FINE_BANDS = (1, 50, 100, 200, 500)
+# Windows offered on the staff page; the loan_analytics command refreshes each.
+DAY_OPTIONS = (30, 90, 365, 730)
+DAY = 86400
+
+
+def _loans(start, chunk_size):
+    """Every loan still open or returned since ``start``, archived ones included.
+
+    One row per loan: id, borrowed_at, due_date, returned_at (epoch seconds,
+    NaN when NULL) and book_id, read in id order ``chunk_size`` rows at a time.
+    """
+    chunks = []
+    for model in (Borrow, ArchivedBorrow):
+        loans = model.objects.filter(Q(returned=False) | Q(returned_at__gte=start)).order_by('id')
+        last_id = 0
+        while True:
+            rows = list(
+                loans.filter(id__gt=last_id).values_list(
+                    'id', EpochSeconds('borrowed_at'), EpochSeconds('due_date'), EpochSeconds('returned_at'), 'book_id',
+                )[:chunk_size]
+            )
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.float64))
+            last_id = rows[-1][0]
+            if len(rows) < chunk_size:
+                break
+    return np.concatenate(chunks) if chunks else np.empty((0, 5))
+
+
+def _genre_codes(book_ids, genres):
+    """Index into ``genres`` of each loan's book, through a lookup array over book ids."""
+    position = {genre: i for i, genre in enumerate(genres)}
+    books = list(Book.objects.values_list('id', 'genre'))
+    lookup = np.full(max([book_id for book_id, _ in books] + [int(book_ids.max(initial=0))]) + 1, position['other'])
+    for book_id, genre in books:
+        lookup[book_id] = position.get(genre, position['other'])
+    return lookup[book_ids]
+
+
+def _percentiles(values):
+    values = np.percentile(values, PERCENTILES) if len(values) else [0.0] * len(PERCENTILES)
+    return [{'percentile': p, 'value': round(float(value), 2)} for p, value in zip(PERCENTILES, values)]
+
+
+def compute(days=365, now=None, chunk_size=CHUNK_SIZE):
+    """Loan durations, fines, turnover and utilisation over the last ``days`` days.
+
+    Loans are pulled as plain numbers in chunks and every metric is a
+    vectorised NumPy expression, so the cost is the fetch, not Python. Fines
+    use the same whole-day rule as ``Borrow.fine_amount``, before payments.
+    Turnover and utilisation are per copy on the shelves today.
+    """
+    now = now or timezone.now()
+    start = now - timedelta(days=days)
+    t0, t1 = start.timestamp(), now.timestamp()
+    loans = _loans(start, chunk_size)
+    borrowed, due, returned = loans[:, 1], loans[:, 2], loans[:, 3]
+    genres = [genre for genre, _ in Book.GENRE_CHOICES]
+    codes = _genre_codes(loans[:, 4].astype(np.int64), genres)
+    copies = dict(Book.objects.order_by().values('genre').annotate(total=Sum('total_copies')).values_list('genre', 'total'))
+    copies = np.array([copies.get(genre) or 0 for genre in genres], dtype=np.float64)
+    ended = np.where(np.isnan(returned), t1, returned)
+
+    # Durations of the loans returned in the window, in days.
+    done = ~np.isnan(returned)
+    durations = (returned[done] - borrowed[done]) / DAY
+
+    # Fines on the loans that fell due in the window.
+    fell_due = (due >= t0) & (due < t1)
+    fines = np.floor(np.clip(ended[fell_due] - due[fell_due], 0, None) / DAY) * Borrow.FINE_PER_DAY
+    fined = fines[fines > 0]
+    band_counts, _ = np.histogram(fined, bins=[*FINE_BANDS, np.inf])
+
+    # Loans started per copy, and the share of copy-time spent on loan.
+    started = np.bincount(codes[borrowed >= t0], minlength=len(genres))
+    on_loan = np.clip(np.minimum(ended, t1) - np.maximum(borrowed, t0), 0, None)
+    loan_time = np.bincount(codes, weights=on_loan, minlength=len(genres))
+    window = t1 - t0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        turnover = np.where(copies > 0, started / copies, 0.0)
+        utilisation = np.where(copies > 0, loan_time / (copies * window), 0.0)
+
+    labels = dict(Book.GENRE_CHOICES)
+    done_codes = codes[done]
+    return {
+        'days': days,
+        'computed_at': now,
+        'loans': len(loans),
+        'duration': {
+            'loans': int(done.sum()),
+            'mean': round(float(durations.mean()), 2) if len(durations) else 0.0,
+            'percentiles': _percentiles(durations),
+        },
+        'fines': {
+            'loans': int(fell_due.sum()),
+            'fined': len(fined),
+            'total': int(fined.sum()),
+            'percentiles': _percentiles(fined),
+            'bands': [
+                {'low': low, 'high': high - 1 if high else None, 'loans': int(count)}
+                for low, high, count in zip(FINE_BANDS, [*FINE_BANDS[1:], None], band_counts)
+            ],
+        },
+        'utilisation': round(float(loan_time.sum() / (copies.sum() * window)), 4) if copies.sum() else 0.0,
+        'genres': [
+            {
+                'genre': genre,
+                'label': labels[genre],
+                'copies': int(copies[i]),
+                'loans': int(started[i]),
+                'turnover': round(float(turnover[i]), 2),
+                'utilisation': round(float(utilisation[i]), 4),
+                'median_duration': round(float(np.median(durations[done_codes == i])), 2) if (done_codes == i).any() else 0.0,
+            }
+            for i, genre in enumerate(genres)
+        ],
+    }
+
+
+def cache_key(days):
+    return f'analytics:loans:{days}'
+
+
+def _snapshot_name(days):
+    return f'loan_analytics:{days}'
+
+
+def refresh(days=DAY_OPTIONS, now=None, chunk_size=CHUNK_SIZE):
+    """Compute and publish the report for each window in ``days``; returns them in order."""
+    now = now or timezone.now()
+    reports = []
+    for window in days:
+        report = compute(window, now, chunk_size)
+        data = {key: value for key, value in report.items() if key != 'computed_at'}
+        ReportSnapshot.objects.update_or_create(name=_snapshot_name(window), defaults={'data': data, 'refreshed_at': now})
+        cache.set(cache_key(window), report, timeout=None)
+        reports.append(report)
+    return reports
+
+
+def loan_analytics(days=365):
+    """The published report for ``days``: from the cache, else the table, else None; never computed here."""
+    report = cache.get(cache_key(days))
+    if report is None:
+        snapshot = ReportSnapshot.objects.filter(name=_snapshot_name(days), refreshed_at__isnull=False).first()
+        if snapshot is None:
+            return None
+        report = {**snapshot.data, 'computed_at': snapshot.refreshed_at}
+        cache.set(cache_key(days), report, timeout=None)
+    return report
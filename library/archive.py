@@ -0,0 +1,75 @@
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .fines import overdue_days
+from .models import ArchivedBorrow, Borrow, FineLedgerEntry
+
+
+ARCHIVE_AFTER_DAYS = 365
+
+
+def archivable(now, older_than_days=ARCHIVE_AFTER_DAYS):
+    """Returned loans older than the cutoff whose fines are posted and settled.
+
+    Loans still owing (or with overdue days the ledger hasn't seen yet) stay
+    in Borrow so accrue_fines and pay_fine keep working on them.
+    """
+    balance = (
+        FineLedgerEntry.objects.filter(borrow=OuterRef('pk'))
+        .values('borrow').annotate(total=Sum('amount')).values('total')
+    )
+    return (
+        Borrow.objects.filter(returned=True, returned_at__lt=now - timedelta(days=older_than_days))
+        .annotate(owed=Coalesce(Subquery(balance), 0), due_days=overdue_days(now))
+        # fine_paid loans were settled before the ledger and never accrue.
+        .filter(Q(fine_paid=True) | Q(due_days__lte=F('fine_accrued_days')), owed=0)
+    )
+
+
+def _copy_to_archive(ids, now):
+    # Server-side copy: the rows never round-trip through Python.
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(field.column) for field in Borrow._meta.concrete_fields)
+    placeholders = ', '.join(['%s'] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote(ArchivedBorrow._meta.db_table)} ({columns}, {quote("archived_at")}) '
+            f'SELECT {columns}, %s FROM {quote(Borrow._meta.db_table)} WHERE id IN ({placeholders})',
+            [connection.ops.adapt_datetimefield_value(now), *ids],
+        )
+
+
+def archive_returned_loans(older_than_days=ARCHIVE_AFTER_DAYS, batch_size=1000, now=None):
+    """Move archivable loans to ArchivedBorrow, one transaction per batch.
+
+    Each batch is copied and deleted in the same transaction, so a loan is
+    always in exactly one of the two tables and an interrupted run can just
+    be started again. Returns the number of loans moved.
+    """
+    now = now or timezone.now()
+    moved = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                archivable(now, older_than_days)
+                .select_for_update(skip_locked=True, of=('self',))
+                .filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            _copy_to_archive(ids, now)
+            # Ledger and log rows point at loans without a constraint, so this
+            # is a single DELETE with no cascade.
+            Borrow.objects.filter(id__in=ids).delete()
+        moved += len(ids)
+        last_id = ids[-1]
+        if len(ids) < batch_size:
+            break
+    return moved
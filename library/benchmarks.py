@@ -0,0 +1,450 @@
+import random
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Count, F, Q
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from . import analytics, history, trending
+from .archive import archive_returned_loans
+from .fines import accrue_fines
+from .circulation import claim_book, claim_books
+from .models import ArchivedBorrow, Book, Borrow, BorrowHistory, Reader
+from .search import search_backend, search_books
+from .suggest import PrefixIndex
+from .testing import analyze_tables
+
+
+# Registry of benchmark name -> callable(rows, repeat) returning result rows.
+BENCHMARKS = {}
+
+WORDS = [
+    'river', 'shadow', 'garden', 'empire', 'silent', 'winter', 'golden', 'secret',
+    'ocean', 'forest', 'city', 'night', 'dream', 'storm', 'glass', 'iron',
+    'fire', 'stone', 'light', 'house', 'war', 'peace', 'journey', 'kingdom',
+    'memory', 'star', 'moon', 'island', 'letter', 'mirror', 'crown', 'road',
+]
+
+SURNAMES = [
+    'Smith', 'Johnson', 'Lee', 'Garcia', 'Brown', 'Patel', 'Nguyen', 'Kim',
+    'Shinde', 'Martin', 'Rossi', 'Muller', 'Silva', 'Tanaka', 'Novak', 'Ali',
+]
+
+
+class Rollback(Exception):
+    pass
+
+
+def register(name, rollback=True):
+    """Register a benchmark; ``rollback=False`` ones commit, so they get a throwaway database."""
+    def decorator(func):
+        func.rollback = rollback
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+def measure(func, repeat=5):
+    """Run ``func`` ``repeat`` times and return best/median wall time in ms."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {'best_ms': min(samples), 'median_ms': statistics.median(samples)}
+
+
+def seed_books(count, batch_size=5000, seed=42):
+    rng = random.Random(seed)
+    genres = [choice for choice, _ in Book.GENRE_CHOICES]
+    batch = []
+    for i in range(count):
+        title = ' '.join(rng.choice(WORDS).capitalize() for _ in range(rng.randint(2, 4)))
+        batch.append(Book(
+            title=f'{title} {i}',
+            author=f'{rng.choice(WORDS).capitalize()} {rng.choice(SURNAMES)}',
+            description=' '.join(rng.choice(WORDS) for _ in range(12)),
+            genre=rng.choice(genres),
+            available=rng.random() > 0.3,
+        ))
+        book = batch[-1]
+        book.total_copies = rng.choice([1, 1, 1, 2, 3, 5])
+        book.available_copies = book.total_copies if book.available else 0
+        if len(batch) >= batch_size:
+            Book.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        Book.objects.bulk_create(batch)
+
+
+def seed_circulation(users, borrows, batch_size=5000, seed=42):
+    """Create ``users`` users with readers and ``borrows`` loans over existing books.
+
+    Roughly one loan in ten is still active, and a third of those are overdue,
+    which mirrors a catalog that has been in service for a few years.
+    """
+    rng = random.Random(seed)
+    first_user = User.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    User.objects.bulk_create(
+        (User(username=f'reader{first_user + i}') for i in range(users)), batch_size=batch_size
+    )
+    user_ids = list(User.objects.filter(id__gt=first_user).values_list('id', flat=True))
+    Reader.objects.bulk_create(
+        (Reader(user_id=user_id, name=f'{rng.choice(WORDS).capitalize()} {rng.choice(SURNAMES)}',
+                contact='0000000000', reference_id=f'REF{user_id}', address='Seeded')
+         for user_id in user_ids),
+        batch_size=batch_size,
+    )
+    book_ids = list(Book.objects.values_list('id', flat=True))
+    now = timezone.now()
+    batch = []
+    for _ in range(borrows):
+        borrowed_at = now - timedelta(days=rng.randint(0, 3 * 365), minutes=rng.randint(0, 1440))
+        due_date = borrowed_at + timedelta(days=7)
+        returned = rng.random() > 0.1 or borrowed_at < now - timedelta(days=60)
+        batch.append(Borrow(
+            user_id=rng.choice(user_ids),
+            book_id=rng.choice(book_ids),
+            borrowed_at=borrowed_at,
+            due_date=due_date,
+            returned=returned,
+            returned_at=borrowed_at + timedelta(days=rng.randint(1, 14)) if returned else None,
+        ))
+        if len(batch) >= batch_size:
+            _create_loans(batch)
+            batch = []
+    if batch:
+        _create_loans(batch)
+    return user_ids
+
+
+def _create_loans(borrows):
+    # Loans plus their circulation log events, as the real paths would write them.
+    Borrow.objects.bulk_create(borrows)
+    events = []
+    for borrow in borrows:
+        events.append(history.event(borrow, BorrowHistory.BORROWED, borrow.borrowed_at))
+        if borrow.returned:
+            events.append(history.event(borrow, BorrowHistory.RETURNED, borrow.returned_at, return_date=borrow.returned_at))
+    BorrowHistory.objects.bulk_create(events)
+
+
+@contextmanager
+def throwaway_database():
+    """Point the default connection at a fresh test database and a private cache.
+
+    Committed rows also move rollups, facets, suggestions and the catalog
+    version, so nothing short of a separate database and cache leaves the
+    real ones untouched. Both are dropped on exit.
+    """
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'library-benchmark',
+        }}):
+            yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def run(name, rows, repeat=5):
+    """Run a registered benchmark inside a transaction that is rolled back."""
+    if not BENCHMARKS[name].rollback:
+        with throwaway_database():
+            return BENCHMARKS[name](rows=rows, repeat=repeat)
+    results = []
+    try:
+        with transaction.atomic():
+            results = BENCHMARKS[name](rows=rows, repeat=repeat)
+            raise Rollback
+    except Rollback:
+        pass
+    return results
+
+
+@register('search')
+def bench_search(rows, repeat):
+    seed_books(rows)
+    results = []
+    for term in ['river', 'golden empire', 'shin', '4242']:
+        icontains = measure(lambda: list(
+            Book.objects.filter(Q(title__icontains=term) | Q(author__icontains=term)).order_by('title')[:10]
+        ), repeat)
+        fulltext = measure(lambda: list(search_books(Book.objects.all(), term)[:10]), repeat)
+        results.append((f'icontains  q={term!r}', icontains))
+        results.append((f'{search_backend():<10} q={term!r}', fulltext))
+    return results
+
+
+@register('suggest')
+def bench_suggest(rows, repeat):
+    seed_books(rows)
+    index = PrefixIndex()
+    load = measure(lambda: index.load(Book.objects.values_list('id', 'title', 'author').iterator(chunk_size=5000)), 1)
+    results = [('load prefix index', load)]
+    for prefix in ['r', 'gold', 'silent wi', 'smi']:
+        results.append((f'suggest q={prefix!r}', measure(lambda: index.suggest(prefix), repeat)))
+    return results
+
+
+@register('fines')
+def bench_fines(rows, repeat):
+    """Outstanding fine total and per-user top 10, Python properties vs ledger balances in SQL."""
+    seed_books(max(rows // 10, 100))
+    seed_circulation(max(rows // 50, 10), rows)
+    # Leave a fifth of the loans open so there is something to fine.
+    first = Borrow.objects.order_by('id').values_list('id', flat=True).first()
+    Borrow.objects.filter(id__lt=first + rows // 5).update(returned=False, returned_at=None)
+    overdue = Borrow.objects.filter(returned=False, due_date__lt=timezone.now())
+    accrue_fines()
+
+    def python_totals():
+        per_user = {}
+        for borrow in overdue:
+            if not borrow.fine_paid and borrow.fine_amount > 0:
+                per_user[borrow.user_id] = per_user.get(borrow.user_id, 0) + borrow.fine_amount
+        return sum(per_user.values()), sorted(per_user.items(), key=lambda item: -item[1])[:10]
+
+    def sql_totals():
+        return Borrow.objects.fine_totals()['total'], list(Borrow.objects.fines_by_user()[:10])
+
+    return [
+        (f'python properties ({overdue.count()} overdue)', measure(python_totals, repeat)),
+        ('ledger balance aggregates', measure(sql_totals, repeat)),
+    ]
+
+
+@register('archive')
+def bench_archive(rows, repeat):
+    """Active-loan queries with every loan in Borrow vs after archiving old returns."""
+    seed_books(max(rows // 10, 100))
+    seed_circulation(max(rows // 50, 10), rows)
+    # Seeded late returns have no ledger rows; treat their fines as settled.
+    Borrow.objects.filter(returned=True).update(fine_accrued_days=14)
+    now = timezone.now()
+    user_id = Borrow.objects.filter(returned=False).values_list('user_id', flat=True).first()
+    book_ids = list(Borrow.objects.filter(returned=False).values_list('book_id', flat=True)[:20])
+    queries = [
+        ("a reader's active loans", lambda: list(Borrow.objects.filter(user_id=user_id, returned=False).select_related('book'))),
+        ('overdue list, top 50 by fine', lambda: list(Borrow.objects.overdue(now).with_fines(now).order_by('-fine_amount', 'id')[:50])),
+        ('loans out, total', lambda: Borrow.objects.filter(returned=False).count()),
+        ('copies out for 20 books', lambda: list(
+            Borrow.objects.filter(book_id__in=book_ids, returned=False).values('book_id').annotate(n=Count('id'))
+        )),
+        ("a reader's full history", lambda: Borrow.all_loans.history(user_id=user_id)),
+    ]
+    results = []
+    for phase in ('before', 'after'):
+        if phase == 'after':
+            moved = measure(lambda: archive_returned_loans(older_than_days=30, now=now), 1)
+            hot = Borrow.objects.count()
+            results.append((f'archive_returned_loans ({hot} rows left hot)', moved))
+        analyze_tables()
+        for label, query in queries:
+            results.append((f'{phase}: {label}', measure(query, repeat)))
+    return results
+
+
+def _linear_percentile(ordered, p):
+    if not ordered:
+        return 0.0
+    k = (len(ordered) - 1) * p / 100
+    low = int(k)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (k - low)
+
+
+def python_loan_analytics(days=365, now=None):
+    """``analytics.compute()`` the plain way: Borrow objects and Python loops."""
+    now = now or timezone.now()
+    start = now - timedelta(days=days)
+    window = (now - start).total_seconds()
+    copies = {}
+    for book in Book.objects.all():
+        copies[book.genre] = copies.get(book.genre, 0) + book.total_copies
+    durations, fines = [], []
+    fell_due = 0
+    started, loan_time = {}, {}
+    for model in (Borrow, ArchivedBorrow):
+        for loan in model.objects.filter(Q(returned=False) | Q(returned_at__gte=start)).select_related('book'):
+            ended = loan.returned_at or now
+            genre = loan.book.genre
+            if loan.returned_at:
+                durations.append((loan.returned_at - loan.borrowed_at).total_seconds() / 86400)
+            if loan.due_date and start <= loan.due_date < now:
+                fell_due += 1
+                if ended > loan.due_date:
+                    fines.append((ended - loan.due_date).days * Borrow.FINE_PER_DAY)
+            if loan.borrowed_at >= start:
+                started[genre] = started.get(genre, 0) + 1
+            overlap = (min(ended, now) - max(loan.borrowed_at, start)).total_seconds()
+            loan_time[genre] = loan_time.get(genre, 0) + max(overlap, 0)
+    fines = sorted(fine for fine in fines if fine > 0)
+    durations.sort()
+    return {
+        'duration': {
+            'loans': len(durations),
+            'mean': round(statistics.fmean(durations), 2) if durations else 0.0,
+            'percentiles': [
+                {'percentile': p, 'value': round(_linear_percentile(durations, p), 2)} for p in analytics.PERCENTILES
+            ],
+        },
+        'fines': {'loans': fell_due, 'fined': len(fines), 'total': sum(fines)},
+        'genres': {
+            genre: (started.get(genre, 0), round(loan_time.get(genre, 0) / (copies[genre] * window), 4) if copies.get(genre) else 0.0)
+            for genre, _ in Book.GENRE_CHOICES
+        },
+    }
+
+
+@register('analytics')
+def bench_analytics(rows, repeat):
+    """Loan analytics over a year, Python loops over Borrow objects vs NumPy arrays."""
+    seed_books(max(rows // 10, 100))
+    seed_circulation(max(rows // 50, 10), rows)
+    now = timezone.now()
+    report = analytics.compute(now=now)
+    return [
+        (f"python loops ({report['loans']} loans)", measure(lambda: python_loan_analytics(now=now), max(repeat // 2, 1))),
+        ('numpy, 50k-row chunks', measure(lambda: analytics.compute(now=now), repeat)),
+        ('numpy, 5k-row chunks', measure(lambda: analytics.compute(now=now, chunk_size=5000), repeat)),
+    ]
+
+
+@register('trending')
+def bench_trending(rows, repeat):
+    """Top books per window: GROUP BY over Borrow vs merged Space-Saving sketches."""
+    seed_books(max(rows // 10, 100))
+    user_ids = seed_circulation(max(rows // 50, 10), rows)
+    now = timezone.now()
+    # A handful of books borrowed far more than the rest, as a real trend.
+    rng = random.Random(7)
+    hot = list(Book.objects.order_by('?').values_list('id', flat=True)[:20])
+    Borrow.objects.bulk_create(
+        Borrow(user_id=rng.choice(user_ids), book_id=book_id, borrowed_at=now - timedelta(hours=rng.uniform(1, 24 * 30)), returned=True)
+        for rank, book_id in enumerate(hot) for _ in range(60 - 2 * rank)
+    )
+
+    def exact():
+        return {
+            name: {
+                book_id for book_id, _ in Borrow.objects.filter(borrowed_at__gt=now - span).values('book_id')
+                .annotate(total=Count('id')).order_by('-total', 'book_id').values_list('book_id', 'total')[:trending.TOP_K]
+            }
+            for name, _, _, span in trending.WINDOWS
+        }
+
+    group_by = measure(exact, repeat)
+    rebuild = measure(lambda: trending.refresh_trending(rebuild=True, now=now), 1)
+    refresh = measure(lambda: trending.refresh_trending(now=now), repeat)
+    approximate = {window['window']: {book['id'] for book in window['books']} for window in trending.get_trending()['data']}
+    recall = ', '.join(f'{name} {len(top & approximate.get(name, set()))}/{len(top)}' for name, top in exact().items())
+    return [
+        ('GROUP BY per window', group_by),
+        (f'rebuild sketches from Borrow (top-{trending.TOP_K} found: {recall})', rebuild),
+        ('incremental refresh, no new borrows', refresh),
+        ('get_trending (cached)', measure(trending.get_trending, repeat)),
+    ]
+
+
+def legacy_borrow(user, book):
+    """The original borrow_book logic: read, check, then write, with no lock."""
+    book = Book.objects.get(id=book.id)
+    if not book.available:
+        return None
+    borrow = Borrow.objects.create(user=user, book=book, due_date=timezone.now() + timedelta(days=7))
+    book.available = False
+    book.save()
+    return borrow
+
+
+def fire_concurrent_borrows(book, users, borrow=claim_book):
+    """Load generator: every user tries to borrow ``book`` at the same instant.
+
+    Returns successes, errors and wall time. Needs committed rows, since each
+    thread runs on its own database connection.
+    """
+    barrier = threading.Barrier(len(users))
+    successes, errors = [], []
+
+    def worker(user):
+        try:
+            barrier.wait()
+            if borrow(user, book) is not None:
+                successes.append(user.id)
+        except Exception as error:
+            errors.append(error)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker, args=(user,)) for user in users]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {'successes': successes, 'errors': errors, 'elapsed': time.perf_counter() - start}
+
+
+@register('borrow')
+def bench_borrow(rows, repeat):
+    """Sequential cost of one borrow, old path vs conditional-UPDATE path."""
+    rows = min(rows, 2000)
+    seed_books(rows * 2)
+    Book.objects.update(available=True, available_copies=F('total_copies'))
+    user = User.objects.create(username='bench-borrower')
+    books = iter(Book.objects.filter(available=True))
+    legacy = measure(lambda: [legacy_borrow(user, next(books)) for _ in range(rows // repeat)], repeat)
+    claim = measure(lambda: [claim_book(user, next(books)) for _ in range(rows // repeat)], repeat)
+    per_call = rows // repeat
+    return [
+        (f'legacy borrow x{per_call}', legacy),
+        (f'claim_book x{per_call}', claim),
+    ]
+
+
+def legacy_checkout(user, book_ids):
+    """The old My Bag checkout: one INSERT and one UPDATE per book, no transaction."""
+    due_date = timezone.now() + timedelta(days=7)
+    for book in Book.objects.filter(id__in=book_ids, available=True):
+        Borrow.objects.create(user=user, book=book, borrowed_at=timezone.now(), due_date=due_date)
+        book.available = False
+        book.save()
+
+
+@register('checkout')
+def bench_checkout(rows, repeat):
+    """Checkout cost by bag size, per-book loop vs one batch claim."""
+    sizes = [1, 5, 20, 50]
+    seed_books(sum(sizes) * repeat * 2)
+    Book.objects.update(available=True, available_copies=F('total_copies'))
+    user = User.objects.create(username='bench-checkout')
+    books = iter(Book.objects.values_list('id', flat=True))
+    results = []
+    for size in sizes:
+        for label, checkout in (('legacy checkout', legacy_checkout), ('claim_books', claim_books)):
+            timing = measure(lambda: checkout(user, [next(books) for _ in range(size)]), repeat)
+            results.append((f'{label}, bag of {size}', timing))
+    return results
+
+
+@register('borrow-race', rollback=False)
+def bench_borrow_race(rows, repeat):
+    """Concurrent borrows of one book; commits, so it runs in a throwaway database."""
+    workers = min(rows, 200)
+    users = User.objects.bulk_create(User(username=f'bench-racer-{i}') for i in range(workers))
+    results = []
+    for label, borrow in (('legacy borrow', legacy_borrow), ('claim_book', claim_book)):
+        book = Book.objects.create(title=f'Race {label}', author='Bench')
+        outcome = fire_concurrent_borrows(book, users, borrow)
+        elapsed_ms = outcome['elapsed'] * 1000
+        label = (f"{label}: {len(outcome['successes'])} won, {len(outcome['errors'])} errors, "
+                 f"{workers / outcome['elapsed']:.0f} req/s")
+        results.append((label, {'best_ms': elapsed_ms, 'median_ms': elapsed_ms}))
+    return results
@@ -0,0 +1,75 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.core.paginator import Page, Paginator
+from django.db import transaction
+from django.utils.http import urlencode
+
+
+# Monotonic catalog version: bumped after every committed Book change, so any
+# key that embeds it goes stale at once and is never served again.
+VERSION_KEY = 'catalog:version'
+MODIFIED_KEY = 'catalog:modified'
+PAGE_TIMEOUT = 300
+
+# GET parameters that change what book_list shows.
+PAGE_PARAMS = ('q', 'genre', 'available', 'page', 'cursor')
+
+
+def get_version():
+    """Return ``(version, last_modified_timestamp)`` for the catalog."""
+    values = cache.get_many([VERSION_KEY, MODIFIED_KEY])
+    if VERSION_KEY not in values or MODIFIED_KEY not in values:
+        # Seed from the clock so a flushed cache never reuses an old version.
+        now = time.time()
+        cache.add(VERSION_KEY, int(now * 1000), timeout=None)
+        cache.add(MODIFIED_KEY, now, timeout=None)
+        values = cache.get_many([VERSION_KEY, MODIFIED_KEY])
+    return values[VERSION_KEY], values[MODIFIED_KEY]
+
+
+def _bump():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, int(time.time() * 1000), timeout=None)
+    cache.set(MODIFIED_KEY, time.time(), timeout=None)
+
+
+def bump_version():
+    transaction.on_commit(_bump)
+
+
+def _params_digest(params):
+    selected = sorted((name, params.get(name, '')) for name in PAGE_PARAMS)
+    return hashlib.md5(urlencode(selected).encode()).hexdigest()
+
+
+def page_key(kind, version, params):
+    return f'catalog:{kind}:{version}:{_params_digest(params)}'
+
+
+def page_etag(version, params):
+    return f'"{version}-{_params_digest(params)}"'
+
+
+def freeze_page(page):
+    """Make a book_list page object cheap to pickle.
+
+    A Paginator page keeps its queryset around, which would be evaluated in
+    full on pickling; swap it for the page's rows plus a row-count stand-in.
+    """
+    if isinstance(page, Page):
+        paginator = Paginator(range(page.paginator.count), page.paginator.per_page)
+        return Page(list(page.object_list), page.number, paginator)
+    return page
+
+
+def get_or_build(kind, version, params, build):
+    key = page_key(kind, version, params)
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.set(key, value, PAGE_TIMEOUT)
+    return value
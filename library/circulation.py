@@ -0,0 +1,350 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, F, Q, When, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from . import catalog_cache, facets, history, metrics, outbox, rollups
+from .models import Book, Borrow, BorrowHistory, Hold
+
+
+LOAN_DAYS = 7
+HOLD_PICKUP_DAYS = 3
+MAX_RENEWALS = 2
+
+
+def _update_returning_supported():
+    # MySQL/MariaDB have no UPDATE ... RETURNING; SQLite needs 3.35+.
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 35)
+    return False
+
+
+def _books_from_rows(fields, rows):
+    # Same value conversion the ORM applies to fetched rows (e.g. SQLite booleans).
+    converters = []
+    for field in fields:
+        col = field.get_col(Book._meta.db_table)
+        converters.append(connection.ops.get_db_converters(col) + col.get_db_converters(connection))
+    names = [field.attname for field in fields]
+    books = []
+    for row in rows:
+        values = []
+        for field, field_converters, value in zip(fields, converters, row):
+            for converter in field_converters:
+                value = converter(value, field, connection)
+            values.append(value)
+        books.append(Book.from_db(connection.alias, names, values))
+    return books
+
+
+def _move_copies(book_ids, delta):
+    """Take (``delta=-1``) or put back (``delta=1``) one copy of each book.
+
+    One conditional UPDATE per call: books with no copy left to take, or no
+    copy out to put back, are skipped. Returns the Book rows that moved, as
+    they are after the update. Must run inside a transaction.
+    """
+    if _update_returning_supported():
+        fields = Book._meta.concrete_fields
+        table = connection.ops.quote_name(Book._meta.db_table)
+        columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+        placeholders = ', '.join(['%s'] * len(book_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {table} SET available = (available_copies + %s > 0), '
+                f'available_copies = available_copies + %s '
+                f'WHERE id IN ({placeholders}) '
+                f'AND available_copies + %s >= 0 AND available_copies + %s <= total_copies '
+                f'RETURNING {columns}',
+                [delta, delta, *book_ids, delta, delta],
+            )
+            return _books_from_rows(fields, cursor.fetchall())
+
+    room = {'available_copies__gt': 0} if delta < 0 else {'available_copies__lt': F('total_copies')}
+    books = list(Book.objects.select_for_update().filter(id__in=book_ids, **room))
+    if books:
+        # ``available`` first: MySQL evaluates assignments left to right.
+        Book.objects.filter(id__in=[book.id for book in books]).update(
+            available=Case(When(available_copies__gt=-delta, then=True), default=False),
+            available_copies=F('available_copies') + delta,
+        )
+        for book in books:
+            book.available_copies += delta
+            book.available = book.available_copies > 0
+            book._loaded_copies = book._copies_state()
+    return books
+
+
+def _record_flips(books, now_available):
+    """Adjust facet counts for books whose ``available`` flag just changed.
+
+    The raw UPDATEs send no signals, so the derived catalog state is kept in
+    step here.
+    """
+    books = list(books)
+    # After a take the flag flipped if no copy is left; after a put-back, if
+    # this is the only copy on the shelf.
+    flipped = Counter(book.genre for book in books if book.available_copies == int(now_available))
+    facets.record_changes(*[
+        change
+        for genre, total in flipped.items()
+        for change in (((genre, not now_available), -total), ((genre, now_available), total))
+    ])
+    if books:
+        catalog_cache.bump_version()
+        metrics.invalidate()
+
+
+def _lock_books(book_ids):
+    """Serialize changes to these books' hold queues until the transaction ends."""
+    list(Book.objects.select_for_update().filter(id__in=book_ids).values_list('id', flat=True))
+
+
+def _hand_over(freed, now):
+    """Give freed copies to the oldest waiting holds and shelve the rest.
+
+    ``freed`` maps book id -> copies just freed. One windowed query on the
+    partial queue index finds the heads of every book's queue; the caller
+    must hold the book rows (``_lock_books``). Returns the holds made ready.
+    """
+    freed = Counter(freed)
+    ready = []
+    if freed:
+        position = Window(RowNumber(), partition_by=[F('book_id')], order_by=[F('created_at').asc(), F('id').asc()])
+        heads = (
+            Hold.objects.filter(book_id__in=list(freed), status=Hold.WAITING)
+            .annotate(position=position)
+            .filter(position__lte=max(freed.values()))
+            .select_related('user', 'book')
+        )
+        ready = [hold for hold in heads if hold.position <= freed[hold.book_id]]
+
+    if ready:
+        expires_at = now + timedelta(days=HOLD_PICKUP_DAYS)
+        Hold.objects.filter(id__in=[hold.id for hold in ready]).update(
+            status=Hold.READY, ready_at=now, expires_at=expires_at,
+        )
+        for hold in ready:
+            hold.status, hold.ready_at, hold.expires_at = Hold.READY, now, expires_at
+        # Delivered in batches by run_mail_worker once this commits.
+        outbox.enqueue_many(
+            (
+                f"Ready for pickup: {hold.book.title}",
+                f"Hi {hold.user.username},\n\nA copy of '{hold.book.title}' is waiting for you. "
+                f"Borrow it by {expires_at.strftime('%Y-%m-%d')} or it will go to the next reader.\n\nThank you!",
+                [hold.user.email],
+            )
+            for hold in ready
+        )
+        freed.subtract(hold.book_id for hold in ready)
+
+    shelved = []
+    freed = +freed
+    while freed:
+        moved = _move_copies(list(freed), 1)
+        shelved.extend(moved)
+        # Books already full can't take a copy back; stop trying them.
+        freed = Counter({book.id: freed[book.id] - 1 for book in moved})
+        freed = +freed
+    _record_flips(shelved, True)
+    return ready
+
+
+def _collect_ready_holds(user, book_ids):
+    """Mark ``user``'s ready holds on these books collected; returns their book ids."""
+    book_ids = set(
+        Hold.objects.select_for_update()
+        .filter(user=user, book_id__in=book_ids, status=Hold.READY)
+        .values_list('book_id', flat=True)
+    )
+    if book_ids:
+        Hold.objects.filter(user=user, book_id__in=book_ids, status=Hold.READY).update(status=Hold.COLLECTED)
+    return book_ids
+
+
+def claim_book(user, book, days=LOAN_DAYS):
+    """Borrow one copy of ``book`` for ``user`` if one is still on the shelf.
+
+    The availability check and the decrement are one conditional UPDATE, so
+    concurrent callers can never take more copies than exist; the losers get
+    ``None`` and nothing is written. A copy held for ``user`` is theirs
+    whatever the shelf says.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        if _collect_ready_holds(user, [book.id]):
+            borrow = Borrow.objects.create(user=user, book=book, borrowed_at=now, due_date=now + timedelta(days=days))
+            history.record([borrow], BorrowHistory.BORROWED, now)
+            rollups.loans_borrowed([borrow], now)
+            return borrow
+        moved = _move_copies([book.id], -1)
+        if not moved:
+            return None
+        borrow = Borrow.objects.create(user=user, book=book, borrowed_at=now, due_date=now + timedelta(days=days))
+        history.record([borrow], BorrowHistory.BORROWED, now)
+        rollups.loans_borrowed([borrow], now)
+        _record_flips(moved, False)
+
+    book.available, book.available_copies = moved[0].available, moved[0].available_copies
+    return borrow
+
+
+def claim_books(user, book_ids, days=LOAN_DAYS):
+    """Borrow one copy of every book in ``book_ids`` that has one, as one batch.
+
+    One UPDATE claims the copies and one bulk INSERT creates the loans, so the
+    cost barely moves with the number of books and a failure leaves nothing
+    half-borrowed. Returns ``(borrows, unavailable)``: the new Borrow rows and
+    the requested Book objects that could not be claimed (books that no
+    longer exist are left out).
+    """
+    book_ids = list(dict.fromkeys(int(book_id) for book_id in book_ids))
+    if not book_ids:
+        return [], []
+
+    now = timezone.now()
+    due_date = now + timedelta(days=days)
+    with transaction.atomic():
+        held = _collect_ready_holds(user, book_ids)
+        wanted = [book_id for book_id in book_ids if book_id not in held]
+        moved = _move_copies(wanted, -1) if wanted else []
+        claimed = {book.id: book for book in moved}
+        borrows = Borrow.objects.bulk_create(
+            Borrow(user=user, book_id=book_id, borrowed_at=now, due_date=due_date)
+            for book_id in book_ids if book_id in claimed or book_id in held
+        )
+        history.record(borrows, BorrowHistory.BORROWED, now)
+        rollups.loans_borrowed(borrows, now)
+        _record_flips(moved, False)
+
+    if held:
+        books = Book.objects.in_bulk(held)
+        claimed.update((book_id, books[book_id]) for book_id in held)
+    for borrow in borrows:
+        borrow.book = claimed[borrow.book_id]
+
+    missed = [book_id for book_id in book_ids if book_id not in claimed]
+    unavailable = list(Book.objects.filter(id__in=missed).order_by('title')) if missed else []
+    return borrows, unavailable
+
+
+def return_borrow(borrow):
+    """Close ``borrow`` and pass its copy to the next hold, or the shelf.
+
+    Returns False if the loan was already closed (e.g. a double-submitted
+    form), in which case nothing changes.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        # Book before loan, the same order as renew_borrow, so the two can't deadlock.
+        _lock_books([borrow.book_id])
+        closed = Borrow.objects.filter(id=borrow.id, returned=False).update(returned=True, returned_at=now)
+        if not closed:
+            return False
+        history.record([borrow], BorrowHistory.RETURNED, now, return_date=now)
+        rollups.loan_returned(borrow, now)
+        _hand_over({borrow.book_id: 1}, now)
+
+    borrow.returned, borrow.returned_at = True, now
+    return True
+
+
+def renew_borrow(borrow, days=LOAN_DAYS):
+    """Push ``borrow``'s due date back by ``days``.
+
+    Refused (returns False) once the loan is overdue or has been renewed
+    ``MAX_RENEWALS`` times, or while readers are waiting for the book.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        _lock_books([borrow.book_id])
+        if Hold.objects.filter(book_id=borrow.book_id, status=Hold.WAITING).exists():
+            return False
+        # Re-read under the book lock: a concurrent renewal may have moved it.
+        due_date = Borrow.objects.filter(id=borrow.id, returned=False, due_date__gte=now).values_list('due_date', flat=True).first()
+        if due_date is None:
+            return False
+        renewals = BorrowHistory.objects.filter(borrow_id=borrow.id, status=BorrowHistory.RENEWED).count()
+        if renewals >= MAX_RENEWALS:
+            return False
+        borrow.due_date = due_date + timedelta(days=days)
+        Borrow.objects.filter(id=borrow.id).update(due_date=borrow.due_date)
+        history.record([borrow], BorrowHistory.RENEWED, now)
+        rollups.loan_renewed(borrow, due_date)
+    return True
+
+
+def place_hold(user, book):
+    """Join the end of ``book``'s waiting list.
+
+    Returns ``(hold, created)``; ``hold`` is None when a copy is on the
+    shelf, since there is nothing to wait for.
+    """
+    with transaction.atomic():
+        _lock_books([book.id])
+        existing = Hold.objects.filter(user=user, book=book, status__in=Hold.ACTIVE).first()
+        if existing:
+            return existing, False
+        if Book.objects.filter(id=book.id, available_copies__gt=0).exists():
+            return None, False
+        try:
+            with transaction.atomic():
+                return Hold.objects.create(user=user, book=book), True
+        except IntegrityError:
+            return Hold.objects.get(user=user, book=book, status__in=Hold.ACTIVE), False
+
+
+def queue_position(hold):
+    """1-based place of a waiting hold in its book's queue."""
+    ahead = Hold.objects.filter(book_id=hold.book_id, status=Hold.WAITING).filter(
+        Q(created_at__lt=hold.created_at) | Q(created_at=hold.created_at, id__lt=hold.id)
+    )
+    return ahead.count() + 1
+
+
+def release_hold(hold, status=Hold.CANCELLED):
+    """Cancel (or expire) ``hold``; a copy it was keeping moves on."""
+    now = timezone.now()
+    with transaction.atomic():
+        _lock_books([hold.book_id])
+        previous = Hold.objects.filter(id=hold.id, status__in=Hold.ACTIVE).values_list('status', flat=True).first()
+        if previous is None:
+            return False
+        Hold.objects.filter(id=hold.id).update(status=status)
+        if previous == Hold.READY:
+            _hand_over({hold.book_id: 1}, now)
+    hold.status = status
+    return True
+
+
+def expire_holds(batch_size=500, now=None):
+    """Expire ready holds past their pickup date, one batch per transaction.
+
+    Each batch's copies go to the next waiting holds (or the shelf) in the
+    same transaction. Returns ``(expired, handed_on)`` counts.
+    """
+    now = now or timezone.now()
+    expired = handed_on = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                Hold.objects.select_for_update(skip_locked=True)
+                .filter(status=Hold.READY, expires_at__lte=now)
+                .order_by('expires_at', 'id')
+                .values_list('id', 'book_id')[:batch_size]
+            )
+            if not batch:
+                break
+            freed = Counter(book_id for _, book_id in batch)
+            _lock_books(list(freed))
+            Hold.objects.filter(id__in=[hold_id for hold_id, _ in batch]).update(status=Hold.EXPIRED)
+            handed_on += len(_hand_over(freed, now))
+        expired += len(batch)
+        if len(batch) < batch_size:
+            break
+    return expired, handed_on
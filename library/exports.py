@@ -0,0 +1,39 @@
+import csv
+
+from django.http import StreamingHttpResponse
+
+
+# Rows are written to the response in chunks of this many lines.
+CHUNK_ROWS = 500
+
+
+class Echo:
+    """File-like object whose write() hands the CSV line straight back."""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(header, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    chunk = []
+    for row in rows:
+        chunk.append(writer.writerow(row))
+        if len(chunk) >= CHUNK_ROWS:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def csv_response(filename, header, rows):
+    """Stream ``rows`` as a CSV attachment without buffering the whole file.
+
+    ``rows`` should be a lazy iterable such as
+    ``queryset.values_list(...).iterator(chunk_size=...)`` so memory stays
+    flat no matter how many rows are exported.
+    """
+    response = StreamingHttpResponse(stream_csv(header, rows), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
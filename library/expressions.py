@@ -0,0 +1,75 @@
+import datetime
+
+from django.db.models import BigIntegerField, Func, IntegerField
+from django.utils import timezone
+
+
+class DaysBetween(Func):
+    """Whole days from ``start`` to ``end``, rounded down like ``timedelta.days``.
+
+    Only meant for ``end >= start``. Each backend gets native, exact integer
+    arithmetic; Django's generic datetime subtraction goes through a Python
+    function per row on SQLite.
+    """
+    arity = 2
+    output_field = IntegerField()
+
+    def __init__(self, start, end, **extra):
+        super().__init__(start, end, **extra)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        # Native interval types (PostgreSQL, Oracle): ``end - start``.
+        swapped = self.copy()
+        swapped.set_source_expressions(self.get_source_expressions()[::-1])
+        return super(DaysBetween, swapped).as_sql(
+            compiler, connection, arg_joiner=' - ',
+            template='CAST(EXTRACT(DAY FROM (%(expressions)s)) AS integer)',
+            **extra_context,
+        )
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, function='TIMESTAMPDIFF', template='%(function)s(DAY, %(expressions)s)', **extra_context)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # Datetimes are 'YYYY-MM-DD HH:MM:SS[.ffffff]' text in UTC: whole
+        # seconds from strftime('%s'), microseconds from the fraction.
+        parts = []
+        for expression in self.get_source_expressions():
+            if isinstance(getattr(expression, 'value', None), datetime.datetime):
+                # A constant (usually "now"): convert it once, not per row.
+                parts.append(('%s', [_epoch_microseconds(expression.value)]))
+                continue
+            value_sql, value_params = compiler.compile(expression)
+            parts.append((
+                f"(CAST(strftime('%%s', {value_sql}) AS INTEGER) * 1000000"
+                f" + CAST(substr({value_sql}, 21, 6) AS INTEGER))",
+                [*value_params, *value_params],
+            ))
+        (start_sql, start_params), (end_sql, end_params) = parts
+        return f'(({end_sql} - {start_sql}) / 86400000000)', [*end_params, *start_params]
+
+
+class EpochSeconds(Func):
+    """Whole seconds from 1970-01-01 UTC, so datetimes are fetched as plain integers."""
+    arity = 1
+    output_field = BigIntegerField()
+
+    def as_sql(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, template='CAST(EXTRACT(EPOCH FROM %(expressions)s) AS bigint)', **extra_context)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        # Not UNIX_TIMESTAMP(), which reads the column in the session time zone.
+        return super().as_sql(
+            compiler, connection, template="TIMESTAMPDIFF(SECOND, '1970-01-01 00:00:00', %(expressions)s)", **extra_context,
+        )
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        value_sql, value_params = compiler.compile(self.get_source_expressions()[0])
+        return f"CAST(strftime('%%s', {value_sql}) AS INTEGER)", value_params
+
+
+def _epoch_microseconds(value):
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value, datetime.timezone.utc)
+    delta = value - datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
@@ -0,0 +1,97 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+
+from .models import Book
+
+
+# One integer counter per (genre, available) cell, plus a marker that says the
+# full matrix has been built. Counters only ever move by +1/-1 after that.
+KEY_PREFIX = 'facets'
+READY_KEY = f'{KEY_PREFIX}:ready'
+
+
+def counter_key(genre, available):
+    return f'{KEY_PREFIX}:{genre}:{int(bool(available))}'
+
+
+def all_keys():
+    return [counter_key(genre, available) for genre, _ in Book.GENRE_CHOICES for available in (True, False)]
+
+
+def rebuild_facet_counts():
+    """Recompute every counter with one GROUP BY; used on a cold cache or drift."""
+    counts = {key: 0 for key in all_keys()}
+    rows = Book.objects.order_by().values('genre', 'available').annotate(total=Count('id'))
+    for row in rows:
+        counts[counter_key(row['genre'], row['available'])] = row['total']
+    cache.set_many(counts, timeout=None)
+    cache.set(READY_KEY, True, timeout=None)
+    return counts
+
+
+def get_facet_counts():
+    """Return ``{(genre, available): count}`` from the cache."""
+    keys = all_keys()
+    values = cache.get_many(keys + [READY_KEY])
+    if READY_KEY not in values or any(key not in values for key in keys):
+        values = rebuild_facet_counts()
+    return {
+        (genre, available): values[counter_key(genre, available)]
+        for genre, _ in Book.GENRE_CHOICES
+        for available in (True, False)
+    }
+
+
+def summarize(counts, genre='', availability=''):
+    """Per-genre and per-availability totals, each narrowed by the other filter."""
+    wanted = {'available': [True], 'unavailable': [False]}.get(availability, [True, False])
+    genre_counts = {}
+    for (book_genre, available), total in counts.items():
+        if available in wanted:
+            genre_counts[book_genre] = genre_counts.get(book_genre, 0) + total
+    availability_counts = {
+        'available': sum(total for (g, available), total in counts.items() if available and genre in ('', g)),
+        'unavailable': sum(total for (g, available), total in counts.items() if not available and genre in ('', g)),
+    }
+    return genre_counts, availability_counts
+
+
+def invalidate():
+    cache.delete(READY_KEY)
+
+
+def _apply(changes):
+    if cache.get(READY_KEY) is None:
+        return
+    for (genre, available), delta in changes:
+        key = counter_key(genre, available)
+        try:
+            if delta > 0:
+                cache.incr(key, delta)
+            else:
+                cache.decr(key, -delta)
+        except ValueError:
+            # Counter evicted; the next read rebuilds the whole matrix.
+            invalidate()
+            return
+
+
+def record_changes(*changes):
+    """Queue ``((genre, available), delta)`` adjustments until commit."""
+    changes = [change for change in changes if change[1]]
+    if changes:
+        transaction.on_commit(lambda: _apply(changes))
+
+
+def book_added(genre, available):
+    record_changes(((genre, available), 1))
+
+
+def book_removed(genre, available):
+    record_changes(((genre, available), -1))
+
+
+def book_changed(old_genre, old_available, genre, available):
+    if (old_genre, bool(old_available)) != (genre, bool(available)):
+        record_changes(((old_genre, old_available), -1), ((genre, available), 1))
@@ -0,0 +1,127 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, DateTimeField, F, IntegerField, Q, Sum, Value, When
+from django.utils import timezone
+
+from . import history
+from .expressions import DaysBetween
+from .models import Borrow, BorrowHistory, FineAccrualRun, FineLedgerEntry
+
+
+# Re-scan loans returned this long before the last run's start, so a return
+# that committed while that run was reading is not missed.
+WATERMARK_OVERLAP = timedelta(hours=1)
+
+
+def last_watermark():
+    run = FineAccrualRun.objects.order_by('-started_at').first()
+    return run.started_at - WATERMARK_OVERLAP if run else None
+
+
+def overdue_days(now):
+    """Days each loan has been overdue as of ``now``, or up to its return."""
+    return Case(
+        When(returned=False, then=DaysBetween(F('due_date'), Value(now, output_field=DateTimeField()))),
+        When(returned_at__gt=F('due_date'), then=DaysBetween(F('due_date'), F('returned_at'))),
+        default=0,
+        output_field=IntegerField(),
+    )
+
+
+def _accruable(now, watermark, borrow_ids=None):
+    """Loans with overdue days not yet posted to the ledger, as of ``now``.
+
+    Open loans keep accruing, so every overdue one is a candidate; a returned
+    loan only changes once, so only those returned since ``watermark`` are.
+    Loans flagged ``fine_paid`` were settled before the ledger and never
+    accrue; returns from before it were marked posted by migration 0027.
+    """
+    changed = Q(returned=False, due_date__lte=now - timedelta(days=1))
+    if watermark is None:
+        changed |= Q(returned=True, returned_at__isnull=False, due_date__isnull=False)
+    else:
+        changed |= Q(returned=True, returned_at__gte=watermark, due_date__isnull=False)
+    borrows = Borrow.objects.filter(changed, fine_paid=False)
+    if borrow_ids is not None:
+        borrows = borrows.filter(id__in=borrow_ids)
+    return borrows.annotate(accrue_days=overdue_days(now)).filter(accrue_days__gt=F('fine_accrued_days'))
+
+
+def _post_batch(rows, now):
+    entries = [
+        FineLedgerEntry(
+            borrow_id=borrow_id, user_id=user_id, kind=FineLedgerEntry.ACCRUAL,
+            amount=(days - posted) * Borrow.FINE_PER_DAY, days=days, created_at=now,
+        )
+        for borrow_id, user_id, days, posted in rows
+    ]
+    # A row already posted by an overlapping run is skipped by the unique
+    # (borrow, days) constraint instead of charging twice.
+    FineLedgerEntry.objects.bulk_create(entries, ignore_conflicts=True)
+    # The rows are locked, so recomputing gives the days just posted; cheaper
+    # than bulk_update's per-row CASE.
+    Borrow.objects.filter(id__in=[row[0] for row in rows]).update(fine_accrued_days=overdue_days(now))
+    return sum(entry.amount for entry in entries)
+
+
+def accrue_fines(now=None, batch_size=1000, borrow_ids=None):
+    """Post every loan's new overdue days to the ledger.
+
+    Walks the changed loans in id order, one transaction per batch; each loan
+    remembers how many days it has been charged for, so a rerun (or a crash
+    half way) only posts what is still missing. Returns a stats dict. Pass
+    ``borrow_ids`` to bring just those loans up to date (no run is recorded).
+    """
+    now = now or timezone.now()
+    watermark = None if borrow_ids is not None else last_watermark()
+    stats = {'entries': 0, 'amount': 0}
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                _accruable(now, watermark, borrow_ids)
+                .select_for_update(of=('self',))
+                .filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', 'user_id', 'accrue_days', 'fine_accrued_days')[:batch_size]
+            )
+            if not rows:
+                break
+            stats['amount'] += _post_batch(rows, now)
+        stats['entries'] += len(rows)
+        last_id = rows[-1][0]
+        if len(rows) < batch_size:
+            break
+
+    if borrow_ids is None:
+        FineAccrualRun.objects.create(started_at=now, finished_at=timezone.now(), **stats)
+    return stats
+
+
+def balance(borrow):
+    """What is still owed on ``borrow`` according to the ledger."""
+    return FineLedgerEntry.objects.filter(borrow_id=borrow.id).aggregate(total=Sum('amount', default=0))['total']
+
+
+def record_payment(borrow, now=None):
+    """Settle ``borrow``'s fine as of ``now`` with a ledger payment.
+
+    Days not yet posted by the nightly run are accrued first, so the payment
+    covers the full fine. The loan row is locked, so a double submit pays
+    once. Returns the amount paid (0 if nothing was owed).
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        locked = Borrow.objects.select_for_update().filter(id=borrow.id, fine_paid=False).exists()
+        if not locked:
+            return 0
+        accrue_fines(now, borrow_ids=[borrow.id])
+        owed = balance(borrow)
+        if owed <= 0:
+            return 0
+        FineLedgerEntry.objects.create(
+            borrow_id=borrow.id, user_id=borrow.user_id, kind=FineLedgerEntry.PAYMENT, amount=-owed, created_at=now,
+        )
+        history.record([borrow], BorrowHistory.FINE_PAID, now, amount=owed)
+    return owed
@@ -15,7 +15,21 @@ from .models import UserProfile
 class BookForm(forms.ModelForm):
     class Meta:
         model = Book
-        fields = ['title', 'author', 'description', 'genre', 'available']
+        # ``available`` follows the copy counters; a posted flag could be stale.
+        fields = ['title', 'author', 'description', 'genre', 'total_copies']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Older forms and imports don't send a copy count; keep the current one.
+        self.fields['total_copies'].required = False
+
+    def clean_total_copies(self):
+        total = self.cleaned_data.get('total_copies')
+        if total is None:
+            return self.instance.total_copies if self.instance.pk else 1
+        if total < 1:
+            raise ValidationError("A book needs at least one copy.")
+        return total
 
 
 class BorrowForm(forms.ModelForm):
@@ -0,0 +1,68 @@
+from django.db import transaction
+from django.db.models import Count, Q
+
+from . import catalog_cache, facets, metrics
+from .models import Book, BorrowHistory, Hold
+
+
+def event(borrow, status, at, **extra):
+    return BorrowHistory(
+        book_id=borrow.book_id, user_id=borrow.user_id, borrow_id=borrow.id,
+        borrow_date=borrow.borrowed_at, due_date=borrow.due_date,
+        status=status, recorded_at=at, **extra,
+    )
+
+
+def record(borrows, status, at, **extra):
+    """Append one ``status`` event per loan, in a single INSERT."""
+    metrics.invalidate()
+    return BorrowHistory.objects.bulk_create(event(borrow, status, at, **extra) for borrow in borrows)
+
+
+def replay_copies(batch_size=500, dry_run=False):
+    """Recompute every book's shelf count from the log and fix any drift.
+
+    A copy is off the shelf while its loan is open (borrowed but not yet
+    returned in the log) or while a ready hold keeps it for a reader. Books
+    are locked a batch at a time, so circulation can carry on meanwhile.
+    Returns the number of books that were (or, with ``dry_run``, would be)
+    corrected.
+    """
+    corrected = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            books = list(Book.objects.select_for_update().filter(id__gt=last_id).order_by('id')[:batch_size])
+            if not books:
+                break
+            ids = [book.id for book in books]
+            on_loan = dict(
+                BorrowHistory.objects.filter(book_id__in=ids)
+                .values('book_id')
+                .annotate(open=Count('id', filter=Q(status=BorrowHistory.BORROWED))
+                          - Count('id', filter=Q(status=BorrowHistory.RETURNED)))
+                .values_list('book_id', 'open')
+            )
+            held = dict(
+                Hold.objects.filter(book_id__in=ids, status=Hold.READY)
+                .values('book_id').annotate(total=Count('id')).values_list('book_id', 'total')
+            )
+            changed = []
+            for book in books:
+                copies = min(book.total_copies, max(0, book.total_copies - on_loan.get(book.id, 0) - held.get(book.id, 0)))
+                if (book.available_copies, book.available) != (copies, copies > 0):
+                    book.available_copies, book.available = copies, copies > 0
+                    changed.append(book)
+            if changed and not dry_run:
+                Book.objects.bulk_update(changed, ['available', 'available_copies'])
+        corrected += len(changed)
+        last_id = ids[-1]
+        if len(books) < batch_size:
+            break
+
+    if corrected and not dry_run:
+        # bulk_update sends no signals.
+        facets.rebuild_facet_counts()
+        catalog_cache.bump_version()
+        metrics.invalidate()
+    return corrected
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from library.archive import ARCHIVE_AFTER_DAYS, archive_returned_loans
+
+
+class Command(BaseCommand):
+    help = 'Move returned, settled loans older than N days from Borrow into the archive table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=ARCHIVE_AFTER_DAYS, help='Archive loans returned more than this many days ago')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Loans moved per transaction')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        moved = archive_returned_loans(options['older_than_days'], batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {moved} loans returned more than {options['older_than_days']} days ago in {elapsed:.2f}s, "
+            f"{moved / elapsed if elapsed else 0:.0f} loans/s."
+        ))
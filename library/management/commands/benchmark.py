@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from library.benchmarks import BENCHMARKS, run
+
+
+class Command(BaseCommand):
+    help = ('Run performance benchmarks against seeded data (changes are rolled back; '
+            'benchmarks that must commit run in a throwaway test database)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help=f"Benchmarks to run: {', '.join(sorted(BENCHMARKS))}")
+        parser.add_argument('--rows', type=int, default=100000, help='Number of rows to seed')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per case')
+
+    def handle(self, *args, **options):
+        names = options['names'] or sorted(BENCHMARKS)
+        unknown = [name for name in names if name not in BENCHMARKS]
+        if unknown:
+            raise CommandError(f"Unknown benchmark(s): {', '.join(unknown)}")
+
+        for name in names:
+            self.stdout.write(self.style.MIGRATE_HEADING(f"{name} (rows={options['rows']})"))
+            for label, stats in run(name, options['rows'], options['repeat']):
+                self.stdout.write(
+                    f"  {label:<40} best {stats['best_ms']:9.2f} ms   median {stats['median_ms']:9.2f} ms"
+                )
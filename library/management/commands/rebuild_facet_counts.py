@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from library.facets import rebuild_facet_counts
+
+
+class Command(BaseCommand):
+    help = 'Recompute the cached genre/availability facet counts from the Book table'
+
+    def handle(self, *args, **kwargs):
+        counts = rebuild_facet_counts()
+        self.stdout.write(self.style.SUCCESS(f"Facet counts rebuilt ({sum(counts.values())} books)."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from library.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Recreate the catalog full-text index and re-sync it with the Book table'
+
+    def handle(self, *args, **kwargs):
+        backend = rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(f"Search index rebuilt ({backend})."))
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from library.reports import refresh_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Fold new borrows into the admin report snapshot (run periodically, e.g. every few minutes)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Drop the tallies and recount the whole circulation log')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        snapshot = refresh_snapshot(force=options['full'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Rebuilt' if options['full'] else 'Refreshed'} admin_reports snapshot "
+            f"(top reader: {(snapshot['data']['most_active_readers_labels'] or ['none'])[0]}) in {elapsed:.2f}s."
+        ))
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from library.trending import refresh_trending
+
+
+class Command(BaseCommand):
+    help = 'Fold new borrows into the trending-book sketches and republish them (run every few minutes)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Drop the sketches and refill them from Borrow')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        payload = refresh_trending(rebuild=options['rebuild'])
+        elapsed = time.perf_counter() - started
+        summary = ', '.join(
+            f"{window['window']}: {window['books'][0]['title'] if window['books'] else 'none'}" for window in payload['data']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Rebuilt' if options['rebuild'] else 'Refreshed'} trending books ({summary}) in {elapsed:.2f}s."
+        ))
@@ -0,0 +1,42 @@
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from library.outbox import claim_batch, deliver
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued notification emails from the outbox, retrying failures with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Emails claimed per batch')
+        parser.add_argument('--poll-interval', type=float, default=5.0, help='Seconds to sleep when the outbox is empty')
+        parser.add_argument('--once', action='store_true', help='Exit once nothing is due instead of polling')
+
+    def handle(self, *args, **options):
+        totals = {'sent': 0, 'retried': 0, 'failed': 0}
+        connection = get_connection(fail_silently=False)
+        try:
+            while True:
+                emails = claim_batch(options['batch_size'])
+                if not emails:
+                    if options['once']:
+                        break
+                    # Don't hold the SMTP session open while idle.
+                    connection.close()
+                    time.sleep(options['poll_interval'])
+                    continue
+                sent, retried, failed = deliver(emails, connection)
+                totals['sent'] += sent
+                totals['retried'] += retried
+                totals['failed'] += failed
+                self.stdout.write(f"Batch of {len(emails)}: {sent} sent, {retried} to retry, {failed} failed.")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            connection.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Outbox drained: {totals['sent']} sent, {totals['retried']} to retry, {totals['failed']} failed."
+        ))
@@ -1,29 +1,136 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+from itertools import groupby
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
 from django.core.management.base import BaseCommand
+from django.db.models import Q
 from django.utils import timezone
+
 from library.models import Borrow
-from library.utils.email_utils import send_notification_email
+
+
+class ConnectionPool:
+    """One mail connection per worker thread, kept open across digests."""
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+
+    def get(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = get_connection(fail_silently=False)
+            with self.lock:
+                self.connections.append(connection)
+        return connection
+
+    def close_all(self):
+        for connection in self.connections:
+            connection.close()
+
+
+def build_digest(user, borrows):
+    lines = [
+        f"- '{borrow.book.title}' by {borrow.book.author}, due {borrow.due_date.strftime('%Y-%m-%d')}"
+        for borrow in borrows
+    ]
+    if len(borrows) == 1:
+        subject = f"Overdue Book Reminder: {borrows[0].book.title}"
+    else:
+        subject = f"Overdue Book Reminder: {len(borrows)} books"
+    message = (
+        f"Hi {user.username},\n\n"
+        f"The following book{'s are' if len(borrows) > 1 else ' is'} overdue:\n\n"
+        + "\n".join(lines) +
+        "\n\nPlease return them as soon as possible to avoid fines.\n\n"
+        "Thank you!"
+    )
+    return subject, message
 
 
 class Command(BaseCommand):
-    help = 'Send overdue book reminder emails to users'
-
-    def handle(self, *args, **kwargs):
-        overdue_borrows = Borrow.objects.filter(returned=False, due_date__lt=timezone.now())
-        for borrow in overdue_borrows:
-            user = borrow.user
-            book = borrow.book
-            due_date = borrow.due_date.strftime('%Y-%m-%d')
-
-            subject = f"Overdue Book Reminder: {book.title}"
-            message = (
-                f"Hi {user.username},\n\n"
-                f"The book '{book.title}' you borrowed was due on {due_date}.\n"
-                "Please return it as soon as possible to avoid fines.\n\n"
-                "Thank you!"
-            )
-            if user.email:
-                send_notification_email(subject, message, [user.email])
-                self.stdout.write(f"Sent overdue reminder to {user.email} for book '{book.title}'.")
-            else:
-                self.stdout.write(f"User {user.username} has no email set; skipping email for book '{book.title}'.")
+    help = 'Send one overdue-books digest per user, skipping loans reminded recently'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent senders, each with its own mail connection')
+        parser.add_argument('--every-hours', type=float, default=24, help='Minimum hours between reminders for the same loan')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched per database round trip')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        workers = max(1, options['workers'])
+        remind_before = now - timedelta(hours=options['every_hours'])
+
+        overdue = (
+            Borrow.objects
+            .filter(returned=False, due_date__lt=now)
+            .filter(Q(last_reminded_at__isnull=True) | Q(last_reminded_at__lt=remind_before))
+            .exclude(user__email='')
+            .select_related('user', 'book')
+            .order_by('user_id', 'due_date', 'id')
+        )
+
+        self.pool = ConnectionPool()
+        self.stats = {'users': 0, 'borrows': 0, 'failed': 0}
+        self.reminded = []
+        started = time.perf_counter()
+        pending = set()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            try:
+                for _, rows in groupby(overdue.iterator(chunk_size=options['chunk_size']), key=lambda b: b.user_id):
+                    borrows = list(rows)
+                    # Bound the queue so a huge backlog isn't held in memory at once.
+                    if len(pending) >= workers * 4:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        self.collect(done, now)
+                    pending.add(executor.submit(self.send_digest, borrows))
+                done, pending = wait(pending)
+                self.collect(done, now)
+            finally:
+                self.pool.close_all()
+        self.mark_reminded(now)
+
+        elapsed = time.perf_counter() - started
+        stats = self.stats
+        self.stdout.write(self.style.SUCCESS(
+            f"Sent {stats['users']} digests covering {stats['borrows']} overdue loans "
+            f"({stats['failed']} failed) in {elapsed:.1f}s, "
+            f"{stats['users'] / elapsed if elapsed else 0:.0f} emails/s with {workers} workers."
+        ))
+
+    def send_digest(self, borrows):
+        user = borrows[0].user
+        subject, message = build_digest(user, borrows)
+        connection = self.pool.get()
+        email = EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL, [user.email], connection=connection)
+        try:
+            connection.open()
+            connection.send_messages([email])
+        except Exception as error:
+            connection.close()
+            return user, borrows, error
+        return user, borrows, None
+
+    def collect(self, futures, now):
+        for future in futures:
+            user, borrows, error = future.result()
+            if error is not None:
+                self.stats['failed'] += 1
+                self.stderr.write(f"Could not remind {user.email}: {type(error).__name__}: {error}")
+                continue
+            self.stats['users'] += 1
+            self.stats['borrows'] += len(borrows)
+            self.reminded.extend(borrow.id for borrow in borrows)
+        if len(self.reminded) >= 500:
+            self.mark_reminded(now)
 
+    def mark_reminded(self, now):
+        if self.reminded:
+            Borrow.objects.filter(id__in=self.reminded).update(last_reminded_at=now)
+            self.reminded = []
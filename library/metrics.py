@@ -0,0 +1,43 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from .models import Book, Borrow, ReaderBorrowTally
+
+
+CACHE_KEY = 'metrics:dashboard'
+TTL = 60
+
+
+def compute():
+    """Every dashboard counter, with one aggregate query per table."""
+    now = timezone.now()
+    books = Book.objects.aggregate(
+        total_books=Count('id'),
+        available_books=Count('id', filter=Q(available=True)),
+        total_copies=Sum('total_copies', default=0),
+        available_copies=Sum('available_copies', default=0),
+    )
+    # Open loans only, so the partial active-loan index serves it.
+    loans = Borrow.objects.filter(returned=False).aggregate(
+        active_loans=Count('id'),
+        overdue_loans=Count('id', filter=Q(due_date__lt=now)),
+    )
+    # Everyone who ever borrowed has a tally row, so this is a plain count
+    # rather than a DISTINCT over the log; as fresh as the last refresh_reports.
+    total_users = ReaderBorrowTally.objects.count()
+    return {**books, **loans, 'total_users': total_users, 'computed_at': now}
+
+
+def dashboard_metrics():
+    """Cached ``compute()``; dropped after any circulation event, else after TTL seconds."""
+    metrics = cache.get(CACHE_KEY)
+    if metrics is None:
+        metrics = compute()
+        cache.set(CACHE_KEY, metrics, TTL)
+    return metrics
+
+
+def invalidate():
+    transaction.on_commit(lambda: cache.delete(CACHE_KEY))
@@ -0,0 +1,144 @@
+import contextvars
+import json
+import logging
+import random
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+
+logger = logging.getLogger('library.metrics')
+
+# Metrics of the request being sampled on the current thread/task, if any.
+_current = contextvars.ContextVar('library_request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+
+@contextmanager
+def _instrumented(metrics):
+    token = _current.set(metrics)
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(metrics))
+            yield
+    finally:
+        _current.reset(token)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        metrics = _current.get()
+        if metrics is None:
+            return super().render(context, request)
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_time += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """DjangoTemplates backend whose top-level renders count as template time.
+
+    Includes and extends render inside the top-level template, so they are
+    not counted twice.
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+class RequestMetricsMiddleware:
+    """Record SQL count, DB time, template time and wall time per request.
+
+    Only a REQUEST_METRICS_SAMPLE_RATE fraction of requests is instrumented,
+    so the rest pay for a single random() call. Sampled requests get a
+    Server-Timing header and one JSON log line on the ``library.metrics``
+    logger. Works with DEBUG off: queries are counted through execute
+    wrappers, not ``connection.queries``. Template time needs the
+    TimedDjangoTemplates backend.
+
+    A streaming response's body is produced after the headers are sent, so it
+    gets no Server-Timing header; its chunks are measured as they are
+    consumed and the log line is written when the stream ends. Async streams
+    are not followed: only the view that built them is measured.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sample_rate = getattr(settings, 'REQUEST_METRICS_SAMPLE_RATE', 0.0)
+        if sample_rate <= 0 or random.random() >= sample_rate:
+            return self.get_response(request)
+
+        metrics = RequestMetrics()
+        start = time.perf_counter()
+        with _instrumented(metrics):
+            response = self.get_response(request)
+
+        if response.streaming and not response.is_async:
+            response.streaming_content = self.measure_stream(
+                response.streaming_content, metrics,
+                lambda: self.log(request, response, metrics, time.perf_counter() - start),
+            )
+            return response
+
+        total_time = time.perf_counter() - start
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={metrics.db_time * 1000:.2f};desc="{metrics.queries} queries"',
+            f'tpl;dur={metrics.template_time * 1000:.2f}',
+            f'total;dur={total_time * 1000:.2f}',
+        ])
+        self.log(request, response, metrics, total_time)
+        return response
+
+    def measure_stream(self, content, metrics, finish):
+        try:
+            while True:
+                with _instrumented(metrics):
+                    chunk = next(content, None)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            finish()
+
+    def log(self, request, response, metrics, total_time):
+        match = getattr(request, 'resolver_match', None)
+        logger.info(json.dumps({
+            'event': 'request',
+            'method': request.method,
+            'route': match.route if match else None,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'queries': metrics.queries,
+            'db_ms': round(metrics.db_time * 1000, 2),
+            'template_ms': round(metrics.template_time * 1000, 2),
+            'total_ms': round(total_time * 1000, 2),
+        }))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0017_outbox_email'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='borrow',
+            name='last_reminded_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
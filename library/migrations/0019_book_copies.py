@@ -0,0 +1,74 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:04
+
+from django.db import migrations, models
+
+
+# The FTS5 triggers from 0015, copied so this migration doesn't depend on
+# library.search. PostgreSQL's generated column survives the field changes.
+SQLITE_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS library_book_fts_ai AFTER INSERT ON library_book BEGIN
+        INSERT INTO library_book_fts(rowid, title, author, description)
+        VALUES (new.id, new.title, new.author, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS library_book_fts_ad AFTER DELETE ON library_book BEGIN
+        INSERT INTO library_book_fts(library_book_fts, rowid, title, author, description)
+        VALUES ('delete', old.id, old.title, old.author, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS library_book_fts_au AFTER UPDATE OF title, author, description ON library_book
+    WHEN old.title IS NOT new.title OR old.author IS NOT new.author OR old.description IS NOT new.description
+    BEGIN
+        INSERT INTO library_book_fts(library_book_fts, rowid, title, author, description)
+        VALUES ('delete', old.id, old.title, old.author, old.description);
+        INSERT INTO library_book_fts(rowid, title, author, description)
+        VALUES (new.id, new.title, new.author, new.description);
+    END
+    """,
+]
+
+
+def count_shelved_copies(apps, schema_editor):
+    Book = apps.get_model('library', 'Book')
+    Book.objects.filter(available=False).update(available_copies=0)
+
+
+def reinstall_search_index(apps, schema_editor):
+    # SQLite rebuilds library_book for these fields, which drops the FTS triggers.
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in SQLITE_TRIGGERS:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0018_borrow_last_reminded_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, reinstall_search_index),
+        migrations.AddField(
+            model_name='book',
+            name='available_copies',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='total_copies',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.RunPython(count_shelved_copies, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='book',
+            constraint=models.CheckConstraint(condition=models.Q(('available_copies__lte', models.F('total_copies'))), name='book_copies_within_total'),
+        ),
+        migrations.AddConstraint(
+            model_name='book',
+            constraint=models.CheckConstraint(condition=models.Q(models.Q(('available', True), ('available_copies__gt', 0)), models.Q(('available', False), ('available_copies', 0)), _connector='OR'), name='book_available_matches_copies'),
+        ),
+        migrations.RunPython(reinstall_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:19
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0020_hold'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FineAccrualRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField()),
+                ('entries', models.PositiveIntegerField(default=0)),
+                ('amount', models.IntegerField(default=0)),
+            ],
+            options={
+                'get_latest_by': 'started_at',
+            },
+        ),
+        migrations.AddField(
+            model_name='borrow',
+            name='fine_accrued_days',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='FineLedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('accrual', 'Accrual'), ('payment', 'Payment')], max_length=10)),
+                ('amount', models.IntegerField()),
+                ('days', models.PositiveIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('borrow', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fine_entries', to='library.borrow')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['borrow', 'kind'], name='fine_entry_borrow_kind_idx'), models.Index(fields=['user', 'created_at'], name='fine_entry_user_created_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('kind', 'accrual')), fields=('borrow', 'days'), name='fine_entry_one_accrual_per_day')],
+            },
+        ),
+    ]
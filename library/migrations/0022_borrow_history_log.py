@@ -0,0 +1,71 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:26
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_events(apps, schema_editor):
+    # Loans made before the log existed get their borrow/return events.
+    Borrow = apps.get_model('library', 'Borrow')
+    BorrowHistory = apps.get_model('library', 'BorrowHistory')
+    batch = []
+    for borrow in Borrow.objects.filter(events__isnull=True).order_by('id').iterator(chunk_size=2000):
+        common = dict(
+            book_id=borrow.book_id, user_id=borrow.user_id, borrow_id=borrow.id,
+            borrow_date=borrow.borrowed_at, due_date=borrow.due_date,
+        )
+        batch.append(BorrowHistory(status='borrowed', recorded_at=borrow.borrowed_at, **common))
+        if borrow.returned:
+            returned_at = borrow.returned_at or borrow.borrowed_at
+            batch.append(BorrowHistory(status='returned', return_date=borrow.returned_at, recorded_at=returned_at, **common))
+        if len(batch) >= 2000:
+            BorrowHistory.objects.bulk_create(batch)
+            batch = []
+    BorrowHistory.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0021_fine_ledger'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='borrowhistory',
+            name='amount',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='borrowhistory',
+            name='borrow',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='events', to='library.borrow'),
+        ),
+        migrations.AddField(
+            model_name='borrowhistory',
+            name='due_date',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='borrowhistory',
+            name='recorded_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='borrowhistory',
+            name='status',
+            field=models.CharField(choices=[('borrowed', 'Borrowed'), ('returned', 'Returned'), ('renewed', 'Renewed'), ('fine_paid', 'Fine paid')], default='borrowed', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='borrowhistory',
+            index=models.Index(fields=['book', 'borrow_date'], name='history_book_borrow_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='borrowhistory',
+            index=models.Index(fields=['user', 'borrow_date'], name='history_user_borrow_idx'),
+        ),
+        migrations.RunPython(backfill_events, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:32
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0022_borrow_history_log'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='borrowhistory',
+            name='borrow',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='events', to='library.borrow'),
+        ),
+        migrations.AlterField(
+            model_name='fineledgerentry',
+            name='borrow',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='fine_entries', to='library.borrow'),
+        ),
+        migrations.CreateModel(
+            name='ArchivedBorrow',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('borrowed_at', models.DateTimeField()),
+                ('due_date', models.DateTimeField(blank=True, null=True)),
+                ('returned', models.BooleanField(default=True)),
+                ('returned_at', models.DateTimeField(blank=True, null=True)),
+                ('fine_paid', models.BooleanField(default=False)),
+                ('fine_accrued_days', models.PositiveIntegerField(default=0)),
+                ('last_reminded_at', models.DateTimeField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_borrows', to='library.book')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_borrows', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-borrowed_at'], name='archived_user_borrowed_idx'), models.Index(fields=['book', '-borrowed_at'], name='archived_book_borrowed_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+from django.db import migrations
+from django.db.models import F, Func, IntegerField
+
+
+class DaysBetween(Func):
+    """Whole days from ``start`` to ``end`` for two datetime columns.
+
+    A frozen copy of library.expressions.DaysBetween, without its constant
+    shortcut, so later changes there can't change this migration.
+    """
+    arity = 2
+    output_field = IntegerField()
+
+    def as_sql(self, compiler, connection, **extra_context):
+        swapped = self.copy()
+        swapped.set_source_expressions(self.get_source_expressions()[::-1])
+        return super(DaysBetween, swapped).as_sql(
+            compiler, connection, arg_joiner=' - ',
+            template='CAST(EXTRACT(DAY FROM (%(expressions)s)) AS integer)',
+            **extra_context,
+        )
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, function='TIMESTAMPDIFF', template='%(function)s(DAY, %(expressions)s)', **extra_context)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        parts = []
+        for expression in self.get_source_expressions():
+            value_sql, value_params = compiler.compile(expression)
+            parts.append((
+                f"(CAST(strftime('%%s', {value_sql}) AS INTEGER) * 1000000"
+                f" + CAST(substr({value_sql}, 21, 6) AS INTEGER))",
+                [*value_params, *value_params],
+            ))
+        (start_sql, start_params), (end_sql, end_params) = parts
+        return f'(({end_sql} - {start_sql}) / 86400000000)', [*end_params, *start_params]
+
+
+def mark_legacy_returns_posted(apps, schema_editor):
+    # Before the ledger a loan owed nothing once returned, so late returns
+    # from that time count as fully posted instead of being charged now.
+    Borrow = apps.get_model('library', 'Borrow')
+    FineAccrualRun = apps.get_model('library', 'FineAccrualRun')
+    first_run = FineAccrualRun.objects.order_by('started_at').values_list('started_at', flat=True).first()
+    legacy = Borrow.objects.filter(returned=True, returned_at__gt=F('due_date'), fine_entries__isnull=True)
+    if first_run is not None:
+        legacy = legacy.filter(returned_at__lt=first_run)
+    Borrow.objects.filter(id__in=legacy.values('id')).update(fine_accrued_days=DaysBetween(F('due_date'), F('returned_at')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0026_trending_bucket'),
+    ]
+
+    operations = [
+        migrations.RunPython(mark_legacy_returns_posted, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:42
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0027_settle_legacy_returns'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='borrow',
+            name='borrowed_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -1,9 +1,13 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
+from datetime import timedelta
+from django.db.models.functions import Coalesce, Greatest, Least
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
+from .expressions import DaysBetween
+
 
 # BOOK MODEL
 class Book(models.Model):
@@ -21,20 +25,205 @@ class Book(models.Model):
     description = models.TextField(blank=True)
     genre = models.CharField(max_length=50, choices=GENRE_CHOICES, default='other')  # ✅ New field
     available = models.BooleanField(default=True)
+    # Copies on the shelf; moved only by conditional F() updates in circulation.py.
+    # ``available`` always equals ``available_copies > 0``.
+    total_copies = models.PositiveIntegerField(default=1)
+    available_copies = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        indexes = [
+            # Catalog browsing: keyset pagination and the genre/availability filters.
+            models.Index(fields=['title', 'id'], name='book_title_id_idx'),
+            models.Index(fields=['available', 'genre', 'title'], name='book_avail_genre_title_idx'),
+            models.Index(fields=['genre', 'title'], name='book_genre_title_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(available_copies__lte=models.F('total_copies')),
+                name='book_copies_within_total',
+            ),
+            models.CheckConstraint(
+                condition=models.Q(available=True, available_copies__gt=0) | models.Q(available=False, available_copies=0),
+                name='book_available_matches_copies',
+            ),
+        ]
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_copies = cls._copies_state(instance)
+        return instance
+
+    def _copies_state(self):
+        return tuple(self.__dict__.get(name) for name in ('available', 'available_copies', 'total_copies'))
+
+    def sync_copies(self):
+        """Reconcile ``available`` and the copy counters before a save that writes them.
+
+        Forms and scripts may change either the flag or the counters; whichever
+        was edited wins. Borrowing and returning never come through here, and
+        saves that leave both alone don't either (see ``save``).
+        """
+        loaded = getattr(self, '_loaded_copies', None)
+        if loaded is not None and loaded[2] is not None and self.total_copies != loaded[2]:
+            # Added or withdrawn copies go straight onto (or off) the shelf.
+            self.available_copies = max(0, self.available_copies + self.total_copies - loaded[2])
+        self.available_copies = min(self.available_copies, self.total_copies)
+        if self.available == (self.available_copies > 0):
+            return
+
+        if loaded is None:
+            # New row: an explicit available=False means no copy is on the shelf.
+            flag_edited = not self.available
+        else:
+            flag_edited = self.available != loaded[0] and self.available_copies == loaded[1]
+        if not flag_edited:
+            self.available = self.available_copies > 0
+        elif not self.available:
+            self.available_copies = 0
+        else:
+            # Only copies that aren't on loan can go back on the shelf.
+            on_loan = self.borrow_set.filter(returned=False).count() if self.pk else 0
+            self.available_copies = max(0, self.total_copies - on_loan)
+            self.available = self.available_copies > 0
+
+    def save(self, *args, **kwargs):
+        loaded = getattr(self, '_loaded_copies', None)
+        if (
+            self._state.adding or loaded is None or None in loaded or args or set(kwargs) - {'using'}
+            or (self.available, self.available_copies) != loaded[:2]
+        ):
+            self.sync_copies()
+            super().save(*args, **kwargs)
+            self._loaded_copies = self._copies_state()
+            return
+
+        # The counters weren't edited, so leave them to circulation's F()
+        # updates and move the shelf by the change in total_copies. That runs
+        # first so post_save sees the resulting ``available``.
+        copies = ('available', 'available_copies', 'total_copies')
+        fields = [field.attname for field in self._meta.concrete_fields if not field.primary_key and field.attname not in copies]
+        delta = self.total_copies - loaded[2]
+        db = kwargs.get('using') or self._state.db
+        with transaction.atomic(using=db):
+            if delta:
+                # ``available`` first: MySQL evaluates assignments left to right.
+                Book.objects.using(db).filter(pk=self.pk).update(
+                    available=models.Case(models.When(available_copies__gt=-delta, then=self.total_copies > 0), default=False),
+                    available_copies=Least(Greatest(models.F('available_copies') + delta, 0), self.total_copies),
+                    total_copies=self.total_copies,
+                )
+                self.refresh_from_db(using=db, fields=['available', 'available_copies'])
+            super().save(update_fields=fields, **kwargs)
+        self._loaded_copies = self._copies_state()
+
+
+class BorrowQuerySet(models.QuerySet):
+    """Fine arithmetic in SQL, matching Borrow.is_overdue/days_overdue/fine_amount."""
+
+    def overdue(self, now=None):
+        return self.filter(returned=False, due_date__lt=now or timezone.now())
+
+    def with_fines(self, now=None):
+        """Annotate ``days_overdue`` and ``fine_amount`` as of ``now``."""
+        now = models.Value(now or timezone.now(), output_field=models.DateTimeField())
+        days = models.Case(
+            models.When(returned=False, due_date__lt=now, then=DaysBetween(models.F('due_date'), now)),
+            default=0,
+            output_field=models.IntegerField(),
+        )
+        return self.annotate(days_overdue=days, fine_amount=days * Borrow.FINE_PER_DAY)
+
+    def with_fine_due(self):
+        """Annotate ``fine_due``: what the loan owes according to the fine ledger.
+
+        The ledger is the only record of what is owed; days not yet posted
+        by ``accrue_fines`` aren't owed until they are.
+        """
+        balance = (
+            FineLedgerEntry.objects.filter(borrow=models.OuterRef('pk'))
+            .values('borrow').annotate(total=models.Sum('amount')).values('total')
+        )
+        return self.annotate(fine_due=Coalesce(models.Subquery(balance), 0))
+
+    def outstanding_fines(self):
+        """Loans, open or returned, with a positive ledger balance.
+
+        Driven from the ledger's per-loan totals, so only loans that were
+        ever charged are read, through the primary key.
+        """
+        owing = (
+            FineLedgerEntry.objects.values('borrow_id').annotate(total=models.Sum('amount'))
+            .filter(total__gt=0).values('borrow_id')
+        )
+        return self.filter(id__in=owing).with_fine_due()
+
+    def fine_totals(self):
+        """``{'total': ..., 'loans': ...}`` for every unpaid fine in the queryset."""
+        return self.outstanding_fines().aggregate(
+            total=models.Sum('fine_due', default=0), loans=models.Count('id'),
+        )
+
+    def fines_by_user(self):
+        """Outstanding fine per user, largest first."""
+        return (
+            self.outstanding_fines()
+            .values('user_id', 'user__username')
+            .annotate(total=models.Sum('fine_due'), loans=models.Count('id'))
+            .order_by('-total', 'user_id')
+        )
+
+
+class LoanArchiveManager(models.Manager):
+    """Reads loans from the hot Borrow table and ArchivedBorrow as one set.
+
+    Archived rows keep their Borrow ids, so the UNION ALL never repeats a
+    loan. Results are read-only Borrow instances; see archive.py.
+    """
+    FIELDS = ('id', 'user_id', 'book_id', 'borrowed_at', 'due_date', 'returned', 'returned_at', 'fine_paid')
+
+    def including_archived(self, **filters):
+        """One UNION ALL query of ``FIELDS`` tuples for loans matching ``filters``."""
+        hot = self.get_queryset().filter(**filters).values_list(*self.FIELDS)
+        cold = ArchivedBorrow.objects.filter(**filters).values_list(*self.FIELDS)
+        return hot.union(cold, all=True)
+
+    def history(self, *ordering, **filters):
+        """Matching loans as Borrow objects with their books, newest first by default."""
+        rows = self.including_archived(**filters).order_by(*(ordering or ('-borrowed_at', '-id')))
+        loans = [self.model(**dict(zip(self.FIELDS, row))) for row in rows]
+        models.prefetch_related_objects(loans, 'book')
+        return loans
+
 
 # BORROW MODEL
 class Borrow(models.Model):
+    FINE_PER_DAY = 10
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)  # revert back to required
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
-    borrowed_at = models.DateTimeField(auto_now_add=True)
+    borrowed_at = models.DateTimeField(default=timezone.now, editable=False)
     due_date = models.DateTimeField(null=True, blank=True)
     returned = models.BooleanField(default=False)
     returned_at = models.DateTimeField(null=True, blank=True)
-    fine_paid = models.BooleanField(default=False)
+    fine_paid = models.BooleanField(default=False)  # legacy flag; payments now live in FineLedgerEntry
+    fine_accrued_days = models.PositiveIntegerField(default=0)  # overdue days already posted to the ledger
+    last_reminded_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'returned'], name='borrow_user_returned_idx'),
+            models.Index(fields=['returned', 'due_date'], name='borrow_returned_due_idx'),
+            models.Index(fields=['user', '-borrowed_at'], name='borrow_user_borrowed_idx'),
+            # Active loans are a small slice of the table; keep them in their own index.
+            models.Index(fields=['due_date'], name='borrow_active_due_idx', condition=models.Q(returned=False)),
+        ]
+
+    objects = BorrowQuerySet.as_manager()
+    all_loans = LoanArchiveManager()
 
     def __str__(self):
         return f"{self.user} borrowed {self.book}"
@@ -43,29 +232,275 @@ class Borrow(models.Model):
     def is_overdue(self):
         return not self.returned and self.due_date and timezone.now() > self.due_date
 
+    # days_overdue and fine_amount prefer the values annotated by
+    # Borrow.objects.with_fines(), so listing fines needs no per-row math.
     @property
-    def fine_amount(self):
+    def days_overdue(self):
+        if 'days_overdue' in self.__dict__:
+            return self.__dict__['days_overdue']
         if not self.is_overdue:
             return 0
-        fine_rate_per_day = 10
-        days_overdue = (timezone.now() - self.due_date).days
-        return fine_rate_per_day * days_overdue
+        return (timezone.now() - self.due_date).days
+
+    @days_overdue.setter
+    def days_overdue(self, value):
+        self.__dict__['days_overdue'] = value
+
+    @property
+    def fine_amount(self):
+        if 'fine_amount' in self.__dict__:
+            return self.__dict__['fine_amount']
+        return self.FINE_PER_DAY * self.days_overdue
+
+    @fine_amount.setter
+    def fine_amount(self, value):
+        self.__dict__['fine_amount'] = value
+
+
+class ArchivedBorrow(models.Model):
+    """A returned loan moved out of Borrow by ``archive_loans``, under its original id."""
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_borrows')
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='archived_borrows')
+    borrowed_at = models.DateTimeField()
+    due_date = models.DateTimeField(null=True, blank=True)
+    returned = models.BooleanField(default=True)
+    returned_at = models.DateTimeField(null=True, blank=True)
+    fine_paid = models.BooleanField(default=False)
+    fine_accrued_days = models.PositiveIntegerField(default=0)
+    last_reminded_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-borrowed_at'], name='archived_user_borrowed_idx'),
+            models.Index(fields=['book', '-borrowed_at'], name='archived_book_borrowed_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} borrowed {self.book} (archived)"
+
+
+# HOLD MODEL
+class Hold(models.Model):
+    """A place in a book's FIFO waiting list.
+
+    A returned copy goes to the oldest waiting hold instead of the shelf; the
+    hold is then ready until ``expires_at``, after which the copy moves on.
+    """
+    WAITING = 'waiting'
+    READY = 'ready'
+    COLLECTED = 'collected'
+    EXPIRED = 'expired'
+    CANCELLED = 'cancelled'
+    STATUS_CHOICES = [
+        (WAITING, 'Waiting'),
+        (READY, 'Ready for pickup'),
+        (COLLECTED, 'Collected'),
+        (EXPIRED, 'Expired'),
+        (CANCELLED, 'Cancelled'),
+    ]
+    ACTIVE = [WAITING, READY]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=WAITING)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    ready_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Head of each book's queue, read on every return.
+            models.Index(fields=['book', 'created_at', 'id'], name='hold_queue_idx', condition=models.Q(status='waiting')),
+            # The expiry sweep.
+            models.Index(fields=['expires_at'], name='hold_ready_expiry_idx', condition=models.Q(status='ready')),
+            models.Index(fields=['user', 'status'], name='hold_user_status_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'book'], condition=models.Q(status__in=['waiting', 'ready']), name='hold_one_active_per_book',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user} holds {self.book} ({self.status})"
+
+
+# FINE LEDGER MODELS
+class FineLedgerEntry(models.Model):
+    """One movement on a loan's fine: accruals are positive, payments negative.
+
+    A loan's balance is the sum of its entries. Accrual rows carry the
+    overdue-day count they bring the loan up to, which makes reposting the
+    same days a constraint violation instead of a double charge.
+    """
+    ACCRUAL = 'accrual'
+    PAYMENT = 'payment'
+    KIND_CHOICES = [
+        (ACCRUAL, 'Accrual'),
+        (PAYMENT, 'Payment'),
+    ]
+
+    # No database constraint: the loan may since have moved to ArchivedBorrow
+    # under the same id.
+    borrow = models.ForeignKey(Borrow, on_delete=models.DO_NOTHING, db_constraint=False, related_name='fine_entries')
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    amount = models.IntegerField()
+    days = models.PositiveIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['borrow', 'kind'], name='fine_entry_borrow_kind_idx'),
+            models.Index(fields=['user', 'created_at'], name='fine_entry_user_created_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['borrow', 'days'], condition=models.Q(kind='accrual'), name='fine_entry_one_accrual_per_day'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.amount} on {self.borrow_id}"
+
+
+class FineAccrualRun(models.Model):
+    """A completed accrue_fines run; the latest one is the next run's watermark."""
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField()
+    entries = models.PositiveIntegerField(default=0)
+    amount = models.IntegerField(default=0)
+
+    class Meta:
+        get_latest_by = 'started_at'
+
+    def __str__(self):
+        return f"Fine accrual at {self.started_at:%Y-%m-%d %H:%M}: {self.entries} entries"
 
 
 # BORROW HISTORY MODEL
 class BorrowHistory(models.Model):
+    """Append-only circulation log: one row per borrow, return, renewal or fine payment.
+
+    ``borrow_date`` is the loan's start, so a book's or user's history reads
+    straight off the (book|user, borrow_date) indexes. Rows are only ever
+    inserted; see ``history.record``.
+    """
+    BORROWED = 'borrowed'
+    RETURNED = 'returned'
+    RENEWED = 'renewed'
+    FINE_PAID = 'fine_paid'
+    STATUS_CHOICES = [
+        (BORROWED, 'Borrowed'),
+        (RETURNED, 'Returned'),
+        (RENEWED, 'Renewed'),
+        (FINE_PAID, 'Fine paid'),
+    ]
+
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Unconstrained like FineLedgerEntry.borrow: archived loans keep their id.
+    borrow = models.ForeignKey(Borrow, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='events')
     borrow_date = models.DateTimeField(default=timezone.now)
     return_date = models.DateTimeField(null=True, blank=True)
-    status = models.CharField(max_length=20, choices=[
-        ('borrowed', 'Borrowed'),
-        ('returned', 'Returned'),
-    ], default='borrowed')
+    due_date = models.DateTimeField(null=True, blank=True)
+    amount = models.IntegerField(null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=BORROWED)
+    recorded_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['book', 'borrow_date'], name='history_book_borrow_idx'),
+            models.Index(fields=['user', 'borrow_date'], name='history_user_borrow_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.book.title} - {self.status}"
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("BorrowHistory is append-only; record a new event instead.")
+        super().save(*args, **kwargs)
+
+
+# REPORT SNAPSHOT MODELS
+class ReportSnapshot(models.Model):
+    """Precomputed report data, refreshed incrementally by ``refresh_reports``.
+
+    ``watermark`` is the last BorrowHistory id folded into the borrow tallies.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    data = models.JSONField(default=dict)
+    watermark = models.BigIntegerField(default=0)
+    refreshed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} snapshot at {self.refreshed_at}"
+
+
+class BookBorrowTally(models.Model):
+    """Running count of borrows per book, kept by the report snapshot refresh."""
+    book = models.OneToOneField(Book, on_delete=models.CASCADE, primary_key=True, related_name='borrow_tally')
+    borrows = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=['-borrows'], name='book_tally_borrows_idx')]
+
+
+class ReaderBorrowTally(models.Model):
+    """Running count of borrows per user, kept by the report snapshot refresh."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='borrow_tally')
+    borrows = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=['-borrows'], name='reader_tally_borrows_idx')]
+
+
+class TrendingBucket(models.Model):
+    """Space-Saving summary of the books borrowed in one hour or one day, kept by ``trending``.
+
+    ``counters`` maps book id to ``[count, error]``.
+    """
+    HOUR = 'hour'
+    DAY = 'day'
+    GRANULARITY_CHOICES = [
+        (HOUR, 'Hour'),
+        (DAY, 'Day'),
+    ]
+
+    granularity = models.CharField(max_length=4, choices=GRANULARITY_CHOICES)
+    start = models.DateTimeField()
+    counters = models.JSONField(default=dict)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['granularity', 'start'], name='trending_bucket_uniq'),
+        ]
+
+    def __str__(self):
+        return f"Trending {self.granularity} from {self.start:%Y-%m-%d %H:%M}"
+
+
+class DailyCirculation(models.Model):
+    """Borrows, returns and loans gone overdue per (day, genre), kept by ``rollups``.
+
+    A loan counts as overdue on the day it falls due unless it came back in
+    time, so rows for the coming days already hold the loans due then.
+    """
+    day = models.DateField()
+    genre = models.CharField(max_length=50, choices=Book.GENRE_CHOICES)
+    borrowed = models.IntegerField(default=0)
+    returned = models.IntegerField(default=0)
+    overdue = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'genre'], name='daily_circulation_day_genre_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.genre}: {self.borrowed} borrowed, {self.returned} returned"
+
 
 # READER MODEL
 class Reader(models.Model):
@@ -75,10 +510,51 @@ class Reader(models.Model):
     reference_id = models.CharField(max_length=50)
     address = models.TextField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['name', 'id'], name='reader_name_id_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
 
+# OUTBOX MODEL
+class OutboxEmail(models.Model):
+    """Email queued in the same transaction as the change it reports.
+
+    Requests only insert rows; ``run_mail_worker`` delivers them.
+    """
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254, blank=True)
+    recipients = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The worker's poll: due rows that are still pending.
+            models.Index(fields=['next_attempt_at', 'id'], name='outbox_pending_due_idx', condition=models.Q(status='pending')),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.recipients)} ({self.status})"
+
+
 # USER PROFILE MODEL
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
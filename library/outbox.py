@@ -0,0 +1,93 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = 30
+BACKOFF_MAX = 3600
+# How long a claimed batch stays invisible to other workers; a worker that
+# dies mid-batch therefore delays its emails by this much, never loses them.
+LEASE_SECONDS = 300
+
+
+def enqueue(subject, body, recipient_list, from_email=None):
+    """Queue an email; call inside the transaction that makes it true."""
+    recipients = [address for address in recipient_list if address]
+    if not recipients:
+        return None
+    return OutboxEmail.objects.create(
+        subject=subject,
+        body=body,
+        recipients=recipients,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+    )
+
+
+def enqueue_many(messages):
+    """Queue ``(subject, body, recipient_list)`` triples with one INSERT."""
+    rows = []
+    for subject, body, recipient_list in messages:
+        recipients = [address for address in recipient_list if address]
+        if recipients:
+            rows.append(OutboxEmail(subject=subject, body=body, recipients=recipients, from_email=settings.DEFAULT_FROM_EMAIL))
+    return OutboxEmail.objects.bulk_create(rows)
+
+
+def backoff(attempts):
+    """Seconds to wait before retry number ``attempts`` (1-based)."""
+    return min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+
+
+def claim_batch(batch_size, now=None):
+    """Lease up to ``batch_size`` due emails to the calling worker."""
+    now = now or timezone.now()
+    with transaction.atomic():
+        ids = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboxEmail.PENDING, next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if ids:
+            OutboxEmail.objects.filter(id__in=ids).update(next_attempt_at=now + timedelta(seconds=LEASE_SECONDS))
+    return list(OutboxEmail.objects.filter(id__in=ids).order_by('id')) if ids else []
+
+
+def deliver(emails, connection):
+    """Send ``emails`` over one open ``connection`` and record the outcome.
+
+    Returns ``(sent, retried, failed)`` counts. A failure closes the
+    connection so the next email gets a fresh one.
+    """
+    now = timezone.now()
+    sent_ids, retries = [], []
+    failed = 0
+    for email in emails:
+        message = EmailMessage(email.subject, email.body, email.from_email, email.recipients, connection=connection)
+        try:
+            connection.open()  # no-op while the connection is up
+            connection.send_messages([message])
+        except Exception as error:
+            connection.close()
+            email.attempts += 1
+            email.last_error = f'{type(error).__name__}: {error}'[:1000]
+            if email.attempts >= MAX_ATTEMPTS:
+                email.status = OutboxEmail.FAILED
+                failed += 1
+            else:
+                email.next_attempt_at = now + timedelta(seconds=backoff(email.attempts))
+            retries.append(email)
+        else:
+            sent_ids.append(email.id)
+
+    if sent_ids:
+        OutboxEmail.objects.filter(id__in=sent_ids).update(status=OutboxEmail.SENT, sent_at=now, last_error='')
+    if retries:
+        OutboxEmail.objects.bulk_update(retries, ['attempts', 'last_error', 'status', 'next_attempt_at'])
+    return len(sent_ids), len(retries) - failed, failed
@@ -0,0 +1,136 @@
+import base64
+import binascii
+import json
+
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Q
+
+
+def encode_cursor(direction, values):
+    payload = json.dumps({'d': direction, 'k': list(values)}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    """Return (direction, values) for a cursor, or None if it is not valid."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        direction, values = payload['d'], payload['k']
+    except (binascii.Error, ValueError, TypeError, KeyError, UnicodeDecodeError):
+        return None
+    if direction not in ('n', 'p') or not isinstance(values, list) or len(values) != size:
+        return None
+    return direction, values
+
+
+def approximate_count(queryset):
+    """Cheap row estimate: the planner's guess on PostgreSQL, COUNT(*) elsewhere."""
+    queryset = queryset.order_by()
+    if connection.vendor == 'postgresql':
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+    return queryset.count()
+
+
+class CursorPage:
+    def __init__(self, object_list, ordering, has_next, has_previous, count=None):
+        self.object_list = object_list
+        self.ordering = ordering
+        self.has_next_page = has_next
+        self.has_previous_page = has_previous
+        self.approximate_count = count
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.has_next_page
+
+    def has_previous(self):
+        return self.has_previous_page
+
+    def has_other_pages(self):
+        return self.has_next_page or self.has_previous_page
+
+    def _key(self, obj):
+        return [getattr(obj, field) for field in self.ordering]
+
+    @property
+    def next_cursor(self):
+        if not self.has_next_page or not self.object_list:
+            return ''
+        return encode_cursor('n', self._key(self.object_list[-1]))
+
+    @property
+    def previous_cursor(self):
+        if not self.has_previous_page or not self.object_list:
+            return ''
+        return encode_cursor('p', self._key(self.object_list[0]))
+
+
+class CursorPaginator:
+    """Keyset pagination over a unique, ascending ordering such as (title, id).
+
+    Each page is a single indexed range scan of ``per_page + 1`` rows: no
+    COUNT(*) and no OFFSET, so page 10,000 costs the same as page 1.
+    """
+
+    def __init__(self, queryset, ordering, per_page=10, with_count=False):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+        self.with_count = with_count
+
+    def _after(self, values, lookup):
+        condition = Q()
+        for position, field in enumerate(self.ordering):
+            term = Q(**{f'{field}__{lookup}': values[position]})
+            for previous_field, previous_value in zip(self.ordering[:position], values):
+                term &= Q(**{previous_field: previous_value})
+            condition |= term
+        return condition
+
+    def page(self, cursor=None):
+        decoded = decode_cursor(cursor, len(self.ordering)) if cursor else None
+        limit = self.per_page + 1
+
+        if decoded is None:
+            rows = list(self.queryset.order_by(*self.ordering)[:limit])
+            has_next, has_previous = len(rows) > self.per_page, False
+            rows = rows[:self.per_page]
+        elif decoded[0] == 'n':
+            rows = list(self.queryset.filter(self._after(decoded[1], 'gt')).order_by(*self.ordering)[:limit])
+            has_next, has_previous = len(rows) > self.per_page, True
+            rows = rows[:self.per_page]
+        else:
+            descending = [f'-{field}' for field in self.ordering]
+            rows = list(self.queryset.filter(self._after(decoded[1], 'lt')).order_by(*descending)[:limit])
+            has_next, has_previous = True, len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+
+        count = approximate_count(self.queryset) if self.with_count else None
+        return CursorPage(rows, self.ordering, has_next, has_previous, count)
+
+
+def paginate(request, queryset, ordering, per_page=10, with_count=False):
+    """Keyset-paginate ``queryset`` unless the client asked for ``?page=N``.
+
+    Returns ``(page, is_cursor_page)``; numbered pages keep working for old
+    links and bookmarks. Cursor pages only carry an ``approximate_count``
+    when ``with_count`` asks for one, as off PostgreSQL it is a COUNT(*).
+    """
+    if 'page' in request.GET:
+        paginator = Paginator(queryset.order_by(*ordering), per_page)
+        return paginator.get_page(request.GET.get('page')), False
+    paginator = CursorPaginator(queryset, ordering, per_page, with_count=with_count)
+    return paginator.page(request.GET.get('cursor')), True
@@ -0,0 +1,104 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, Max, Q, Sum
+from django.utils import timezone
+
+from . import metrics
+from .models import (
+    BookBorrowTally, Borrow, BorrowHistory, FineLedgerEntry, ReaderBorrowTally, ReportSnapshot,
+)
+
+
+ADMIN_REPORTS = 'admin_reports'
+CACHE_KEY = f'reports:{ADMIN_REPORTS}'
+# Log rows younger than this are left for the next refresh: on PostgreSQL a
+# lower id can still be uncommitted, and folding past it would skip it forever.
+SETTLE = timedelta(seconds=60)
+# Log ids read per GROUP BY, so no single query sorts the whole log.
+WINDOW = 50000
+
+
+def _add_to_tallies(model, key, counts, chunk_size=1000):
+    target = {'unique_fields': [key]} if connection.features.supports_update_conflicts_with_target else {}
+    pks = list(counts)
+    for start in range(0, len(pks), chunk_size):
+        chunk = pks[start:start + chunk_size]
+        existing = dict(model.objects.filter(pk__in=chunk).values_list('pk', 'borrows'))
+        model.objects.bulk_create(
+            [model(**{f'{key}_id': pk}, borrows=existing.get(pk, 0) + counts[pk]) for pk in chunk],
+            update_conflicts=True, update_fields=['borrows'], **target,
+        )
+
+
+def _fold_new_borrows(start, now):
+    """Add borrows logged after id ``start`` to the tallies; returns the new watermark."""
+    settled = BorrowHistory.objects.filter(id__gt=start, recorded_at__lt=now - SETTLE)
+    end = settled.aggregate(last=Max('id'))['last']
+    if end is None:
+        return start
+    counts = {'book': Counter(), 'user': Counter()}
+    for low in range(start, end, WINDOW):
+        window = BorrowHistory.objects.filter(id__gt=low, id__lte=min(low + WINDOW, end), status=BorrowHistory.BORROWED)
+        for key, counter in counts.items():
+            counter.update(dict(window.values(f'{key}_id').annotate(total=Count('id')).values_list(f'{key}_id', 'total')))
+    _add_to_tallies(BookBorrowTally, 'book', counts['book'])
+    _add_to_tallies(ReaderBorrowTally, 'user', counts['user'])
+    return end
+
+
+def _build_data():
+    most_borrowed = BookBorrowTally.objects.select_related('book').order_by('-borrows', 'book_id')[:5]
+    most_active = ReaderBorrowTally.objects.select_related('user').order_by('-borrows', 'user_id')[:5]
+    ledger = FineLedgerEntry.objects.aggregate(
+        charged=Sum('amount', filter=Q(kind=FineLedgerEntry.ACCRUAL), default=0),
+        collected=Sum('amount', filter=Q(kind=FineLedgerEntry.PAYMENT), default=0),
+    )
+    return {
+        'most_borrowed_books_labels': [tally.book.title for tally in most_borrowed],
+        'most_borrowed_books_data': [tally.borrows for tally in most_borrowed],
+        'most_active_readers_labels': [tally.user.username for tally in most_active],
+        'most_active_readers_data': [tally.borrows for tally in most_active],
+        'fine_totals': Borrow.objects.fine_totals(),
+        'top_fines': list(Borrow.objects.fines_by_user()[:5]),
+        'ledger_totals': {'charged': ledger['charged'], 'collected': -ledger['collected']},
+    }
+
+
+def refresh_snapshot(force=False, now=None):
+    """Bring the admin_reports snapshot up to date and return it.
+
+    Only log rows after the watermark are read, so a refresh costs the same
+    however long the library has been running; ``force`` drops the tallies
+    and recounts the whole log. Refreshes are serialized on the snapshot
+    row, and the cache is only updated once the new snapshot is committed.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        snapshot, _ = ReportSnapshot.objects.select_for_update().get_or_create(name=ADMIN_REPORTS)
+        if force:
+            BookBorrowTally.objects.all().delete()
+            ReaderBorrowTally.objects.all().delete()
+            snapshot.watermark = 0
+        snapshot.watermark = _fold_new_borrows(snapshot.watermark, now)
+        # The dashboard's reader count is read from the tallies.
+        metrics.invalidate()
+        snapshot.data = _build_data()
+        snapshot.refreshed_at = now
+        snapshot.save()
+        payload = {'data': snapshot.data, 'refreshed_at': snapshot.refreshed_at}
+        transaction.on_commit(lambda: cache.set(CACHE_KEY, payload, timeout=None))
+    return payload
+
+
+def get_snapshot():
+    """The latest snapshot, from the cache, else the table, else built now."""
+    payload = cache.get(CACHE_KEY)
+    if payload is None:
+        payload = ReportSnapshot.objects.filter(name=ADMIN_REPORTS, refreshed_at__isnull=False).values('data', 'refreshed_at').first()
+        if payload is None:
+            return refresh_snapshot()
+        cache.set(CACHE_KEY, payload, timeout=None)
+    return payload
@@ -0,0 +1,192 @@
+from collections import Counter
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Q, Sum
+from django.db.models.functions import Trunc, TruncDate
+from django.utils import timezone
+
+from .models import ArchivedBorrow, Book, Borrow, DailyCirculation
+
+
+FIELDS = ('borrowed', 'returned', 'overdue')
+BUCKETS = ('day', 'week', 'month')
+# Default backfill reach, and days rebuilt per transaction.
+HISTORY_DAYS = 730
+CHUNK_DAYS = 31
+
+
+def _day(at):
+    return timezone.localdate(at)
+
+
+def _midnight(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _genres(borrows):
+    missing = {borrow.book_id for borrow in borrows if not Borrow.book.is_cached(borrow)}
+    genres = dict(Book.objects.filter(id__in=missing).values_list('id', 'genre')) if missing else {}
+    return [
+        borrow.book.genre if Borrow.book.is_cached(borrow) else genres.get(borrow.book_id, 'other')
+        for borrow in borrows
+    ]
+
+
+def _apply(changes):
+    cells = sorted({(day, genre) for day, genre, _ in changes})
+    with transaction.atomic():
+        DailyCirculation.objects.bulk_create(
+            [DailyCirculation(day=day, genre=genre) for day, genre in cells], ignore_conflicts=True,
+        )
+        # Sorted, so concurrent updates lock the shared rows in the same order.
+        for day, genre in cells:
+            DailyCirculation.objects.filter(day=day, genre=genre).update(**{
+                field: F(field) + delta for (d, g, field), delta in changes.items() if (d, g) == (day, genre)
+            })
+
+
+def _bump(changes):
+    """Add ``{(day, genre, field): delta}`` to the rollups once the caller's transaction commits.
+
+    Every loan of a genre on a day shares one row, so updating it inside the
+    circulation transaction would serialise them all. A delta lost to a crash
+    after the commit is put right by ``backfill``.
+    """
+    changes = {key: delta for key, delta in changes.items() if delta}
+    if changes:
+        transaction.on_commit(lambda: _apply(changes))
+
+
+def loans_borrowed(borrows, at):
+    changes = Counter()
+    for borrow, genre in zip(borrows, _genres(borrows)):
+        changes[_day(at), genre, 'borrowed'] += 1
+        if borrow.due_date:
+            changes[_day(borrow.due_date), genre, 'overdue'] += 1
+    _bump(changes)
+
+
+def loan_returned(borrow, at):
+    genre, = _genres([borrow])
+    changes = Counter({(_day(at), genre, 'returned'): 1})
+    if borrow.due_date and at <= borrow.due_date:
+        changes[_day(borrow.due_date), genre, 'overdue'] -= 1
+    _bump(changes)
+
+
+def loan_renewed(borrow, previous_due):
+    genre, = _genres([borrow])
+    changes = Counter()
+    changes[_day(previous_due), genre, 'overdue'] -= 1
+    changes[_day(borrow.due_date), genre, 'overdue'] += 1
+    _bump(changes)
+
+
+def _count(model, field, start, end, *filters):
+    rows = (
+        model.objects.filter(*filters, **{f'{field}__gte': _midnight(start), f'{field}__lt': _midnight(end)})
+        .annotate(day=TruncDate(field))
+        .values('day', 'book__genre')
+        .annotate(total=Count('id'))
+        .order_by()
+    )
+    return {(row['day'], row['book__genre']): row['total'] for row in rows}
+
+
+def backfill(start=None, end=None, chunk_days=CHUNK_DAYS):
+    """Rebuild the rollups for days ``start`` to ``end`` (exclusive) from the loans.
+
+    Archived loans are counted too. Each chunk of days is recounted and
+    replaced in its own transaction, so the job can be stopped and rerun. A
+    loan that changes while its chunk is being rebuilt can be missed, so
+    rebuild recent days at a quiet time. By default covers the last
+    ``HISTORY_DAYS`` days through the last open loan's due date. Returns the
+    number of rows written.
+    """
+    today = timezone.localdate()
+    start = start or today - timedelta(days=HISTORY_DAYS)
+    if end is None:
+        last_due = Borrow.objects.filter(returned=False).aggregate(last=Max('due_date'))['last']
+        end = max(today, _day(last_due) if last_due else today) + timedelta(days=1)
+    late = Q(returned=False) | Q(returned_at__gt=F('due_date'))
+    written = 0
+    low = start
+    while low < end:
+        high = min(low + timedelta(days=chunk_days), end)
+        with transaction.atomic():
+            DailyCirculation.objects.filter(day__gte=low, day__lt=high).delete()
+            counts = {field: Counter() for field in FIELDS}
+            for model in (Borrow, ArchivedBorrow):
+                counts['borrowed'].update(_count(model, 'borrowed_at', low, high))
+                counts['returned'].update(_count(model, 'returned_at', low, high))
+                counts['overdue'].update(_count(model, 'due_date', low, high, late))
+            cells = set().union(*counts.values())
+            DailyCirculation.objects.bulk_create(
+                DailyCirculation(day=day, genre=genre, **{field: counts[field][day, genre] for field in FIELDS})
+                for day, genre in cells
+            )
+        written += len(cells)
+        low = high
+    return written
+
+
+def bucket_start(day, bucket):
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def bucket_count(start, end, bucket):
+    """How many buckets ``bucket_starts`` would return, without building them."""
+    first, last = bucket_start(start, bucket), bucket_start(end, bucket)
+    if bucket == 'month':
+        return max(0, (last.year - first.year) * 12 + last.month - first.month + 1)
+    return max(0, (last - first).days // (7 if bucket == 'week' else 1) + 1)
+
+
+def bucket_starts(start, end, bucket):
+    """Every bucket from the one holding ``start`` through the one holding ``end``."""
+    starts = []
+    current = bucket_start(start, bucket)
+    while current <= end:
+        starts.append(current)
+        if bucket == 'month':
+            current = (current.replace(day=28) + timedelta(days=4)).replace(day=1)
+        else:
+            current += timedelta(days=7 if bucket == 'week' else 1)
+    return starts
+
+
+def series(start, end, bucket='day', genre=None):
+    """Circulation from ``start`` to ``end`` (inclusive), summed per day, week or month.
+
+    One GROUP BY over the rollups; buckets with no activity are zero. Returns
+    the totals and a breakdown per genre, ready for JSON.
+    """
+    rows = DailyCirculation.objects.filter(day__gte=start, day__lte=end)
+    if genre:
+        rows = rows.filter(genre=genre)
+    period = F('day') if bucket == 'day' else Trunc('day', bucket)
+    rows = rows.annotate(period=period).values('period', 'genre').annotate(**{field: Sum(field) for field in FIELDS}).order_by()
+
+    labels = bucket_starts(start, end, bucket)
+    position = {label: i for i, label in enumerate(labels)}
+    totals = {field: [0] * len(labels) for field in FIELDS}
+    genres = {}
+    for row in rows:
+        i = position[row['period']]
+        per_genre = genres.setdefault(row['genre'], {field: [0] * len(labels) for field in FIELDS})
+        for field in FIELDS:
+            totals[field][i] += row[field]
+            per_genre[field][i] += row[field]
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'bucket': bucket,
+        'labels': [label.isoformat() for label in labels],
+        'totals': totals,
+        'genres': genres,
+    }
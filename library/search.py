@@ -0,0 +1,171 @@
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Q
+from django.db.models.expressions import RawSQL
+
+
+# Name of the SQLite FTS5 table mirroring library_book (see migration 0015).
+FTS_TABLE = 'library_book_fts'
+
+# Relative weight of each indexed column: title, author, description.
+SQLITE_WEIGHTS = (10.0, 5.0, 1.0)
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS library_book_fts USING fts5(
+        title, author, description,
+        content='library_book', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS library_book_fts_ai AFTER INSERT ON library_book BEGIN
+        INSERT INTO library_book_fts(rowid, title, author, description)
+        VALUES (new.id, new.title, new.author, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS library_book_fts_ad AFTER DELETE ON library_book BEGIN
+        INSERT INTO library_book_fts(library_book_fts, rowid, title, author, description)
+        VALUES ('delete', old.id, old.title, old.author, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS library_book_fts_au AFTER UPDATE OF title, author, description ON library_book
+    WHEN old.title IS NOT new.title OR old.author IS NOT new.author OR old.description IS NOT new.description
+    BEGIN
+        INSERT INTO library_book_fts(library_book_fts, rowid, title, author, description)
+        VALUES ('delete', old.id, old.title, old.author, old.description);
+        INSERT INTO library_book_fts(rowid, title, author, description)
+        VALUES (new.id, new.title, new.author, new.description);
+    END
+    """,
+    "INSERT INTO library_book_fts(library_book_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARD = [
+    'DROP TRIGGER IF EXISTS library_book_fts_au',
+    'DROP TRIGGER IF EXISTS library_book_fts_ad',
+    'DROP TRIGGER IF EXISTS library_book_fts_ai',
+    'DROP TABLE IF EXISTS library_book_fts',
+]
+
+POSTGRES_FORWARD = [
+    """
+    ALTER TABLE library_book ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(author, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'C')
+    ) STORED
+    """,
+    'CREATE INDEX IF NOT EXISTS library_book_search_vector_gin ON library_book USING GIN (search_vector)',
+]
+
+POSTGRES_BACKWARD = [
+    'DROP INDEX IF EXISTS library_book_search_vector_gin',
+    'ALTER TABLE library_book DROP COLUMN IF EXISTS search_vector',
+]
+
+
+def search_backend():
+    """Return the full-text backend available on the current database."""
+    if connection.vendor == 'sqlite':
+        return 'fts5'
+    if connection.vendor == 'postgresql':
+        return 'tsvector'
+    return 'icontains'
+
+
+def fts5_match_expression(query):
+    """Turn free user input into a safe FTS5 MATCH expression.
+
+    Every word becomes a quoted prefix term so punctuation in the input can
+    never be interpreted as FTS5 syntax; terms are implicitly AND-ed.
+    """
+    tokens = TOKEN_RE.findall(query)
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def search_books(queryset, query):
+    """Filter a Book queryset by ``query`` and order it by relevance.
+
+    Returns the queryset annotated with ``search_rank``; on backends without
+    a full-text index it falls back to the old icontains lookups.
+    """
+    query = query.strip()
+    if not query:
+        return queryset
+
+    backend = search_backend()
+
+    if backend == 'fts5':
+        match = fts5_match_expression(query)
+        if not match:
+            return queryset.none()
+        # Join the FTS table directly so bm25() is computed in the same scan
+        # that finds the matches; bm25() is negative, lower is more relevant.
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = library_book.id', f'{FTS_TABLE} MATCH %s'],
+            params=[match],
+            select={'search_rank': f'-bm25({FTS_TABLE}, %s, %s, %s)'},
+            select_params=SQLITE_WEIGHTS,
+        ).order_by('-search_rank', 'title', 'id')
+
+    if backend == 'tsvector':
+        matches = RawSQL(
+            "library_book.search_vector @@ websearch_to_tsquery('english', %s)",
+            [query],
+            output_field=BooleanField(),
+        )
+        rank = RawSQL(
+            "ts_rank(library_book.search_vector, websearch_to_tsquery('english', %s))",
+            [query],
+            output_field=FloatField(),
+        )
+        return (
+            queryset.filter(matches)
+            .annotate(search_rank=rank)
+            .order_by('-search_rank', 'title', 'id')
+        )
+
+    return queryset.filter(
+        Q(title__icontains=query) | Q(author__icontains=query) | Q(description__icontains=query)
+    ).order_by('title', 'id')
+
+
+def run_statements(db_connection, statements):
+    with db_connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def install_search_index(db_connection=connection):
+    """Create the full-text index and its sync triggers; safe to rerun.
+
+    SQLite drops triggers whenever a migration rebuilds library_book, so any
+    such migration must recreate them afterwards (as 0019 does).
+    """
+    if db_connection.vendor == 'sqlite':
+        run_statements(db_connection, SQLITE_FORWARD)
+    elif db_connection.vendor == 'postgresql':
+        run_statements(db_connection, POSTGRES_FORWARD)
+
+
+def drop_search_index(db_connection=connection):
+    if db_connection.vendor == 'sqlite':
+        run_statements(db_connection, SQLITE_BACKWARD)
+    elif db_connection.vendor == 'postgresql':
+        run_statements(db_connection, POSTGRES_BACKWARD)
+
+
+def rebuild_search_index():
+    """Recreate missing triggers and rebuild the index from library_book."""
+    install_search_index()
+    if connection.vendor == 'postgresql':
+        # search_vector is a generated column; REINDEX refreshes the GIN index.
+        run_statements(connection, ['REINDEX INDEX library_book_search_vector_gin'])
+    return search_backend()
@@ -0,0 +1,35 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from . import catalog_cache, facets, metrics, suggest
+from .models import Book
+
+
+@receiver(post_init, sender=Book)
+def book_loaded(sender, instance, **kwargs):
+    # Remember the facet cell the row was loaded in; __dict__ avoids
+    # triggering a query for deferred fields.
+    instance._facet_state = (instance.__dict__.get('genre'), instance.__dict__.get('available'))
+
+
+@receiver(post_save, sender=Book)
+def book_saved(sender, instance, created, **kwargs):
+    suggest.book_saved(instance)
+    catalog_cache.bump_version()
+    metrics.invalidate()
+
+    if created:
+        facets.book_added(instance.genre, instance.available)
+    elif None in instance._facet_state:
+        facets.invalidate()
+    else:
+        facets.book_changed(*instance._facet_state, instance.genre, instance.available)
+    instance._facet_state = (instance.genre, instance.available)
+
+
+@receiver(post_delete, sender=Book)
+def book_deleted(sender, instance, **kwargs):
+    suggest.book_deleted(instance.id)
+    catalog_cache.bump_version()
+    metrics.invalidate()
+    facets.book_removed(*instance._facet_state)
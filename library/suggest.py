@@ -0,0 +1,192 @@
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db import connection, transaction
+
+
+# Entries scanned per lookup before ranking; keeps worst-case latency bounded.
+MAX_SCAN = 200
+
+
+def normalize(text):
+    return ' '.join(text.lower().split())
+
+
+class PrefixIndex:
+    """Sorted-array prefix index over book titles and authors.
+
+    Every title and author is stored once per word start, so "gats" completes
+    "The Great Gatsby" as well as "the gr". Lookups are a bisect plus a short
+    forward scan, and never touch the database once the index is loaded.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = []
+        self._by_book = {}
+        # Changes made while a reload is reading the table, replayed over it.
+        self._journal = None
+        self.loaded_at = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _book_entries(self, book_id, title, author):
+        entries = set()
+        for field, value in (('title', title), ('author', author)):
+            words = normalize(value).split(' ')
+            for start in range(len(words)):
+                key = ' '.join(words[start:])
+                if key:
+                    entries.add((key, start == 0, value, field, book_id))
+        return sorted(entries)
+
+    @property
+    def tracking(self):
+        return self.loaded_at is not None or self._journal is not None
+
+    def begin_reload(self):
+        with self._lock:
+            self._journal = []
+
+    def load(self, rows):
+        """Replace the index with ``rows`` of (book_id, title, author).
+
+        Changes since ``begin_reload`` are applied again on top, as ``rows``
+        may have been read before they committed.
+        """
+        entries = []
+        by_book = {}
+        for book_id, title, author in rows:
+            book_entries = self._book_entries(book_id, title, author)
+            by_book[book_id] = book_entries
+            entries.extend(book_entries)
+        entries.sort()
+        with self._lock:
+            self._entries = entries
+            self._by_book = by_book
+            for change in self._journal or ():
+                self._apply(*change)
+            self._journal = None
+            self.loaded_at = time.monotonic()
+
+    def add(self, book_id, title, author):
+        self._change(book_id, title, author)
+
+    def remove(self, book_id):
+        self._change(book_id)
+
+    def _change(self, book_id, *book):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((book_id, *book))
+            self._apply(book_id, *book)
+
+    def _apply(self, book_id, title=None, author=None):
+        self._remove(book_id)
+        if title is not None:
+            book_entries = self._book_entries(book_id, title, author)
+            for entry in book_entries:
+                insort(self._entries, entry)
+            self._by_book[book_id] = book_entries
+
+    def _remove(self, book_id):
+        for entry in self._by_book.pop(book_id, ()):
+            position = bisect_left(self._entries, entry)
+            if position < len(self._entries) and self._entries[position] == entry:
+                del self._entries[position]
+
+    def suggest(self, prefix, limit=10):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        with self._lock:
+            entries = self._entries
+            position = bisect_left(entries, (prefix,))
+            candidates = []
+            while position < len(entries) and len(candidates) < MAX_SCAN:
+                entry = entries[position]
+                if not entry[0].startswith(prefix):
+                    break
+                candidates.append(entry)
+                position += 1
+
+        # Matches at the start of a title/author beat mid-string word matches.
+        candidates.sort(key=lambda entry: (not entry[1], len(entry[2]), entry[2].lower()))
+        suggestions = []
+        seen = set()
+        for _, _, value, field, book_id in candidates:
+            if (field, value) in seen:
+                continue
+            seen.add((field, value))
+            suggestions.append({'value': value, 'field': field, 'book_id': book_id})
+            if len(suggestions) == limit:
+                break
+        return suggestions
+
+
+_index = PrefixIndex()
+_load_lock = threading.Lock()
+_refreshing = False
+
+
+def refresh_index():
+    """Reload this worker's index from the Book table."""
+    from .models import Book
+    _index.begin_reload()
+    _index.load(Book.objects.values_list('id', 'title', 'author').iterator(chunk_size=5000))
+
+
+def _refresh_in_background():
+    global _refreshing
+    try:
+        refresh_index()
+    finally:
+        connection.close()
+        with _load_lock:
+            _refreshing = False
+
+
+def _start_refresh():
+    global _refreshing
+    with _load_lock:
+        if _refreshing:
+            return
+        _refreshing = True
+    threading.Thread(target=_refresh_in_background, name='suggest-index-refresh', daemon=True).start()
+
+
+def get_index():
+    """Return this worker's index, loading it on first use.
+
+    Signals keep the index current for committed writes made by this
+    worker. Once it is older than the SUGGEST_INDEX_TTL setting (seconds) a
+    background thread reloads it, picking up other workers and bulk writes
+    that bypass signals, while requests keep reading the current one.
+    """
+    if _index.loaded_at is None:
+        with _load_lock:
+            if _index.loaded_at is None:
+                refresh_index()
+    elif time.monotonic() - _index.loaded_at > getattr(settings, 'SUGGEST_INDEX_TTL', 300):
+        _start_refresh()
+    return _index
+
+
+def book_saved(book):
+    if _index.tracking:
+        book_id, title, author = book.id, book.title, book.author
+        transaction.on_commit(lambda: _index.add(book_id, title, author))
+
+
+def book_deleted(book_id):
+    if _index.tracking:
+        transaction.on_commit(lambda: _index.remove(book_id))
+
+
+def reset_index():
+    with _load_lock:
+        _index.load([])
+        _index.loaded_at = None
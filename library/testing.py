@@ -0,0 +1,83 @@
+import re
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+# Plan lines that mean "read the whole table": SQLite prints "SCAN <table>"
+# (without "USING INDEX"), PostgreSQL prints "Seq Scan on <table>".
+SQLITE_TABLE_SCAN = re.compile(r'\bSCAN (?P<table>\w+)(?! USING (?:COVERING )?INDEX)\s*$')
+POSTGRES_TABLE_SCAN = re.compile(r'Seq Scan on (?P<table>\w+)')
+
+
+def analyze_tables():
+    """Refresh planner statistics after seeding so plans reflect the data."""
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def sequential_scans(queryset):
+    """Return the tables ``queryset`` reads with a full sequential scan."""
+    plan = queryset.explain()
+    pattern = POSTGRES_TABLE_SCAN if connection.vendor == 'postgresql' else SQLITE_TABLE_SCAN
+    tables = []
+    for line in plan.splitlines():
+        match = pattern.search(line.strip())
+        if match:
+            tables.append(match.group('table'))
+    return tables
+
+
+class QueryPlanMixin:
+    """TestCase mixin asserting that hot queries are served from an index."""
+
+    def assertUsesIndex(self, queryset, msg=None):
+        scans = sequential_scans(queryset)
+        if scans:
+            self.fail(msg or (
+                f"Query falls back to a sequential scan of {', '.join(scans)}:\n"
+                f"{queryset.query}\n\n{queryset.explain()}"
+            ))
+
+
+class QueryBudgetMixin:
+    """TestCase mixin that caps the number of SQL queries a view may run.
+
+    Subclasses declare ``query_budgets = {url: max_queries}`` and a
+    ``row_factory`` method that adds more of the rows the views list;
+    ``assertQueryBudgets()`` then checks every URL against its budget both
+    before and after ``row_factory()``, so an N+1 pattern fails even when it
+    still fits under the cap for a small fixture.
+    """
+
+    query_budgets = {}
+    row_factory = None
+
+    @classmethod
+    def setUpClass(cls):
+        if cls.row_factory is None:
+            raise ImproperlyConfigured(f'{cls.__name__} must set row_factory to use QueryBudgetMixin.')
+        super().setUpClass()
+
+    def capture_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, f'GET {url} returned {response.status_code}')
+        return [query['sql'] for query in context.captured_queries]
+
+    def assertQueryBudget(self, url, max_queries):
+        queries = self.capture_queries(url)
+        if len(queries) > max_queries:
+            self.fail(
+                f'GET {url} ran {len(queries)} queries, budget is {max_queries}:\n' + '\n'.join(queries)
+            )
+        return len(queries)
+
+    def assertQueryBudgets(self):
+        before = {url: self.assertQueryBudget(url, budget) for url, budget in self.query_budgets.items()}
+        self.row_factory()
+        for url, budget in self.query_budgets.items():
+            with self.subTest(url=url):
+                after = self.assertQueryBudget(url, budget)
+                self.assertEqual(after, before[url], f'Query count for GET {url} grows with the number of rows')
@@ -1,11 +1,47 @@
-from django.test import TestCase, Client
+import importlib
+import json
+import os
+import tempfile
+import tracemalloc
+from io import StringIO
+from smtplib import SMTPException
+from unittest import mock
+
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.test import TestCase, TransactionTestCase, Client, RequestFactory, override_settings
 from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import get_connection
+from django.db import connection
+from django.db.models import F
+from django.http import StreamingHttpResponse
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
-from datetime import timedelta
+from datetime import date, timedelta
 
-from .models import Book, Borrow, Reader, UserProfile
-from .forms import CustomPasswordChangeForm
+from .expressions import DaysBetween
+from .models import (
+    ArchivedBorrow, Book, BookBorrowTally, Borrow, BorrowHistory, DailyCirculation, FineAccrualRun, FineLedgerEntry,
+    Hold, OutboxEmail, Reader, ReaderBorrowTally, ReportSnapshot, TrendingBucket, UserProfile,
+)
+from .forms import BookForm, CustomPasswordChangeForm
+from .management.commands.import_books import iter_json_array
+from .middleware import RequestMetricsMiddleware
+from .benchmarks import fire_concurrent_borrows, python_loan_analytics, seed_books, seed_circulation
+from .circulation import (
+    MAX_RENEWALS, claim_book, claim_books, expire_holds, place_hold, queue_position, release_hold, renew_borrow,
+    return_borrow,
+)
+from .pagination import CursorPaginator
+from .search import search_books
+from . import analytics, catalog_cache, facets, fines, metrics, outbox, reports, rollups, suggest, trending
+from .archive import archive_returned_loans
+from .fines import accrue_fines
+from .testing import QueryBudgetMixin, QueryPlanMixin, analyze_tables
 
 
 class BookListViewTest(TestCase):
@@ -14,6 +50,9 @@ class BookListViewTest(TestCase):
         Book.objects.create(title='Test Book 1', author='Author 1', available=True)
         Book.objects.create(title='Test Book 2', author='Author 2', available=True)
 
+    def setUp(self):
+        cache.clear()
+
     def test_view_url_exists_at_desired_location(self):
         response = self.client.get('/books/')
         self.assertEqual(response.status_code, 200)
@@ -31,6 +70,486 @@ class BookListViewTest(TestCase):
         self.assertEqual(len(response.context['page_obj']), 2)
 
 
+class BookSearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.title_match = Book.objects.create(title='Dune', author='Frank Herbert', description='Desert planet.')
+        cls.description_match = Book.objects.create(
+            title='Sand and Stars', author='A. Writer', description='A reread of Dune and its sequels.'
+        )
+        Book.objects.create(title='Emma', author='Jane Austen', description='A comedy of manners.')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_matches_title_author_and_description(self):
+        self.assertEqual(list(search_books(Book.objects.all(), 'austen').values_list('title', flat=True)), ['Emma'])
+        self.assertEqual(list(search_books(Book.objects.all(), 'desert').values_list('title', flat=True)), ['Dune'])
+
+    def test_ranks_title_match_first(self):
+        results = list(search_books(Book.objects.all(), 'dune'))
+        self.assertEqual(results, [self.title_match, self.description_match])
+
+    def test_prefix_and_punctuation_are_safe(self):
+        self.assertEqual(search_books(Book.objects.all(), 'herb').get(), self.title_match)
+        self.assertFalse(search_books(Book.objects.all(), '"(*').exists())
+
+    def test_index_follows_save_and_delete(self):
+        self.title_match.title = 'Children of Dune'
+        self.title_match.description = 'Sequel.'
+        self.title_match.save()
+        self.assertTrue(search_books(Book.objects.all(), 'children').exists())
+        self.assertFalse(search_books(Book.objects.all(), 'desert').exists())
+
+        self.title_match.delete()
+        self.assertFalse(search_books(Book.objects.all(), 'children').exists())
+
+    def test_book_list_uses_search(self):
+        response = self.client.get(reverse('book_list'), {'q': 'manners'})
+        self.assertEqual([book.title for book in response.context['page_obj']], ['Emma'])
+
+
+class BookSuggestTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.gatsby = Book.objects.create(title='The Great Gatsby', author='F. Scott Fitzgerald')
+        Book.objects.create(title='Great Expectations', author='Charles Dickens')
+        Book.objects.create(title='Emma', author='Jane Austen')
+
+    def setUp(self):
+        suggest.reset_index()
+
+    def test_completes_titles_authors_and_word_starts(self):
+        index = suggest.get_index()
+        self.assertEqual([s['value'] for s in index.suggest('great')], ['Great Expectations', 'The Great Gatsby'])
+        self.assertEqual(index.suggest('gats')[0]['book_id'], self.gatsby.id)
+        self.assertEqual(index.suggest('jane')[0]['field'], 'author')
+        self.assertEqual(index.suggest('zzz'), [])
+
+    def test_signals_update_loaded_index(self):
+        index = suggest.get_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            book = Book.objects.create(title='Gathering Storm', author='Winston Churchill')
+        self.assertIn('Gathering Storm', [s['value'] for s in index.suggest('gath')])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            book.title = 'The Hinge of Fate'
+            book.save()
+        self.assertNotIn('Gathering Storm', [s['value'] for s in index.suggest('gath')])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            book.delete()
+        self.assertEqual(index.suggest('hinge'), [])
+
+    def test_uncommitted_writes_stay_out_of_the_index(self):
+        index = suggest.get_index()
+        with self.captureOnCommitCallbacks() as callbacks:
+            Book.objects.create(title='Gathering Storm', author='Winston Churchill')
+        self.assertEqual(index.suggest('gath'), [])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(index.suggest('gath')[0]['value'], 'Gathering Storm')
+
+    def test_stale_index_reloads_in_the_background(self):
+        index = suggest.get_index()
+        Book.objects.bulk_create([Book(title='Persuasion', author='Jane Austen')])
+        with override_settings(SUGGEST_INDEX_TTL=0), mock.patch('library.suggest.threading.Thread') as thread:
+            with self.assertNumQueries(0):
+                self.assertIs(suggest.get_index(), index)
+            suggest.get_index()
+        thread.assert_called_once()
+        self.assertEqual(index.suggest('pers'), [])
+
+        suggest.refresh_index()
+        self.assertEqual(index.suggest('pers')[0]['value'], 'Persuasion')
+
+    def test_reload_keeps_changes_made_while_reading(self):
+        index = suggest.PrefixIndex()
+        index.load([(1, 'Emma', 'Jane Austen'), (2, 'Ivanhoe', 'Walter Scott')])
+        index.begin_reload()
+        index.add(3, 'Persuasion', 'Jane Austen')
+        index.remove(2)
+        index.load([(1, 'Emma', 'Jane Austen'), (2, 'Ivanhoe', 'Walter Scott')])
+        self.assertEqual([s['value'] for s in index.suggest('jane')], ['Jane Austen'])
+        self.assertEqual(index.suggest('pers')[0]['book_id'], 3)
+        self.assertEqual(index.suggest('ivan'), [])
+
+    def test_endpoint_does_not_query_database_once_loaded(self):
+        suggest.get_index()
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('book_suggest'), {'q': 'Em'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['suggestions'][0]['value'], 'Emma')
+
+
+class CursorPaginationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Duplicate titles make sure the id tie-breaker is honoured.
+        Book.objects.bulk_create(Book(title=f'Book {i % 9:02d}', author='Author') for i in range(25))
+        cls.expected = list(Book.objects.order_by('title', 'id').values_list('id', flat=True))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_walks_forward_and_back_without_gaps(self):
+        paginator = CursorPaginator(Book.objects.all(), ('title', 'id'), per_page=10)
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_cursor))
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual([book.id for page in pages for book in page], self.expected)
+
+        previous = paginator.page(pages[-1].previous_cursor)
+        self.assertEqual([book.id for book in previous], self.expected[10:20])
+        self.assertTrue(previous.has_previous())
+        self.assertFalse(paginator.page(pages[1].previous_cursor).has_previous())
+
+    def test_page_uses_one_query_without_count(self):
+        paginator = CursorPaginator(Book.objects.all(), ('title', 'id'), per_page=10)
+        cursor = paginator.page().next_cursor
+        with self.assertNumQueries(1):
+            paginator.page(cursor)
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        page = CursorPaginator(Book.objects.all(), ('title', 'id'), per_page=10).page('not-a-cursor')
+        self.assertEqual([book.id for book in page], self.expected[:10])
+
+    def test_book_list_cursor_and_page_fallback(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('book_list'))
+        self.assertTrue(response.context['cursor_pagination'])
+        # Taken from the facet counters rather than a COUNT(*) per page.
+        self.assertEqual(response.context['page_obj'].approximate_count, 25)
+        self.assertFalse([q['sql'] for q in queries.captured_queries if 'COUNT(*)' in q['sql'] and 'library_book' in q['sql']])
+        self.assertEqual(self.client.get(reverse('book_list'), {'genre': 'fiction'}).context['page_obj'].approximate_count, 0)
+        second = self.client.get(reverse('book_list'), {'cursor': response.context['page_obj'].next_cursor})
+        self.assertEqual([book.id for book in second.context['page_obj']], self.expected[10:20])
+
+        numbered = self.client.get(reverse('book_list'), {'page': 2})
+        self.assertFalse(numbered.context['cursor_pagination'])
+        self.assertEqual([book.id for book in numbered.context['page_obj']], self.expected[10:20])
+
+
+class HotQueryPlanTest(QueryPlanMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_books(3000)
+        cls.user_ids = seed_circulation(users=200, borrows=8000)
+        analyze_tables()
+
+    def hot_queries(self):
+        now = timezone.now()
+        user_id = self.user_ids[0]
+        return {
+            'book_list': Book.objects.order_by('title', 'id')[:11],
+            'book_list genre+available': Book.objects.filter(genre='fiction', available=True).order_by('title', 'id')[:11],
+            'book_list genre': Book.objects.filter(genre='mystery').order_by('title', 'id')[:11],
+            'active borrows of user': Borrow.objects.filter(user_id=user_id, returned=False),
+            'overdue borrows': Borrow.objects.filter(returned=False, due_date__lt=now),
+            'borrow history': Borrow.objects.filter(user_id=user_id).order_by('-borrowed_at'),
+            'reader_list': Reader.objects.order_by('name', 'id')[:11],
+        }
+
+    def test_hot_queries_use_indexes(self):
+        for name, queryset in self.hot_queries().items():
+            with self.subTest(name):
+                self.assertUsesIndex(queryset)
+
+
+class ViewQueryBudgetTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.password = 'St@ff$trongP@ss1'
+        self.staff = User.objects.create_user(username='staff', password=self.password, is_staff=True)
+        self.reader = Reader.objects.create(
+            name='Staff Reader', contact='1234567890', reference_id='REF1', address='Desk', user=self.staff
+        )
+        self.add_borrows(3)
+        cache.clear()
+        facets.get_facet_counts()
+        reports.refresh_snapshot()
+        trending.refresh_trending()
+        trending.get_trending()
+        self.client.login(username='staff', password=self.password)
+        self.query_budgets = {
+            reverse('book_list'): 5,
+            reverse('borrowed_books'): 5,
+            reverse('borrow_history'): 4,
+            reverse('overdue_books_user'): 4,
+            reverse('user_profile'): 4,
+            reverse('reader_detail', args=[self.reader.id]): 6,
+            reverse('admin_dashboard'): 5,
+            reverse('admin_reports'): 6,
+        }
+
+    def add_borrows(self, count):
+        for i in range(count):
+            borrower = User.objects.create_user(username=f'borrower{Borrow.objects.count()}')
+            for user in (self.staff, borrower):
+                book = Book.objects.create(title=f'Budget Book {Book.objects.count()}', author='Author', available=False)
+                Borrow.objects.create(user=user, book=book, due_date=timezone.now() - timedelta(days=i + 1))
+                Borrow.objects.create(user=user, book=book, returned=True, returned_at=timezone.now())
+
+    def add_rows(self):
+        self.add_borrows(10)
+        # Measure the uncached catalog path again, with warm facet counters.
+        cache.clear()
+        facets.get_facet_counts()
+        trending.get_trending()
+
+    row_factory = add_rows
+
+    def test_views_stay_within_query_budget(self):
+        self.assertQueryBudgets()
+
+
+class QueryBudgetMixinTest(TestCase):
+    def test_row_factory_is_required(self):
+        class NoRows(QueryBudgetMixin, TestCase):
+            query_budgets = {'/': 1}
+
+            def test_nothing(self):
+                pass
+
+        with self.assertRaisesMessage(ImproperlyConfigured, 'NoRows must set row_factory'):
+            NoRows.setUpClass()
+
+
+class RequestMetricsMiddlewareTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Book.objects.create(title='Timed Book', author='Author T')
+
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(REQUEST_METRICS_SAMPLE_RATE=1.0, DEBUG=False)
+    def test_sampled_request_gets_server_timing_and_log_line(self):
+        with self.assertLogs('library.metrics', level='INFO') as logs:
+            response = self.client.get(reverse('book_list'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+, total;dur=[\d.]+$')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'book_list')
+        self.assertEqual(record['status'], 200)
+        self.assertGreater(record['queries'], 0)
+        self.assertGreater(record['template_ms'], 0)
+
+    @override_settings(REQUEST_METRICS_SAMPLE_RATE=1.0)
+    def test_streamed_body_is_measured_until_it_is_consumed(self):
+        def rows():
+            yield 'count\n'
+            yield f'{Book.objects.count()}\n'
+
+        middleware = RequestMetricsMiddleware(lambda request: StreamingHttpResponse(rows()))
+        response = middleware(RequestFactory().get('/export/'))
+        self.assertNotIn('Server-Timing', response)
+        with self.assertLogs('library.metrics', level='INFO') as logs:
+            self.assertEqual(b''.join(response.streaming_content), b'count\n1\n')
+        self.assertEqual(json.loads(logs.records[0].getMessage())['queries'], 1)
+
+    @override_settings(REQUEST_METRICS_SAMPLE_RATE=0.0)
+    def test_unsampled_request_is_untouched(self):
+        response = self.client.get(reverse('book_list'))
+        self.assertNotIn('Server-Timing', response)
+
+
+class FacetCountTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.fiction = Book.objects.create(title='Novel', author='A', genre='fiction', available=True)
+        Book.objects.create(title='Memoir', author='B', genre='biography', available=False)
+
+    def test_counts_are_built_once_then_served_from_cache(self):
+        with self.assertNumQueries(1):
+            counts = facets.get_facet_counts()
+        self.assertEqual(counts[('fiction', True)], 1)
+        self.assertEqual(counts[('biography', False)], 1)
+        with self.assertNumQueries(0):
+            facets.get_facet_counts()
+
+    def test_counters_follow_save_delete_and_borrow(self):
+        facets.get_facet_counts()
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.create(title='Second Novel', author='C', genre='fiction', available=True)
+            self.fiction.available = False
+            self.fiction.save()
+        with self.assertNumQueries(0):
+            counts = facets.get_facet_counts()
+        self.assertEqual(counts[('fiction', True)], 1)
+        self.assertEqual(counts[('fiction', False)], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.fiction.delete()
+        cached = facets.get_facet_counts()
+        self.assertEqual(cached[('fiction', False)], 0)
+        facets.rebuild_facet_counts()
+        self.assertEqual(facets.get_facet_counts(), cached)
+
+    def test_summary_narrows_by_other_filter(self):
+        genre_counts, availability_counts = facets.summarize(facets.get_facet_counts(), 'fiction', 'unavailable')
+        self.assertEqual(genre_counts['fiction'], 0)
+        self.assertEqual(genre_counts['biography'], 1)
+        self.assertEqual(availability_counts, {'available': 1, 'unavailable': 0})
+
+    def test_book_list_shows_counts(self):
+        response = self.client.get(reverse('book_list'))
+        self.assertContains(response, 'Fiction (1)')
+        self.assertContains(response, 'Unavailable (1)')
+
+
+class CatalogPageCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.book = Book.objects.create(title='Cached Book', author='Author C')
+
+    def test_anonymous_revalidation_returns_304(self):
+        response = self.client.get(reverse('book_list'), {'genre': 'other'})
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+        again = self.client.get(reverse('book_list'), {'genre': 'other'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+        other_filter = self.client.get(reverse('book_list'), {'genre': 'fiction'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(other_filter.status_code, 200)
+
+    def test_anonymous_page_served_from_cache_until_catalog_changes(self):
+        first = self.client.get(reverse('book_list'))
+        with self.assertNumQueries(0):
+            cached = self.client.get(reverse('book_list'))
+        self.assertEqual(cached.content, first.content)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.title = 'Renamed Book'
+            self.book.save()
+        fresh = self.client.get(reverse('book_list'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(fresh.status_code, 200)
+        self.assertContains(fresh, 'Renamed Book')
+
+    def test_shared_page_carries_no_csrf_token(self):
+        self.book.available = False
+        self.book.available_copies = 0
+        self.book.save()
+        first, second = Client(enforce_csrf_checks=True), Client(enforce_csrf_checks=True)
+        first.get(reverse('book_list'))
+        response = second.get(reverse('book_list'))
+        self.assertNotContains(response, 'csrfmiddlewaretoken')
+        self.assertContains(response, 'Log in to place a hold')
+        # The login page hands the second visitor their own token, and it works.
+        login = second.get(reverse('login'), {'next': reverse('book_list')})
+        self.assertNotIn('csrftoken', first.cookies)
+        self.assertIn('csrftoken', second.cookies)
+        password = 'User$trongP@ss1'
+        User.objects.create_user(username='holder', password=password)
+        response = second.post(reverse('login'), {
+            'username': 'holder', 'password': password, 'next': reverse('book_list'),
+            'csrfmiddlewaretoken': login.context['csrf_token'],
+        })
+        self.assertRedirects(response, reverse('book_list'), fetch_redirect_response=False)
+        page = second.get(reverse('book_list'))
+        self.assertContains(page, 'Place Hold')
+        hold = second.post(reverse('hold_book', args=[self.book.id]), {'csrfmiddlewaretoken': page.context['csrf_token']})
+        self.assertEqual(hold.status_code, 302)
+        self.assertTrue(Hold.objects.filter(book=self.book, user__username='holder').exists())
+
+    def test_authenticated_users_reuse_shared_part_but_get_own_borrows(self):
+        password = 'User$trongP@ss1'
+        user = User.objects.create_user(username='reader', password=password)
+        Borrow.objects.create(user=user, book=self.book)
+        self.client.get(reverse('book_list'))
+        self.client.login(username='reader', password=password)
+
+        with self.assertNumQueries(3):  # session, user, the user's borrows
+            response = self.client.get(reverse('book_list'))
+        self.assertNotIn('ETag', response)
+        self.assertContains(response, 'You borrowed this')
+
+
+class ImportBooksCommandTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.tempdir.name, name)
+        with open(path, 'w', encoding='utf-8') as fh:
+            fh.write(content)
+        return path
+
+    def import_books(self, path, **options):
+        out = StringIO()
+        call_command('import_books', path, stdout=out, stderr=StringIO(), **options)
+        return out.getvalue()
+
+    def test_imports_fixture_shaped_json(self):
+        fixture = os.path.join(settings.BASE_DIR, 'books.json')
+        with open(fixture, encoding='utf-8') as fh:
+            expected = {(row['fields']['title'], row['fields']['author']) for row in json.load(fh)}
+        self.import_books(fixture, batch_size=3)
+        self.assertEqual(set(Book.objects.values_list('title', 'author')), expected)
+
+    def test_csv_validates_and_dedupes(self):
+        Book.objects.create(title='Existing', author='Someone')
+        path = self.write('books.csv', (
+            'title,author,description,genre,available\n'
+            'Dune,Frank Herbert,Desert,sci-fi,yes\n'
+            'Dune,Frank Herbert,Again,sci-fi,yes\n'
+            'Existing,Someone,,other,no\n'
+            ',No Title,,other,yes\n'
+            'Emma,Jane Austen,,not-a-genre,yes\n'
+            'Loaned,Author L,,fiction,0\n'
+        ))
+        output = self.import_books(path, batch_size=2)
+        self.assertIn('Imported 2 books from 6 records (2 duplicates, 2 invalid)', output)
+        self.assertTrue(Book.objects.get(title='Dune').available)
+        self.assertFalse(Book.objects.get(title='Loaned').available)
+        self.assertFalse(os.path.exists(path + '.checkpoint'))
+
+    def test_json_items_split_across_reads(self):
+        records = [{'title': f'Book {i} \u00e9', 'author': 'Author', 'total_copies': 12345} for i in range(40)]
+        stream = StringIO(json.dumps(records))
+        with mock.patch('library.management.commands.import_books.READ_SIZE', 7):
+            self.assertEqual(list(iter_json_array(stream)), records)
+
+    def test_json_syntax_error_names_the_record(self):
+        stream = StringIO('[{"title": "A"}, {"title": "B" "author": "C"}, ' + '{"title": "D"}, ' * 10000 + ']')
+        with mock.patch('library.management.commands.import_books.READ_SIZE', 64):
+            with self.assertRaisesMessage(CommandError, "Invalid JSON in record 2: Expecting ',' delimiter."):
+                list(iter_json_array(stream))
+        self.assertLess(stream.tell(), 1000)
+
+    def test_truncated_json_names_the_record(self):
+        with self.assertRaisesMessage(CommandError, 'Unexpected end of JSON input in record 2.'):
+            list(iter_json_array(StringIO('[{"title": "A"}, {"title": "B')))
+
+    def test_applies_book_form_copy_rules(self):
+        path = self.write('books.csv', (
+            'title,author,total_copies\n'
+            'Default,Author,\n'
+            'Several,Author,4\n'
+            'None Left,Author,0\n'
+        ))
+        output = self.import_books(path)
+        self.assertIn('Imported 2 books from 3 records (0 duplicates, 1 invalid)', output)
+        self.assertEqual(dict(Book.objects.values_list('title', 'total_copies')), {'Default': 1, 'Several': 4})
+
+    def test_resume_skips_checkpointed_records(self):
+        path = self.write('books.jsonl', '\n'.join(
+            json.dumps({'title': f'Book {i}', 'author': 'Author'}) for i in range(5)
+        ))
+        with open(path + '.checkpoint', 'w') as fh:
+            json.dump({'path': os.path.abspath(path), 'stats': {
+                'records': 2, 'inserted': 2, 'duplicates': 0, 'invalid': 0,
+            }}, fh)
+        self.import_books(path, resume=True)
+        self.assertEqual(sorted(Book.objects.values_list('title', flat=True)), ['Book 2', 'Book 3', 'Book 4'])
+
+    def test_refreshes_facet_counts(self):
+        facets.get_facet_counts()
+        path = self.write('books.jsonl', json.dumps({'title': 'Novel', 'author': 'A', 'genre': 'fiction'}))
+        self.import_books(path)
+        self.assertEqual(facets.get_facet_counts()[('fiction', True)], 1)
+
+
 class BorrowBookTest(TestCase):
     def setUp(self):
         self.client = Client()
@@ -51,6 +570,39 @@ class BorrowBookTest(TestCase):
         self.assertEqual(Borrow.objects.count(), 1)
 
 
+class ConcurrentBorrowTest(TransactionTestCase):
+    workers = 200
+
+    def test_exactly_one_concurrent_borrow_wins(self):
+        book = Book.objects.create(title='Bestseller', author='Popular Author')
+        users = User.objects.bulk_create(User(username=f'racer{i}') for i in range(self.workers))
+
+        outcome = fire_concurrent_borrows(book, users)
+
+        self.assertEqual(outcome['errors'], [])
+        self.assertEqual(len(outcome['successes']), 1)
+        self.assertEqual(Borrow.objects.filter(book=book).count(), 1)
+        self.assertEqual(Borrow.objects.get(book=book).user_id, outcome['successes'][0])
+        self.assertFalse(Book.objects.get(id=book.id).available)
+
+    def test_concurrent_borrows_never_exceed_copies(self):
+        book = Book.objects.create(title='Bestseller', author='Popular Author', total_copies=5, available_copies=5)
+        users = User.objects.bulk_create(User(username=f'racer{i}') for i in range(50))
+
+        outcome = fire_concurrent_borrows(book, users)
+
+        self.assertEqual(outcome['errors'], [])
+        self.assertEqual(len(outcome['successes']), 5)
+        book.refresh_from_db()
+        self.assertEqual((book.available_copies, book.available), (0, False))
+
+    def test_losing_claim_writes_nothing(self):
+        book = Book.objects.create(title='Taken', author='Author', available=False)
+        user = User.objects.create(username='late')
+        self.assertIsNone(claim_book(user, book))
+        self.assertFalse(Borrow.objects.exists())
+
+
 class ReturnBookTest(TestCase):
     def setUp(self):
         self.client = Client()
@@ -111,7 +663,7 @@ class ExportReadersCSVTest(TestCase):
         response = self.client.get(reverse('export_readers_csv'))
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response['Content-Type'], 'text/csv')
-        content = response.content.decode('utf-8')
+        content = b''.join(response.streaming_content).decode('utf-8')
         self.assertIn("Name,Contact,Reference ID,Address", content)
         self.assertIn("Test Reader", content)
 
@@ -122,6 +674,51 @@ class ExportReadersCSVTest(TestCase):
         self.assertIn(response.status_code, [302, 403])
 
 
+class StreamingExportTest(TestCase):
+    def setUp(self):
+        self.admin_password = 'Adm1n$trongP@ss!'
+        self.admin_user = User.objects.create_user(username='admin', password=self.admin_password, is_staff=True)
+        self.client.login(username='admin', password=self.admin_password)
+
+    def export(self, name):
+        response = self.client.get(reverse(name))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf-8').splitlines()
+
+    def test_borrow_export_joins_user_and_book(self):
+        book = Book.objects.create(title='Exported Book', author='Author E', genre='fiction')
+        Borrow.objects.create(user=self.admin_user, book=book, due_date=timezone.now())
+        lines = self.export('export_borrows_csv')
+        self.assertTrue(lines[0].startswith('ID,Username,Email,Book ID,Title,Author'))
+        self.assertIn(f'admin,,{book.id},Exported Book,Author E', lines[1])
+        self.assertIn('Exported Book,Author E,fiction', self.export('export_books_csv')[1])
+
+    def peak_memory(self, name):
+        tracemalloc.start()
+        try:
+            response = self.client.get(reverse(name))
+            for _ in response.streaming_content:
+                pass
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_memory_stays_flat_as_rows_grow(self):
+        def add_readers(count):
+            Reader.objects.bulk_create(
+                Reader(name=f'Reader {i}', contact='0000000000', reference_id=f'R{i}', address='Somewhere ' * 5)
+                for i in range(count)
+            )
+
+        add_readers(3000)
+        small = self.peak_memory('export_readers_csv')
+        add_readers(12000)
+        large = self.peak_memory('export_readers_csv')
+        # Five times the rows must not mean noticeably more memory.
+        self.assertLess(large, small * 1.5)
+
+
 class CheckoutBagTest(TestCase):
     def setUp(self):
         self.client = Client()
@@ -154,6 +751,1068 @@ class CheckoutBagTest(TestCase):
         self.assertEqual(session.get('my_bag', []), [])
 
 
+class BulkCheckoutTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='bulk', password='User$trongP@ss1')
+
+    def test_claims_available_books_and_reports_the_rest(self):
+        free = [Book.objects.create(title=f'Free {i}', author='A', genre='fiction') for i in range(3)]
+        taken = Book.objects.create(title='Taken', author='B', available=False)
+        facets.get_facet_counts()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            borrows, unavailable = claim_books(self.user, [b.id for b in free] + [taken.id, taken.id, 999999])
+
+        self.assertEqual([borrow.book_id for borrow in borrows], [b.id for b in free])
+        self.assertEqual(unavailable, [taken])
+        self.assertEqual(Borrow.objects.filter(user=self.user).count(), 3)
+        self.assertFalse(Book.objects.filter(id__in=[b.id for b in free], available=True).exists())
+        self.assertEqual(facets.get_facet_counts()[('fiction', False)], 3)
+        self.assertEqual(facets.get_facet_counts()[('fiction', True)], 0)
+
+    def test_checkout_queries_do_not_grow_with_bag_size(self):
+        def checkout_queries(size):
+            user = User.objects.create(username=f'bag{size}')
+            ids = [Book.objects.create(title=f'Bag {size}-{i}', author='A').id for i in range(size)]
+            with self.captureOnCommitCallbacks(execute=True):
+                with CaptureQueriesContext(connection) as queries:
+                    borrows, _ = claim_books(user, ids)
+            self.assertEqual(len(borrows), size)
+            return len(queries)
+
+        self.assertEqual(checkout_queries(2), checkout_queries(40))
+
+    def test_failed_insert_rolls_back_the_claim(self):
+        book = Book.objects.create(title='Atomic', author='A')
+        with mock.patch.object(Borrow.objects, 'bulk_create', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                claim_books(self.user, [book.id])
+        self.assertTrue(Book.objects.get(id=book.id).available)
+        self.assertFalse(Borrow.objects.exists())
+
+    def test_checkout_view_warns_about_unavailable_titles(self):
+        free = Book.objects.create(title='Still Here', author='A')
+        gone = Book.objects.create(title='Already Out', author='B', available=False)
+        self.client.login(username='bulk', password='User$trongP@ss1')
+        session = self.client.session
+        session['my_bag'] = [str(free.id), str(gone.id)]
+        session.save()
+
+        response = self.client.post(reverse('checkout'), follow=True)
+
+        texts = [str(message) for message in response.context['messages']]
+        self.assertIn('You successfully borrowed 1 book(s). A confirmation email has been sent.', texts)
+        self.assertIn('Not borrowed because they are no longer available: Already Out.', texts)
+
+
+class MailOutboxTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='reader', password='User$trongP@ss1', email='reader@example.com')
+        self.client.login(username='reader', password='User$trongP@ss1')
+
+    def drain(self):
+        out = StringIO()
+        call_command('run_mail_worker', '--once', stdout=out)
+        return out.getvalue()
+
+    def test_borrow_queues_email_instead_of_sending(self):
+        book = Book.objects.create(title='Queued', author='Author')
+        self.client.get(reverse('borrow_book', args=[book.id]))
+
+        self.assertEqual(len(mail.outbox), 0)
+        queued = OutboxEmail.objects.get()
+        self.assertEqual(queued.subject, 'Book Borrowed: Queued')
+        self.assertEqual(queued.recipients, ['reader@example.com'])
+
+        self.drain()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['reader@example.com'])
+        self.assertEqual(OutboxEmail.objects.get().status, OutboxEmail.SENT)
+
+    def test_smtp_failure_does_not_break_return(self):
+        book = Book.objects.create(title='Returned', author='Author', available=False)
+        borrow = Borrow.objects.create(user=self.user, book=book)
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=SMTPException):
+            response = self.client.post(reverse('return_book', args=[borrow.id]))
+            self.drain()
+        self.assertRedirects(response, reverse('book_list'))
+        queued = OutboxEmail.objects.get()
+        self.assertEqual(queued.status, OutboxEmail.PENDING)
+        self.assertEqual(queued.attempts, 1)
+        self.assertGreater(queued.next_attempt_at, timezone.now() + timedelta(seconds=outbox.backoff(1) - 5))
+        self.assertIn('SMTPException', queued.last_error)
+
+    def test_rolled_back_change_queues_nothing(self):
+        book = Book.objects.create(title='Never', author='Author')
+        with mock.patch.object(Borrow.objects, 'create', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                self.client.get(reverse('borrow_book', args=[book.id]))
+        self.assertFalse(OutboxEmail.objects.exists())
+
+    def test_retries_back_off_then_give_up(self):
+        outbox.enqueue('Hello', 'Body', ['reader@example.com'])
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=SMTPException):
+            for attempt in range(1, outbox.MAX_ATTEMPTS + 1):
+                OutboxEmail.objects.update(next_attempt_at=timezone.now())
+                self.drain()
+                self.assertEqual(OutboxEmail.objects.get().attempts, attempt)
+        self.assertEqual(OutboxEmail.objects.get().status, OutboxEmail.FAILED)
+        self.assertEqual([outbox.backoff(n) for n in (1, 2, 3)], [30, 60, 120])
+        self.assertEqual(outbox.backoff(20), outbox.BACKOFF_MAX)
+
+    def test_worker_reuses_one_connection_per_run(self):
+        for i in range(5):
+            outbox.enqueue(f'Notice {i}', 'Body', ['reader@example.com'])
+        with mock.patch('library.management.commands.run_mail_worker.get_connection', wraps=get_connection) as factory:
+            output = self.drain()
+        self.assertEqual(factory.call_count, 1)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertIn('5 sent, 0 to retry, 0 failed', output)
+
+    def test_email_not_yet_due_is_left_alone(self):
+        queued = outbox.enqueue('Later', 'Body', ['reader@example.com'])
+        OutboxEmail.objects.filter(id=queued.id).update(next_attempt_at=timezone.now() + timedelta(minutes=5))
+        self.drain()
+        self.assertEqual(len(mail.outbox), 0)
+
+
+class OverdueRemindersCommandTest(TestCase):
+    def setUp(self):
+        past = timezone.now() - timedelta(days=3)
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com')
+        silent = User.objects.create_user(username='silent')
+        for user, count in ((self.alice, 3), (self.bob, 1), (silent, 1)):
+            for i in range(count):
+                book = Book.objects.create(title=f'{user.username} {i}', author='Author', available=False)
+                Borrow.objects.create(user=user, book=book, due_date=past)
+        book = Book.objects.create(title='Not due', author='Author', available=False)
+        Borrow.objects.create(user=self.alice, book=book, due_date=timezone.now() + timedelta(days=3))
+
+    def remind(self, *args):
+        out = StringIO()
+        call_command('send_overdue_reminders', '--workers', '2', *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_one_digest_per_user(self):
+        output = self.remind()
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['alice@example.com', 'bob@example.com'])
+        digest = next(message for message in mail.outbox if message.to == ['alice@example.com'])
+        self.assertEqual(digest.subject, 'Overdue Book Reminder: 3 books')
+        self.assertEqual(digest.body.count("\n- '"), 3)
+        self.assertNotIn('Not due', digest.body)
+        self.assertIn('Sent 2 digests covering 4 overdue loans (0 failed)', output)
+
+    def test_rerun_is_idempotent_until_interval_passes(self):
+        self.remind()
+        self.remind()
+        self.assertEqual(len(mail.outbox), 2)
+
+        Borrow.objects.filter(user=self.bob).update(last_reminded_at=timezone.now() - timedelta(days=2))
+        self.remind()
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[-1].to, ['bob@example.com'])
+
+    def test_failed_digest_is_retried_next_run(self):
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=SMTPException):
+            output = self.remind()
+        self.assertIn('(2 failed)', output)
+        self.assertFalse(Borrow.objects.filter(last_reminded_at__isnull=False).exists())
+        self.remind()
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_queries_do_not_grow_with_users(self):
+        # One streamed SELECT plus one UPDATE per 500 reminded loans.
+        with self.assertNumQueries(2):
+            self.remind()
+
+
+class BookCopiesTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create_user(username=f'copy{i}') for i in range(4)]
+        self.book = Book.objects.create(title='Popular', author='Author', genre='mystery', total_copies=3, available_copies=3)
+        facets.get_facet_counts()
+
+    def test_borrow_and_return_move_the_counter(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            borrows = [claim_book(user, self.book) for user in self.users]
+        self.assertIsNone(borrows[-1])
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.available_copies, self.book.available), (0, False))
+        self.assertEqual(facets.get_facet_counts()[('mystery', False)], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(return_borrow(borrows[0]))
+            self.assertFalse(return_borrow(borrows[0]))
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.available_copies, self.book.available), (1, True))
+        cached = facets.get_facet_counts()
+        self.assertEqual(cached[('mystery', True)], 1)
+        facets.invalidate()
+        self.assertEqual(cached, facets.get_facet_counts())
+
+    def test_return_and_renew_lock_the_book_before_the_loan(self):
+        loan = claim_book(self.users[0], self.book)
+        for action in (renew_borrow, return_borrow):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertTrue(action(loan))
+            sql = [q['sql'] for q in queries.captured_queries if not q['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+            self.assertIn('FROM "library_book"', sql[0], action.__name__)
+
+    def test_fallback_without_returning(self):
+        with mock.patch('library.circulation._update_returning_supported', return_value=False):
+            borrows, unavailable = claim_books(self.users[0], [self.book.id])
+            self.assertEqual(len(borrows), 1)
+            self.assertTrue(return_borrow(borrows[0]))
+            claim_book(self.users[1], self.book)
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.available_copies, self.book.available), (2, True))
+
+    def test_availability_needs_no_borrow_count(self):
+        claim_book(self.users[0], self.book)
+        with self.assertNumQueries(1):
+            book = Book.objects.get(id=self.book.id)
+            self.assertEqual((book.available_copies, book.total_copies), (2, 3))
+
+    def test_edits_keep_flag_and_counter_in_step(self):
+        single = Book.objects.create(title='Single', author='Author', available=False)
+        self.assertEqual(single.available_copies, 0)
+
+        claim_book(self.users[0], self.book)
+        book = Book.objects.get(id=self.book.id)
+        book.total_copies = 5
+        book.save()
+        self.assertEqual((book.available_copies, book.available), (4, True))
+
+        book.available = False
+        book.save()
+        self.assertEqual(book.available_copies, 0)
+        book.available = True
+        book.save()
+        self.assertEqual(book.available_copies, 4)  # one copy is still on loan
+
+    def test_edits_keep_concurrent_loans(self):
+        book = Book.objects.get(id=self.book.id)
+        # Loans taken after the edit form loaded the book.
+        claim_book(self.users[0], self.book)
+        claim_book(self.users[1], self.book)
+        book.title = 'Renamed'
+        book.save()
+        book.refresh_from_db()
+        self.assertEqual((book.title, book.available_copies, book.available), ('Renamed', 1, True))
+
+        stale = Book.objects.get(id=self.book.id)
+        claim_book(self.users[2], self.book)
+        stale.total_copies = 4
+        stale.save()
+        self.assertEqual((stale.total_copies, stale.available_copies, stale.available), (4, 1, True))
+        stale.total_copies = 2
+        stale.save()
+        self.assertEqual((stale.available_copies, stale.available), (0, False))
+        self.assertEqual(Book.objects.filter(id=self.book.id, available_copies=0, total_copies=2).count(), 1)
+
+    def test_stale_edit_form_cannot_shelve_a_loaned_copy(self):
+        single = Book.objects.create(title='Single', author='Author', total_copies=1, available_copies=1)
+        staff = User.objects.create_user(username='editor', is_staff=True)
+        self.client.force_login(staff)
+        self.client.get(reverse('edit_book', args=[single.id]))
+        claim_book(self.users[0], single)
+        self.client.post(reverse('edit_book', args=[single.id]), {
+            'title': 'Single (2nd ed.)', 'author': 'Author', 'genre': 'other', 'total_copies': 1, 'available': 'on',
+        })
+        single.refresh_from_db()
+        self.assertEqual((single.title, single.available, single.available_copies), ('Single (2nd ed.)', False, 0))
+        self.assertIsNone(claim_book(self.users[1], single))
+
+        # Marking it available by hand can't shelve it either.
+        single.available = True
+        single.save()
+        self.assertEqual((single.available, single.available_copies), (False, 0))
+
+    def test_book_form_defaults_to_one_copy(self):
+        form = BookForm({'title': 'New', 'author': 'Author', 'genre': 'other'})
+        self.assertTrue(form.is_valid(), form.errors)
+        book = form.save()
+        self.assertEqual((book.total_copies, book.available_copies), (1, 1))
+
+
+class HoldQueueTest(QueryPlanMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner, self.first, self.second = (
+            User.objects.create_user(username=name, email=f'{name}@example.com') for name in ('owner', 'first', 'second')
+        )
+        self.book = Book.objects.create(title='Wanted', author='Author', genre='fiction')
+        self.loan = claim_book(self.owner, self.book)
+
+    def test_return_goes_to_the_oldest_hold(self):
+        first, _ = place_hold(self.first, self.book)
+        second, _ = place_hold(self.second, self.book)
+        self.assertEqual((queue_position(first), queue_position(second)), (1, 2))
+
+        self.assertTrue(return_borrow(self.loan))
+
+        first.refresh_from_db()
+        self.assertEqual(first.status, Hold.READY)
+        self.assertEqual(Hold.objects.get(id=second.id).status, Hold.WAITING)
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.available, self.book.available_copies), (False, 0))
+        self.assertEqual(OutboxEmail.objects.get().recipients, ['first@example.com'])
+
+        # Only the holder can take the reserved copy.
+        self.assertIsNone(claim_book(self.second, self.book))
+        self.assertIsNotNone(claim_book(self.first, self.book))
+        self.assertEqual(Hold.objects.get(id=first.id).status, Hold.COLLECTED)
+
+    def test_no_hold_when_a_copy_is_on_the_shelf(self):
+        return_borrow(self.loan)
+        self.assertEqual(place_hold(self.first, self.book), (None, False))
+
+    def test_one_active_hold_per_user(self):
+        hold, created = place_hold(self.first, self.book)
+        self.assertEqual(place_hold(self.first, self.book), (hold, False))
+        self.assertTrue(created)
+
+    def test_return_finds_the_queue_head_without_scanning(self):
+        place_hold(self.first, self.book)
+        analyze_tables()
+        self.assertUsesIndex(Hold.objects.filter(book_id=self.book.id, status=Hold.WAITING).order_by('created_at', 'id'))
+
+    def test_expiry_sweep_passes_copies_down_the_queue(self):
+        place_hold(self.first, self.book)
+        place_hold(self.second, self.book)
+        return_borrow(self.loan)
+
+        expired, handed_on = expire_holds(now=timezone.now() + timedelta(days=4))
+        self.assertEqual((expired, handed_on), (1, 1))
+        self.assertEqual(Hold.objects.get(user=self.first).status, Hold.EXPIRED)
+        self.assertEqual(Hold.objects.get(user=self.second).status, Hold.READY)
+
+        out = StringIO()
+        call_command('expire_holds', stdout=out)
+        self.assertIn('Expired 0 holds', out.getvalue())
+        expire_holds(now=timezone.now() + timedelta(days=8))
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.available, self.book.available_copies), (True, 1))
+
+    def test_cancelling_a_ready_hold_moves_the_copy_on(self):
+        first, _ = place_hold(self.first, self.book)
+        place_hold(self.second, self.book)
+        return_borrow(self.loan)
+        self.assertTrue(release_hold(Hold.objects.get(id=first.id)))
+        self.assertEqual(Hold.objects.get(user=self.second).status, Hold.READY)
+
+    def test_hold_views(self):
+        self.client.force_login(self.first)
+        response = self.client.post(reverse('hold_book', args=[self.book.id]), follow=True)
+        texts = [str(message) for message in response.context['messages']]
+        self.assertIn("Hold placed on 'Wanted'. You are number 1 in line.", texts)
+
+        response = self.client.get(reverse('borrowed_books'))
+        hold = response.context['holds'][0]
+        self.client.post(reverse('cancel_hold', args=[hold.id]))
+        self.assertEqual(Hold.objects.get(id=hold.id).status, Hold.CANCELLED)
+
+    def test_second_copy_back_does_not_change_facets(self):
+        book = Book.objects.create(title='Two', author='Author', genre='mystery', total_copies=2, available_copies=2)
+        loans = [claim_book(self.first, book), claim_book(self.second, book)]
+        facets.get_facet_counts()
+        with self.captureOnCommitCallbacks(execute=True):
+            return_borrow(loans[0])
+            return_borrow(loans[1])
+        cached = facets.get_facet_counts()
+        facets.invalidate()
+        self.assertEqual(cached, facets.get_facet_counts())
+
+
+class FineAnnotationTest(QueryPlanMixin, TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.users = [User.objects.create_user(username=f'fined{i}') for i in range(3)]
+        book = Book.objects.create(title='Fines', author='Author', total_copies=50, available_copies=50)
+        offsets = [
+            timedelta(days=-3), timedelta(hours=-5), timedelta(days=1, hours=2), timedelta(days=1),
+            timedelta(days=6, minutes=59), timedelta(days=30, seconds=1), timedelta(days=400, hours=23),
+        ]
+        for i, offset in enumerate(offsets):
+            for returned in (False, True):
+                Borrow.objects.create(
+                    user=self.users[i % 3], book=book, due_date=self.now - offset, returned=returned,
+                    returned_at=self.now if returned else None, fine_paid=(i == 5),
+                )
+        Borrow.objects.create(user=self.users[0], book=book, due_date=None)
+
+    def test_annotations_match_properties(self):
+        with mock.patch('django.utils.timezone.now', return_value=self.now):
+            rows = list(Borrow.objects.with_fines(self.now))
+            expected = {borrow.id: (borrow.days_overdue, borrow.fine_amount) for borrow in Borrow.objects.all()}
+        self.assertEqual({borrow.id: (borrow.days_overdue, borrow.fine_amount) for borrow in rows}, expected)
+        self.assertIn(4000, [fine for _, fine in expected.values()])
+
+    def test_totals_come_from_the_ledger(self):
+        accrue_fines(self.now)
+        fined = [borrow for borrow in Borrow.objects.all() if fines.balance(borrow) > 0]
+        # Returned loans owe what was charged too; legacy fine_paid loans never are.
+        self.assertEqual(len([borrow for borrow in fined if borrow.returned]), 4)
+        self.assertFalse([borrow for borrow in fined if borrow.fine_paid])
+        expected = {}
+        for borrow in fined:
+            expected[borrow.user_id] = expected.get(borrow.user_id, 0) + fines.balance(borrow)
+        self.assertEqual(Borrow.objects.fine_totals(), {'total': sum(expected.values()), 'loans': len(fined)})
+        self.assertEqual({row['user_id']: row['total'] for row in Borrow.objects.fines_by_user()}, expected)
+
+        # Settling a returned loan's charge removes it from every total.
+        returned = Borrow.objects.outstanding_fines().filter(returned=True).first()
+        owed = returned.fine_due
+        fines.record_payment(returned, self.now)
+        self.assertEqual(Borrow.objects.fine_totals(), {'total': sum(expected.values()) - owed, 'loans': len(fined) - 1})
+
+    def test_outstanding_fines_are_read_by_primary_key(self):
+        accrue_fines(self.now)
+        # Most loans were never fined; only the charged ones should be read.
+        book = Book.objects.get()
+        Borrow.objects.bulk_create(
+            Borrow(user=self.users[0], book=book, due_date=self.now, returned=True, returned_at=self.now) for _ in range(2000)
+        )
+        analyze_tables()
+        self.assertUsesIndex(Borrow.objects.outstanding_fines())
+
+    def test_pay_fine_is_recorded_once(self):
+        accrue_fines(self.now)
+        self.client.force_login(self.users[0])
+        borrow = Borrow.objects.outstanding_fines().filter(user=self.users[0], returned=True).first()
+        page = self.client.get(reverse('borrowed_books'))
+        self.assertContains(page, reverse('pay_fine', args=[borrow.id]))
+        first = self.client.post(reverse('pay_fine', args=[borrow.id]), follow=True)
+        second = self.client.post(reverse('pay_fine', args=[borrow.id]), follow=True)
+        self.assertIn(f'Fine of {borrow.fine_due} has been paid.', [str(m) for m in first.context['messages']])
+        self.assertIn('No fine to pay or fine already paid.', [str(m) for m in second.context['messages']])
+        payments = FineLedgerEntry.objects.filter(borrow=borrow, kind=FineLedgerEntry.PAYMENT)
+        self.assertEqual(list(payments.values_list('amount', flat=True)), [-borrow.fine_due])
+        self.assertFalse(Borrow.objects.outstanding_fines().filter(id=borrow.id).exists())
+
+
+class FineLedgerTest(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.user = User.objects.create_user(username='ledger')
+        book = Book.objects.create(title='Ledger', author='Author', total_copies=10, available_copies=10)
+        self.open_loan = Borrow.objects.create(user=self.user, book=book, due_date=self.now - timedelta(days=3, hours=1))
+        self.returned_loan = Borrow.objects.create(
+            user=self.user, book=book, due_date=self.now - timedelta(days=10),
+            returned=True, returned_at=self.now - timedelta(days=4, hours=22),
+        )
+        self.on_time = Borrow.objects.create(
+            user=self.user, book=book, due_date=self.now - timedelta(days=4),
+            returned=True, returned_at=self.now - timedelta(days=6),
+        )
+
+    def test_accrual_posts_overdue_days_once(self):
+        stats = accrue_fines(self.now)
+        self.assertEqual(stats, {'entries': 2, 'amount': 80})
+        self.assertEqual(fines.balance(self.open_loan), 30)
+        self.assertEqual(fines.balance(self.returned_loan), 50)
+        self.assertEqual(fines.balance(self.on_time), 0)
+
+        self.assertEqual(accrue_fines(self.now), {'entries': 0, 'amount': 0})
+        self.assertEqual(FineLedgerEntry.objects.count(), 2)
+
+    def test_later_run_posts_only_new_days(self):
+        accrue_fines(self.now)
+        stats = accrue_fines(self.now + timedelta(days=2))
+        self.assertEqual(stats, {'entries': 1, 'amount': 20})
+        self.assertEqual(
+            list(FineLedgerEntry.objects.filter(borrow=self.open_loan).order_by('days').values_list('days', 'amount')),
+            [(3, 30), (5, 20)],
+        )
+
+    def test_old_returns_are_not_rescanned(self):
+        accrue_fines(self.now)
+        # Returned loans from before the watermark are no longer candidates.
+        Borrow.objects.filter(id=self.returned_loan.id).update(fine_accrued_days=0)
+        self.assertEqual(accrue_fines(self.now + timedelta(days=1))['entries'], 1)
+
+    def test_interrupted_run_can_be_rerun(self):
+        # A run that posted entries but died before recording its progress.
+        FineLedgerEntry.objects.create(
+            borrow=self.open_loan, user=self.user, kind=FineLedgerEntry.ACCRUAL, amount=30, days=3,
+        )
+        accrue_fines(self.now)
+        self.assertEqual(fines.balance(self.open_loan), 30)
+
+    def test_payment_accrues_first_and_settles_balance(self):
+        paid = fines.record_payment(self.returned_loan, self.now)
+        self.assertEqual(paid, 50)
+        self.assertEqual(fines.balance(self.returned_loan), 0)
+        self.assertEqual(fines.record_payment(self.returned_loan, self.now), 0)
+        self.assertFalse(Borrow.objects.get(id=self.returned_loan.id).fine_paid)
+
+    def test_loans_settled_before_the_ledger_never_accrue(self):
+        Borrow.objects.filter(id__in=[self.open_loan.id, self.returned_loan.id]).update(fine_paid=True)
+        self.assertEqual(accrue_fines(self.now), {'entries': 0, 'amount': 0})
+        Borrow.objects.filter(id=self.returned_loan.id).update(returned_at=self.now - timedelta(days=400))
+        self.assertEqual(archive_returned_loans(365, now=self.now), 1)
+
+    def test_migration_marks_legacy_returns_posted(self):
+        from django.apps import apps
+        migration = importlib.import_module('library.migrations.0027_settle_legacy_returns')
+        FineAccrualRun.objects.create(started_at=self.now - timedelta(hours=1), finished_at=self.now)
+        late = Borrow.objects.create(
+            user=self.user, book=self.open_loan.book, due_date=self.now - timedelta(days=3),
+            returned=True, returned_at=self.now,
+        )
+        migration.mark_legacy_returns_posted(apps, None)
+        accrued = dict(Borrow.objects.values_list('id', 'fine_accrued_days'))
+        self.assertEqual(accrued[self.returned_loan.id], 5)
+        self.assertEqual((accrued[self.open_loan.id], accrued[self.on_time.id], accrued[late.id]), (0, 0, 0))
+        self.assertEqual(accrue_fines(self.now), {'entries': 2, 'amount': 60})
+
+    def test_overdue_page_and_totals_show_the_ledger_balance(self):
+        accrue_fines(self.now)
+        FineLedgerEntry.objects.create(borrow=self.open_loan, user=self.user, kind=FineLedgerEntry.PAYMENT, amount=-20)
+        self.client.force_login(User.objects.create_user(username='clerk', is_staff=True))
+        response = self.client.get(reverse('overdue_books_user'))
+        self.assertEqual([record.fine_due for record in response.context['overdue']], [10])
+        self.assertContains(response, 'Fine due:</strong> 10<')
+        # The returned loan's charge is owed too, and archiving waits for it.
+        self.assertEqual(response.context['fine_totals'], {'total': 60, 'loans': 2})
+        Borrow.objects.filter(id=self.returned_loan.id).update(returned_at=self.now - timedelta(days=400))
+        self.assertEqual(archive_returned_loans(365, now=self.now), 0)
+        fines.record_payment(self.returned_loan, self.now)
+        self.assertEqual(archive_returned_loans(365, now=self.now), 1)
+
+    def test_command_reports_stats(self):
+        out = StringIO()
+        call_command('accrue_fines', stdout=out)
+        self.assertIn('Posted 2 accruals totalling 80', out.getvalue())
+        self.assertEqual(FineAccrualRun.objects.count(), 1)
+
+
+class CirculationLogTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='logged')
+        self.books = [
+            Book.objects.create(title=f'Logged {i}', author='Author', genre='fiction', total_copies=2, available_copies=2)
+            for i in range(3)
+        ]
+
+    def events(self, **filters):
+        return list(BorrowHistory.objects.filter(**filters).order_by('id').values_list('book_id', 'status'))
+
+    def test_borrow_return_renew_and_payment_are_logged(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            loan = claim_book(self.user, self.books[0])
+            borrows, _ = claim_books(self.user, [self.books[1].id, self.books[2].id])
+            due_date = loan.due_date
+            self.assertTrue(renew_borrow(loan))
+            return_borrow(borrows[0])
+
+        self.assertEqual(Borrow.objects.get(id=loan.id).due_date, due_date + timedelta(days=7))
+        self.assertEqual(self.events(), [
+            (self.books[0].id, BorrowHistory.BORROWED),
+            (self.books[1].id, BorrowHistory.BORROWED),
+            (self.books[2].id, BorrowHistory.BORROWED),
+            (self.books[0].id, BorrowHistory.RENEWED),
+            (self.books[1].id, BorrowHistory.RETURNED),
+        ])
+        returned = BorrowHistory.objects.get(status=BorrowHistory.RETURNED)
+        self.assertEqual((returned.borrow_id, returned.return_date), (borrows[0].id, borrows[0].returned_at))
+
+        Borrow.objects.filter(id=loan.id).update(due_date=timezone.now() - timedelta(days=2, hours=1))
+        loan.refresh_from_db()
+        fines.record_payment(loan)
+        self.assertEqual(BorrowHistory.objects.get(status=BorrowHistory.FINE_PAID).amount, 20)
+
+    def test_renewal_refused_when_overdue_waiting_or_renewed_too_often(self):
+        loan = claim_book(self.user, self.books[0])
+        for _ in range(MAX_RENEWALS):
+            self.assertTrue(renew_borrow(loan))
+        self.assertFalse(renew_borrow(loan))
+
+        other = claim_book(self.user, self.books[1])
+        claim_book(User.objects.create_user(username='rival'), self.books[1])
+        place_hold(User.objects.create_user(username='waiting'), self.books[1])
+        self.assertFalse(renew_borrow(other))
+
+        overdue = claim_book(self.user, self.books[2], days=-1)
+        self.assertFalse(renew_borrow(overdue))
+        self.assertEqual(BorrowHistory.objects.filter(status=BorrowHistory.RENEWED).count(), MAX_RENEWALS)
+
+    def test_renew_view(self):
+        loan = claim_book(self.user, self.books[0])
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('renew_book', args=[loan.id]), follow=True)
+        self.assertContains(response, 'renewed')
+        self.assertContains(response, 'Renew')
+
+    def test_log_is_append_only(self):
+        claim_book(self.user, self.books[0])
+        event = BorrowHistory.objects.get()
+        event.status = BorrowHistory.RETURNED
+        with self.assertRaises(ValueError):
+            event.save()
+
+    def test_replay_rebuilds_copy_counters(self):
+        claim_book(self.user, self.books[0])
+        claim_books(self.user, [self.books[1].id])
+        Book.objects.filter(id__in=[self.books[0].id, self.books[2].id]).update(available=False, available_copies=0)
+
+        out = StringIO()
+        call_command('replay_history', '--dry-run', stdout=out)
+        self.assertIn('2 books would be corrected', out.getvalue())
+        self.assertEqual(Book.objects.get(id=self.books[2].id).available_copies, 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('replay_history', stdout=StringIO())
+        copies = dict(Book.objects.filter(id__in=[book.id for book in self.books]).values_list('id', 'available_copies'))
+        self.assertEqual(copies, {self.books[0].id: 1, self.books[1].id: 1, self.books[2].id: 2})
+        self.assertEqual(facets.get_facet_counts()[('fiction', True)], 3)
+
+    def test_staff_book_history_reads_the_log(self):
+        loan = claim_book(self.user, self.books[0])
+        return_borrow(loan)
+        staff = User.objects.create_user(username='historian', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get(reverse('book_history', args=[self.books[0].id]))
+        self.assertContains(response, 'Borrowed')
+        self.assertContains(response, 'Returned')
+
+
+class LoanArchiveTest(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.user = User.objects.create_user(username='archivist', password='Arch1v3$pass')
+        self.book = Book.objects.create(title='Dusty', author='Author', total_copies=5, available_copies=4)
+        old = self.now - timedelta(days=400)
+
+        def loan(borrowed_at, **fields):
+            return Borrow.objects.create(
+                user=self.user, book=self.book, borrowed_at=borrowed_at, due_date=borrowed_at + timedelta(days=7), **fields,
+            )
+
+        self.old_returned = loan(old, returned=True, returned_at=old + timedelta(days=3))
+        self.old_late_unpaid = loan(old, returned=True, returned_at=old + timedelta(days=10))
+        self.recent_returned = loan(self.now - timedelta(days=20), returned=True, returned_at=self.now - timedelta(days=15))
+        self.active = loan(self.now - timedelta(days=2))
+
+    def test_only_old_settled_returns_are_archived(self):
+        accrue_fines(self.now)
+        out = StringIO()
+        call_command('archive_loans', '--older-than-days', '365', '--batch-size', '1', stdout=out)
+        self.assertIn('Archived 1 loans', out.getvalue())
+
+        archived = ArchivedBorrow.objects.get()
+        self.assertEqual((archived.id, archived.borrowed_at), (self.old_returned.id, self.old_returned.borrowed_at))
+        self.assertFalse(Borrow.objects.filter(id=self.old_returned.id).exists())
+
+        # Once its fine is paid the late return can go too.
+        fines.record_payment(self.old_late_unpaid, self.now)
+        self.assertEqual(archive_returned_loans(365, now=self.now), 1)
+        self.assertEqual(Borrow.objects.count(), 2)
+        self.assertEqual(fines.balance(self.old_late_unpaid), 0)
+
+    def test_unified_manager_spans_hot_and_archived_rows(self):
+        accrue_fines(self.now)
+        archive_returned_loans(365, now=self.now)
+        loans = Borrow.all_loans.history(user=self.user)
+        self.assertEqual(
+            [loan.id for loan in loans],
+            [self.active.id, self.recent_returned.id, self.old_late_unpaid.id, self.old_returned.id],
+        )
+        self.assertEqual(loans[-1].book.title, 'Dusty')
+        self.assertEqual(len(Borrow.all_loans.history(user=self.user, returned=True)), 3)
+
+    def test_history_pages_include_archived_loans(self):
+        accrue_fines(self.now)
+        archive_returned_loans(365, now=self.now)
+        self.client.login(username='archivist', password='Arch1v3$pass')
+        response = self.client.get(reverse('borrow_history'))
+        self.assertEqual(len(response.context['history']), 4)
+
+        reader = Reader.objects.create(user=self.user, name='Archivist', contact='1', reference_id='A1', address='x')
+        self.client.force_login(User.objects.create_user(username='desk', is_staff=True))
+        response = self.client.get(reverse('reader_detail', args=[reader.id]))
+        self.assertEqual([loan.id for loan in response.context['active_borrows']], [self.active.id])
+        self.assertEqual(len(response.context['past_borrows']), 3)
+
+
+class ReportSnapshotTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.now = timezone.now()
+        self.staff = User.objects.create_user(username='reporter', is_staff=True)
+        self.readers = [User.objects.create_user(username=f'regular{i}') for i in range(3)]
+        self.books = [Book.objects.create(title=f'Report {i}', author='Author', total_copies=9, available_copies=9) for i in range(3)]
+
+    def log_borrows(self, pairs, ago=timedelta(minutes=5)):
+        for user, book in pairs:
+            BorrowHistory.objects.create(
+                user=user, book=book, status=BorrowHistory.BORROWED, recorded_at=self.now - ago,
+            )
+
+    def tallies(self, model):
+        return dict(model.objects.values_list('pk', 'borrows'))
+
+    def test_refresh_folds_only_new_settled_borrows(self):
+        first, second, third = self.readers
+        self.log_borrows([(first, self.books[0]), (first, self.books[1]), (second, self.books[0])])
+        BorrowHistory.objects.create(user=third, book=self.books[0], status=BorrowHistory.RETURNED, recorded_at=self.now - timedelta(minutes=5))
+        reports.refresh_snapshot(now=self.now)
+        self.assertEqual(self.tallies(BookBorrowTally), {self.books[0].id: 2, self.books[1].id: 1})
+
+        self.log_borrows([(third, self.books[0])])
+        self.log_borrows([(third, self.books[2])], ago=timedelta(seconds=5))
+        with CaptureQueriesContext(connection) as queries:
+            snapshot = reports.refresh_snapshot(now=self.now)
+        self.assertFalse([q['sql'] for q in queries.captured_queries if 'DELETE' in q['sql']])
+        self.assertEqual(self.tallies(BookBorrowTally), {self.books[0].id: 3, self.books[1].id: 1})
+        self.assertEqual(self.tallies(ReaderBorrowTally), {first.id: 2, second.id: 1, third.id: 1})
+        self.assertEqual(snapshot['data']['most_borrowed_books_labels'][0], 'Report 0')
+        self.assertEqual(snapshot['data']['most_active_readers_labels'], ['regular0', 'regular1', 'regular2'])
+
+        # The young row is picked up later; a full recount agrees.
+        reports.refresh_snapshot(now=self.now + timedelta(minutes=2))
+        incremental = self.tallies(BookBorrowTally), self.tallies(ReaderBorrowTally)
+        reports.refresh_snapshot(force=True, now=self.now + timedelta(minutes=2))
+        self.assertEqual((self.tallies(BookBorrowTally), self.tallies(ReaderBorrowTally)), incremental)
+        self.assertEqual(incremental[0][self.books[2].id], 1)
+
+    def test_view_renders_the_snapshot_and_can_force_a_recompute(self):
+        self.log_borrows([(self.readers[0], self.books[0])])
+        with self.captureOnCommitCallbacks(execute=True):
+            reports.refresh_snapshot(now=self.now)
+        self.log_borrows([(self.readers[1], self.books[1])])
+        self.client.force_login(self.staff)
+
+        metrics.dashboard_metrics()
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('admin_reports'))
+        self.assertEqual(response.context['most_active_readers_labels'], ['regular0'])
+        self.assertContains(response, 'Snapshot taken')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('admin_reports'))
+        response = self.client.get(reverse('admin_reports'))
+        self.assertEqual(response.context['most_active_readers_labels'], ['regular0', 'regular1'])
+        self.assertContains(response, 'Reports recomputed')
+
+    def test_command_refreshes(self):
+        self.log_borrows([(self.readers[0], self.books[0])])
+        out = StringIO()
+        call_command('refresh_reports', '--full', stdout=out)
+        self.assertIn('Rebuilt admin_reports snapshot (top reader: regular0)', out.getvalue())
+        self.assertEqual(ReportSnapshot.objects.get().watermark, BorrowHistory.objects.get().id)
+
+
+class DashboardMetricsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.staff = User.objects.create_user(username='metrics', is_staff=True)
+        self.reader = User.objects.create_user(username='counted')
+        self.books = [Book.objects.create(title=f'Counted {i}', author='Author', total_copies=2, available_copies=2) for i in range(3)]
+        Book.objects.create(title='Gone', author='Author', available=False)
+
+    def test_one_query_per_table(self):
+        claim_book(self.reader, self.books[0])
+        claim_book(self.reader, self.books[1], days=-1)
+        reports.refresh_snapshot(now=timezone.now() + reports.SETTLE)
+        with self.assertNumQueries(3):
+            counts = metrics.compute()
+        self.assertEqual(
+            {key: value for key, value in counts.items() if key != 'computed_at'},
+            {'total_books': 4, 'available_books': 3, 'total_copies': 7, 'available_copies': 4,
+             'active_loans': 2, 'overdue_loans': 1, 'total_users': 1},
+        )
+
+    def test_reader_count_follows_the_report_refresh(self):
+        claim_book(self.reader, self.books[0])
+        self.assertEqual(metrics.dashboard_metrics()['total_users'], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            reports.refresh_snapshot(now=timezone.now() + reports.SETTLE)
+        self.assertEqual(metrics.dashboard_metrics()['total_users'], 1)
+
+    def test_cached_until_a_circulation_event(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            loan = claim_book(self.reader, self.books[0])
+        self.assertEqual(metrics.dashboard_metrics()['active_loans'], 1)
+        with self.assertNumQueries(0):
+            metrics.dashboard_metrics()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            return_borrow(loan)
+        self.assertEqual(metrics.dashboard_metrics()['active_loans'], 0)
+
+    def test_dashboard_and_reports_share_the_cached_metrics(self):
+        claim_book(self.reader, self.books[0])
+        reports.refresh_snapshot(now=timezone.now() + reports.SETTLE)
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('admin_dashboard'))
+        self.assertEqual((response.context['total_books'], response.context['total_borrowed']), (4, 1))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin_reports'))
+        self.assertFalse([q['sql'] for q in queries.captured_queries if 'library_book' in q['sql']])
+        self.assertEqual((response.context['total_books'], response.context['total_users']), (4, 1))
+
+
+class CirculationRollupTest(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(username='trends', is_staff=True)
+        self.reader = User.objects.create_user(username='trender')
+        self.novel = Book.objects.create(title='Novel', author='Author', genre='fiction', total_copies=2, available_copies=2)
+        self.whodunit = Book.objects.create(title='Whodunit', author='Author', genre='mystery')
+        self.today = timezone.localdate()
+
+    def rollups(self):
+        return {
+            (row.day, row.genre): (row.borrowed, row.returned, row.overdue)
+            for row in DailyCirculation.objects.all() if (row.borrowed, row.returned, row.overdue) != (0, 0, 0)
+        }
+
+    def test_circulation_keeps_rollups_in_step_with_a_backfill(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            kept = claim_book(self.reader, self.novel)
+            # Applied after commit, outside the borrow transaction.
+            self.assertFalse(DailyCirculation.objects.exists())
+            renew_borrow(kept)
+            (returned,), _ = claim_books(self.reader, [self.whodunit.id])
+            return_borrow(returned)
+            late = claim_book(self.reader, self.novel, days=-1)
+            return_borrow(late)
+
+        live = self.rollups()
+        self.assertEqual(live[self.today, 'fiction'], (2, 1, 0))
+        self.assertEqual(live[self.today - timedelta(days=1), 'fiction'], (0, 0, 1))
+        self.assertEqual(live[self.today, 'mystery'], (1, 1, 0))
+        self.assertEqual(live[self.today + timedelta(days=14), 'fiction'], (0, 0, 1))
+        rollups.backfill()
+        self.assertEqual(self.rollups(), live)
+
+    def test_backfill_counts_archived_loans_in_date_chunks(self):
+        now = timezone.now()
+        for days_ago in (40, 20):
+            Borrow.objects.create(
+                user=self.reader, book=self.whodunit, borrowed_at=now - timedelta(days=days_ago),
+                due_date=now - timedelta(days=days_ago - 7), returned=True, returned_at=now - timedelta(days=days_ago - 10),
+                fine_accrued_days=3,
+            )
+        Borrow.objects.create(user=self.reader, book=self.whodunit, borrowed_at=now - timedelta(days=3), due_date=now + timedelta(days=4))
+        archive_returned_loans(older_than_days=25, now=now)
+        self.assertEqual(ArchivedBorrow.objects.count(), 1)
+
+        # Three borrows, two returns and three due dates, one (day, genre) row each.
+        self.assertEqual(rollups.backfill(chunk_days=7), 8)
+        rows = self.rollups()
+        self.assertEqual(rows[self.today - timedelta(days=40), 'mystery'], (1, 0, 0))
+        self.assertEqual(rows[self.today - timedelta(days=33), 'mystery'], (0, 0, 1))
+        self.assertEqual(rows[self.today - timedelta(days=30), 'mystery'], (0, 1, 0))
+        self.assertEqual(rows[self.today + timedelta(days=4), 'mystery'], (0, 0, 1))
+        self.assertEqual(sum(borrowed for borrowed, _, _ in rows.values()), 3)
+
+    def test_trend_endpoint_downsamples_and_validates(self):
+        monday = self.today - timedelta(days=self.today.weekday() + 14)
+        DailyCirculation.objects.bulk_create([
+            DailyCirculation(day=monday, genre='fiction', borrowed=2),
+            DailyCirculation(day=monday + timedelta(days=6), genre='mystery', borrowed=1, overdue=1),
+            DailyCirculation(day=monday + timedelta(days=7), genre='fiction', returned=3),
+        ])
+        url = reverse('circulation_trends')
+        self.client.force_login(self.reader)
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        self.client.force_login(self.staff)
+        params = {'start': (monday + timedelta(days=2)).isoformat(), 'end': (monday + timedelta(days=8)).isoformat()}
+        with self.assertNumQueries(3):  # session, user, one GROUP BY
+            series = self.client.get(url, {**params, 'bucket': 'week'}).json()
+        self.assertEqual(series['labels'], [monday.isoformat(), (monday + timedelta(days=7)).isoformat()])
+        self.assertEqual(series['totals'], {'borrowed': [1, 0], 'returned': [0, 3], 'overdue': [1, 0]})
+        self.assertEqual(series['genres']['fiction']['returned'], [0, 3])
+
+        daily = self.client.get(url, {**params, 'genre': 'fiction'}).json()
+        self.assertEqual(len(daily['labels']), 7)
+        self.assertEqual(sum(daily['totals']['returned']), 3)
+        self.assertEqual(self.client.get(url, {'bucket': 'month'}).json()['bucket'], 'month')
+
+        for bad in ({'bucket': 'year'}, {'start': '2024-02-30'}, {'end': 'soon'}, {'genre': 'poetry'},
+                    {'start': '2024-01-02', 'end': '2024-01-01'}, {'start': '2000-01-01', 'end': '2024-01-01'}):
+            self.assertEqual(self.client.get(url, bad).status_code, 400, bad)
+        # Refused before any bucket list is built.
+        with mock.patch.object(rollups, 'bucket_starts') as bucket_starts:
+            self.assertEqual(self.client.get(url, {'start': '0001-01-01', 'end': '9999-12-31', 'bucket': 'month'}).status_code, 400)
+        bucket_starts.assert_not_called()
+
+    def test_bucket_count_matches_bucket_starts(self):
+        start = date(2023, 12, 27)
+        for days in (0, 1, 5, 6, 7, 40, 400):
+            for bucket in rollups.BUCKETS:
+                end = start + timedelta(days=days)
+                self.assertEqual(rollups.bucket_count(start, end, bucket), len(rollups.bucket_starts(start, end, bucket)), (days, bucket))
+
+
+class LoanAnalyticsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.staff = User.objects.create_user(username='analyst', is_staff=True)
+        self.reader = User.objects.create_user(username='analysed')
+        self.now = timezone.now()
+        self.novel = Book.objects.create(title='Novel', author='Author', genre='fiction', total_copies=2, available_copies=2)
+        self.whodunit = Book.objects.create(title='Whodunit', author='Author', genre='mystery')
+
+    def loan(self, book, borrowed_days_ago, returned_days_ago=None):
+        borrowed_at = self.now - timedelta(days=borrowed_days_ago)
+        returned_at = None if returned_days_ago is None else self.now - timedelta(days=returned_days_ago)
+        return Borrow.objects.create(
+            user=self.reader, book=book, borrowed_at=borrowed_at, due_date=borrowed_at + timedelta(days=7),
+            returned=returned_at is not None, returned_at=returned_at, fine_accrued_days=9,
+        )
+
+    def test_metrics_over_the_window(self):
+        self.loan(self.novel, 29, 26)        # 3 days, on time
+        self.loan(self.novel, 20, 4)         # 16 days, 9 days late
+        self.loan(self.whodunit, 10)         # open, 3 days overdue
+        self.loan(self.whodunit, 400, 390)   # outside the window
+        archive_returned_loans(older_than_days=25, now=self.now)
+
+        report = analytics.compute(days=30, now=self.now, chunk_size=2)
+        self.assertEqual(report['loans'], 3)
+        self.assertEqual(report['duration']['loans'], 2)
+        self.assertEqual(report['duration']['mean'], 9.5)
+        self.assertEqual(report['duration']['percentiles'][0], {'percentile': 50, 'value': 9.5})
+        self.assertEqual(
+            {key: report['fines'][key] for key in ('loans', 'fined', 'total')},
+            {'loans': 3, 'fined': 2, 'total': 120},
+        )
+        self.assertEqual([band['loans'] for band in report['fines']['bands']], [1, 1, 0, 0, 0])
+        genres = {row['genre']: row for row in report['genres']}
+        self.assertEqual((genres['fiction']['loans'], genres['fiction']['turnover']), (2, 1.0))
+        self.assertEqual(genres['fiction']['utilisation'], round(19 / 60, 4))
+        self.assertEqual(genres['mystery']['utilisation'], round(10 / 30, 4))
+        self.assertEqual(report['utilisation'], round(29 / 90, 4))
+
+    def test_matches_the_python_implementation(self):
+        seed_books(50)
+        seed_circulation(10, 500)
+        report = analytics.compute(now=self.now, chunk_size=100)
+        expected = python_loan_analytics(now=self.now)
+        self.assertEqual(report['duration'], expected['duration'])
+        self.assertEqual({key: report['fines'][key] for key in ('loans', 'fined', 'total')}, expected['fines'])
+        self.assertEqual({row['genre']: (row['loans'], row['utilisation']) for row in report['genres']}, expected['genres'])
+
+    def test_staff_view_serves_only_published_reports(self):
+        self.loan(self.novel, 5)
+        url = reverse('loan_analytics')
+        self.client.force_login(self.reader)
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        self.client.force_login(self.staff)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'days': 90})
+        self.assertIsNone(response.context['report'])
+        self.assertContains(response, 'Not computed yet')
+        self.assertFalse([q['sql'] for q in queries.captured_queries if 'library_borrow' in q['sql']])
+
+        out = StringIO()
+        call_command('loan_analytics', stdout=out)
+        for days in analytics.DAY_OPTIONS:
+            self.assertIn(f'Analysed 1 loans over {days} days', out.getvalue())
+        response = self.client.get(url, {'days': 90})
+        self.assertEqual((response.context['days'], response.context['report']['loans']), (90, 1))
+        self.assertContains(response, 'Loan Analytics')
+
+        # Windows the command doesn't publish fall back to the default.
+        self.assertEqual(self.client.get(url, {'days': 3650}).context['days'], 365)
+
+        self.loan(self.whodunit, 2)
+        call_command('loan_analytics', '--days', '90', stdout=StringIO())
+        self.assertEqual(self.client.get(url, {'days': 90}).context['report']['loans'], 2)
+        self.assertEqual(self.client.get(url, {'days': 30}).context['report']['loans'], 1)
+        # A flushed cache is refilled from the stored snapshot.
+        cache.clear()
+        self.assertEqual(self.client.get(url, {'days': 90}).context['report']['loans'], 2)
+
+
+class TrendingBooksTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user(username='trendsetter')
+        self.books = [Book.objects.create(title=f'Trend {i}', author='Author', total_copies=5, available_copies=5) for i in range(3)]
+        self.now = timezone.now()
+
+    def borrow(self, book, days_ago=0, hours_ago=0):
+        at = self.now - timedelta(days=days_ago, hours=hours_ago)
+        loan = Borrow.objects.create(user=self.reader, book=book, borrowed_at=at, due_date=at + timedelta(days=7))
+        BorrowHistory.objects.create(
+            book=book, user=self.reader, borrow=loan, borrow_date=at, due_date=loan.due_date,
+            status=BorrowHistory.BORROWED, recorded_at=at,
+        )
+
+    def windows(self, payload):
+        return {window['window']: [(book['title'], book['borrows']) for book in window['books']] for window in payload['data']}
+
+    def test_space_saving_keeps_heavy_hitters_and_merges(self):
+        stream = [1] * 50 + [2] * 30 + list(range(100, 160))
+        sketch = trending.SpaceSaving(capacity=10)
+        for item in stream:
+            sketch.offer(item)
+        self.assertEqual([item for item, _ in sketch.top(2)], [1, 2])
+        for item, (count, error) in sketch.counters.items():
+            self.assertLessEqual(count - error, stream.count(item))
+            self.assertGreaterEqual(count, stream.count(item))
+
+        left, right = trending.SpaceSaving(capacity=10), trending.SpaceSaving(capacity=10)
+        left.update({1: 40, 3: 5, **{item: 1 for item in range(100, 120)}})
+        right.update({1: 10, 2: 30})
+        merged = left.merge(right)
+        self.assertEqual([item for item, _ in merged.top(2)], [1, 2])
+        # The left sketch is full, so item 2 may have had up to its floor there.
+        self.assertEqual(merged.counters[2], [31, 1])
+        self.assertLessEqual(len(merged.counters), 10)
+
+    def test_windows_fold_incrementally_and_match_a_rebuild(self):
+        self.borrow(self.books[0], days_ago=20)
+        self.borrow(self.books[0], days_ago=20)
+        self.borrow(self.books[0], days_ago=20)
+        self.borrow(self.books[1], days_ago=3)
+        self.borrow(self.books[1], days_ago=3)
+        self.borrow(self.books[2], days_ago=45)
+        payload = trending.refresh_trending(now=self.now)
+        self.assertEqual(self.windows(payload), {'7d': [('Trend 1', 2)], '30d': [('Trend 0', 3), ('Trend 1', 2)]})
+
+        self.borrow(self.books[2], hours_ago=2)
+        claim_book(self.reader, self.books[2])
+        later = self.now + timedelta(minutes=5)
+        self.assertEqual(self.windows(trending.refresh_trending(now=later))['24h'], [('Trend 2', 2)])
+        incremental = {(b.granularity, b.start): b.counters for b in TrendingBucket.objects.all()}
+
+        trending.refresh_trending(rebuild=True, now=later)
+        self.assertEqual({(b.granularity, b.start): b.counters for b in TrendingBucket.objects.all()}, incremental)
+        self.assertFalse(TrendingBucket.objects.filter(start__lt=later - timedelta(days=31)).exists())
+
+    def test_book_list_shows_trending_without_queries(self):
+        etag = self.client.get(reverse('book_list'))['ETag']
+        self.borrow(self.books[1], hours_ago=3)
+        version = catalog_cache.get_version()[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            trending.refresh_trending(now=self.now)
+        # The catalog cache is untouched; only the trending part of the page key moves.
+        self.assertEqual(catalog_cache.get_version()[0], version)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('book_list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Trending')
+        self.assertEqual(response.context['trending'][0]['books'][0]['title'], 'Trend 1')
+        self.assertFalse([q['sql'] for q in queries.captured_queries if 'snapshot' in q['sql'] or 'borrowhistory' in q['sql']])
+
+        # Nothing changed, so the cached page is still served.
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            trending.refresh_trending(now=self.now + timedelta(minutes=1))
+        self.assertEqual(self.client.get(reverse('book_list'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
 class UserProfileEditTest(TestCase):
     def setUp(self):
         self.client = Client()
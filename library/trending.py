@@ -0,0 +1,193 @@
+import hashlib
+import heapq
+import json
+from collections import Counter, defaultdict
+from datetime import timedelta
+from functools import reduce
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, Max
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .models import Book, Borrow, BorrowHistory, ReportSnapshot, TrendingBucket
+from .reports import SETTLE
+
+
+SNAPSHOT = 'trending'
+CACHE_KEY = f'reports:{SNAPSHOT}'
+# Counters per bucket sketch, and books shown per window.
+CAPACITY = 100
+TOP_K = 5
+WINDOWS = [
+    ('24h', 'Last 24 hours', TrendingBucket.HOUR, timedelta(hours=24)),
+    ('7d', 'Last 7 days', TrendingBucket.DAY, timedelta(days=7)),
+    ('30d', 'Last 30 days', TrendingBucket.DAY, timedelta(days=30)),
+]
+# Buckets older than the longest window are dropped.
+RETENTION = {
+    TrendingBucket.HOUR: timedelta(hours=25),
+    TrendingBucket.DAY: timedelta(days=31),
+}
+
+
+class SpaceSaving:
+    """Space-Saving summary (Metwally et al.): a stream's heaviest items in ``capacity`` counters.
+
+    Each counter is ``[count, error]`` and the item's true count lies between
+    ``count - error`` and ``count``; any item seen more than N / capacity
+    times is sure to hold a counter. Summaries merge, so per-bucket sketches
+    add up to any window. ``capacity=None`` holds exact counts.
+    """
+
+    def __init__(self, capacity=CAPACITY, counters=None):
+        self.capacity = capacity
+        self.counters = {int(item): list(value) for item, value in (counters or {}).items()}
+
+    def _floor(self):
+        # The most an item without a counter can have had.
+        if self.capacity is None or len(self.counters) < self.capacity:
+            return 0
+        return min(count for count, _ in self.counters.values())
+
+    def offer(self, item, count=1):
+        if item in self.counters:
+            self.counters[item][0] += count
+        elif self.capacity is None or len(self.counters) < self.capacity:
+            self.counters[item] = [count, 0]
+        else:
+            victim = min(self.counters, key=lambda key: self.counters[key][0])
+            floor = self.counters.pop(victim)[0]
+            self.counters[item] = [floor + count, floor]
+
+    def merge(self, other):
+        """A summary of both streams (Cafaro et al.'s parallel Space-Saving merge)."""
+        floors = self._floor(), other._floor()
+        merged = {}
+        for item in self.counters.keys() | other.counters.keys():
+            count, error = self.counters.get(item, (floors[0], floors[0]))
+            other_count, other_error = other.counters.get(item, (floors[1], floors[1]))
+            merged[item] = [count + other_count, error + other_error]
+        capacity = self.capacity or other.capacity
+        if capacity is not None:
+            merged = dict(heapq.nlargest(capacity, merged.items(), key=lambda entry: (entry[1][0], -entry[0])))
+        return SpaceSaving(capacity, merged)
+
+    def update(self, counts):
+        """Fold exact ``{item: count}`` tallies for a batch of the stream into the summary."""
+        self.counters = self.merge(SpaceSaving(None, {item: (count, 0) for item, count in counts.items()})).counters
+
+    def top(self, k):
+        """``[(item, count), ...]``, heaviest first."""
+        ranked = sorted(self.counters.items(), key=lambda entry: (-entry[1][0], entry[0]))
+        return [(item, count) for item, (count, _) in ranked[:k]]
+
+
+def _bucket_start(granularity, hour):
+    if granularity == TrendingBucket.DAY:
+        return timezone.localtime(hour).replace(hour=0)
+    return hour
+
+
+def _hourly(loans, field):
+    rows = loans.annotate(hour=TruncHour(field)).values('hour', 'book_id').annotate(total=Count('id')).order_by()
+    return {(row['hour'], row['book_id']): row['total'] for row in rows}
+
+
+def _fold(hourly, now):
+    """Add ``{(hour, book_id): count}`` tallies to the hourly and daily sketches."""
+    batches = defaultdict(Counter)
+    for (hour, book_id), total in hourly.items():
+        for granularity in RETENTION:
+            start = _bucket_start(granularity, hour)
+            if start > now - RETENTION[granularity]:
+                batches[granularity, start][book_id] += total
+    if not batches:
+        return
+    existing = {
+        (bucket.granularity, bucket.start): bucket.counters
+        for bucket in TrendingBucket.objects.filter(start__gte=min(start for _, start in batches))
+    }
+    buckets = []
+    for (granularity, start), counts in batches.items():
+        sketch = SpaceSaving(counters=existing.get((granularity, start)))
+        sketch.update(counts)
+        buckets.append(TrendingBucket(granularity=granularity, start=start, counters=sketch.counters))
+    target = {'unique_fields': ['granularity', 'start']} if connection.features.supports_update_conflicts_with_target else {}
+    TrendingBucket.objects.bulk_create(buckets, update_conflicts=True, update_fields=['counters'], **target)
+
+
+def _build_data(now):
+    buckets = TrendingBucket.objects.filter(start__gt=now - max(RETENTION.values())).values_list('granularity', 'start', 'counters')
+    tops = []
+    for name, label, granularity, span in WINDOWS:
+        sketches = [SpaceSaving(counters=counters) for g, start, counters in buckets if g == granularity and start > now - span]
+        tops.append((name, label, reduce(SpaceSaving.merge, sketches, SpaceSaving()).top(TOP_K)))
+    books = Book.objects.in_bulk({book_id for _, _, top in tops for book_id, _ in top})
+    # Windows with nothing borrowed are left out.
+    return [
+        {
+            'window': name,
+            'label': label,
+            'books': [
+                {'id': book_id, 'title': books[book_id].title, 'author': books[book_id].author, 'borrows': count}
+                for book_id, count in top if book_id in books
+            ],
+        }
+        for name, label, top in tops if any(book_id in books for book_id, _ in top)
+    ]
+
+
+def refresh_trending(rebuild=False, now=None):
+    """Fold borrows logged since the last refresh into the sketches and republish the top books.
+
+    Like the report snapshot, only settled log rows after the watermark are
+    read. ``rebuild`` (and the first run) drops the sketches and refills
+    them from ``Borrow``. The catalog cache is left alone: the payload's
+    ``version`` changes with the lists and is part of the book_list page key.
+    """
+    now = now or timezone.now()
+    settled = now - SETTLE
+    with transaction.atomic():
+        snapshot, _ = ReportSnapshot.objects.select_for_update().get_or_create(name=SNAPSHOT)
+        if rebuild or snapshot.refreshed_at is None:
+            TrendingBucket.objects.all().delete()
+            snapshot.watermark = BorrowHistory.objects.filter(recorded_at__lt=settled).aggregate(last=Max('id'))['last'] or 0
+            loans = Borrow.objects.filter(borrowed_at__gt=now - max(RETENTION.values()), borrowed_at__lt=settled)
+            _fold(_hourly(loans, 'borrowed_at'), now)
+        else:
+            end = BorrowHistory.objects.filter(id__gt=snapshot.watermark, recorded_at__lt=settled).aggregate(last=Max('id'))['last']
+            if end is not None:
+                events = BorrowHistory.objects.filter(
+                    id__gt=snapshot.watermark, id__lte=end, status=BorrowHistory.BORROWED,
+                    recorded_at__gt=now - max(RETENTION.values()),
+                )
+                _fold(_hourly(events, 'recorded_at'), now)
+                snapshot.watermark = end
+        for granularity, keep in RETENTION.items():
+            TrendingBucket.objects.filter(granularity=granularity, start__lte=now - keep).delete()
+
+        snapshot.data = _build_data(now)
+        snapshot.refreshed_at = now
+        snapshot.save()
+        payload = _payload(snapshot.data, snapshot.refreshed_at)
+        transaction.on_commit(lambda: cache.set(CACHE_KEY, payload, timeout=None))
+    return payload
+
+
+def _payload(data, refreshed_at):
+    # ``version`` only changes when the lists do.
+    version = hashlib.md5(json.dumps(data, sort_keys=True).encode()).hexdigest()[:12]
+    return {'data': data, 'refreshed_at': refreshed_at, 'version': version}
+
+
+def get_trending():
+    """The published trending lists: from the cache, else (once) the table; never recomputed here."""
+    payload = cache.get(CACHE_KEY)
+    # Payloads cached before they carried a version are rebuilt too.
+    if payload is None or 'version' not in payload:
+        snapshot = ReportSnapshot.objects.filter(name=SNAPSHOT, refreshed_at__isnull=False).values('data', 'refreshed_at').first()
+        payload = _payload(**(snapshot or {'data': [], 'refreshed_at': None}))
+        cache.set(CACHE_KEY, payload, timeout=None)
+    return payload
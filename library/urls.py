@@ -7,13 +7,17 @@ from .views import export_readers_csv
 urlpatterns = [
     path('', views.landing_page, name='landing_page'),
     path('books/', views.book_list, name='book_list'),
+    path('books/suggest/', views.book_suggest, name='book_suggest'),
     path('books/add/', views.add_book, name='add_book'),
     path('books/edit/<int:pk>/', views.edit_book, name='edit_book'),
     path('books/delete/<int:book_id>/', views.delete_book, name='delete_book'),
     path('admin-books/', views.admin_book_list, name='admin_book_list'),
     path('books/borrow/<int:book_id>/', views.borrow_book, name='borrow_book'),
+    path('books/hold/<int:book_id>/', views.hold_book, name='hold_book'),
     path('borrowed_books/', views.borrowed_books, name='borrowed_books'),
+    path('holds/cancel/<int:hold_id>/', views.cancel_hold, name='cancel_hold'),
     path('return_book/<int:borrow_id>/', views.return_book, name='return_book'),
+    path('borrows/renew/<int:borrow_id>/', views.renew_book, name='renew_book'),
     path('borrow-history/', views.borrow_history, name='borrow_history'),
     path('admin-dashboard/', views.admin_dashboard, name='admin_dashboard'),
     path('register/', views.register, name='register'),
@@ -34,8 +38,12 @@ urlpatterns = [
     path('readers/delete/<int:pk>/', views.delete_reader, name='delete_reader'),
     path('pay-fine/<int:borrow_id>/', views.pay_fine, name='pay_fine'),
     path('readers/export/', views.export_readers_csv, name='export_readers_csv'),
+    path('books/export/', views.export_books_csv, name='export_books_csv'),
+    path('borrows/export/', views.export_borrows_csv, name='export_borrows_csv'),
     path('readers/<int:pk>/', views.reader_detail, name='reader_detail'),
     path('reports/', views.admin_reports, name='admin_reports'),
+    path('reports/circulation/', views.circulation_trends, name='circulation_trends'),
+    path('reports/loans/', views.loan_analytics, name='loan_analytics'),
 
     # Password reset URLs
     path('password-reset/', auth_views.PasswordResetView.as_view(template_name='registration/password_reset_form.html'), name='password_reset'),
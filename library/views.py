@@ -1,4 +1,3 @@
-import csv
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
@@ -7,10 +6,21 @@ from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login
 from django.utils import timezone
 from datetime import timedelta
+from django.db import transaction
 from django.db.models import Q
+from django.core.cache import cache
 from django.core.paginator import Paginator
-
-from .models import Book, Borrow, BorrowHistory, Reader, UserProfile
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_date
+from django.utils.http import http_date
+
+from .models import Book, Borrow, BorrowHistory, Hold, Reader, UserProfile
+from . import analytics, catalog_cache, facets, fines, metrics, outbox, reports, rollups, trending
+from .circulation import claim_book, claim_books, place_hold, queue_position, release_hold, renew_borrow, return_borrow
+from .exports import csv_response
+from .pagination import paginate
+from .search import search_books
+from .suggest import get_index
 from .forms import BookForm, BorrowForm, ReaderForm, UserUpdateForm, EditProfileForm
 from django.contrib.auth import update_session_auth_hash
 from .forms import UserForm, UserProfileForm, CustomPasswordChangeForm
@@ -18,10 +28,7 @@ from .forms import UserForm, UserProfileForm, CustomPasswordChangeForm
 from django.http import HttpResponseRedirect
 from django.urls import reverse
 
-from django.http import HttpResponse
-from .utils.email_utils import send_notification_email
-
-from django.db.models import Count
+from django.http import HttpResponse, JsonResponse
 
 
 from library.utils.email_utils import send_borrow_notification
@@ -34,16 +41,10 @@ def landing_page(request):
 
 
 # Book Views
-def book_list(request):
+def _catalog_page(request, query, genre, availability):
+    """The part of book_list that is the same for every visitor."""
     books = Book.objects.all()
 
-    # Search and filters
-    query = request.GET.get('q', '').strip()
-    genre = request.GET.get('genre', '')
-    availability = request.GET.get('available', '')
-
-    if query:
-        books = books.filter(Q(title__icontains=query) | Q(author__icontains=query))
     if genre:
         books = books.filter(genre=genre)
     if availability == 'available':
@@ -51,28 +52,93 @@ def book_list(request):
     elif availability == 'unavailable':
         books = books.filter(available=False)
 
-    books = books.order_by('title')
+    if query:
+        # Relevance-ranked results cannot be keyed on (title, id).
+        paginator = Paginator(search_books(books, query), 10)
+        page_obj = paginator.get_page(request.GET.get('page'))
+        cursor_pagination = False
+    else:
+        page_obj, cursor_pagination = paginate(request, books, ('title', 'id'))
+
+    genre_counts, availability_counts = facets.summarize(facets.get_facet_counts(), genre, availability)
+    if cursor_pagination:
+        # The facet counters already hold the total, so no COUNT(*) is needed.
+        page_obj.approximate_count = genre_counts.get(genre, 0) if genre else sum(genre_counts.values())
+
+    return {
+        'page_obj': catalog_cache.freeze_page(page_obj),
+        'cursor_pagination': cursor_pagination,
+        'genres': [(value, label, genre_counts.get(value, 0)) for value, label in Book.GENRE_CHOICES],
+        'availability_counts': availability_counts,
+    }
+
+
+def book_list(request):
+    # Search and filters
+    query = request.GET.get('q', '').strip()
+    genre = request.GET.get('genre', '')
+    availability = request.GET.get('available', '')
 
-    paginator = Paginator(books, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Anonymous pages are identical for everyone, so they can be answered
+    # with 304s and served as cached HTML; flash messages make a page unique.
+    shared = not request.user.is_authenticated and not len(messages.get_messages(request))
+    version, last_modified = catalog_cache.get_version()
+    # Published by refresh_trending; a cache read, no query.
+    trending_books = trending.get_trending()
+
+    if shared:
+        # Trending lists change on their own schedule, so the rendered page
+        # is keyed on both versions instead of bumping the catalog's.
+        page_version = f"{version}.{trending_books['version']}"
+        if trending_books['refreshed_at']:
+            last_modified = max(last_modified, trending_books['refreshed_at'].timestamp())
+        etag = catalog_cache.page_etag(page_version, request.GET)
+        not_modified = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+        if not_modified is not None:
+            not_modified['ETag'] = etag
+            return not_modified
+        html = cache.get(catalog_cache.page_key('html', page_version, request.GET))
+        if html is not None:
+            return _shared_catalog_response(HttpResponse(html), etag, last_modified)
+
+    context = catalog_cache.get_or_build(
+        'context', version, request.GET, lambda: _catalog_page(request, query, genre, availability)
+    )
 
     borrowed_book_ids = []
     borrowed_books = []
     if request.user.is_authenticated:
-        borrowed_books = Borrow.objects.filter(user=request.user, returned=False)
-        borrowed_book_ids = [b.book.id for b in borrowed_books]
+        borrowed_books = Borrow.objects.filter(user=request.user, returned=False).select_related('book')
+        borrowed_book_ids = set(borrowed_books.values_list('book_id', flat=True))
 
     context = {
-        'page_obj': page_obj,
+        **context,
         'query': query,
         'genre': genre,
         'availability': availability,
         'borrowed_book_ids': borrowed_book_ids,
         'active_borrows': borrowed_books,
-        'genres': Book.GENRE_CHOICES,
+        'trending': trending_books['data'],
     }
-    return render(request, 'library/book_list.html', context)
+    response = render(request, 'library/book_list.html', context)
+
+    if shared:
+        cache.set(catalog_cache.page_key('html', page_version, request.GET), response.content, catalog_cache.PAGE_TIMEOUT)
+        _shared_catalog_response(response, etag, last_modified)
+    return response
+
+
+def _shared_catalog_response(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def book_suggest(request):
+    query = request.GET.get('q', '').strip()
+    suggestions = get_index().suggest(query) if query else []
+    return JsonResponse({'query': query, 'suggestions': suggestions})
 
 
 
@@ -122,54 +188,78 @@ def delete_book(request, book_id):
 def borrow_book(request, book_id):
     book = get_object_or_404(Book, id=book_id)
 
-    if not book.available:
-        messages.warning(request, "Sorry, this book is already borrowed.")
+    with transaction.atomic():
+        borrow = claim_book(request.user, book)
+        if borrow is not None:
+            # Queued with the loan; run_mail_worker sends it.
+            due_date = borrow.due_date
+            subject = f"Book Borrowed: {book.title}"
+            message = f"Hi {request.user.username},\n\nYou borrowed '{book.title}'. Please return it by {due_date.strftime('%Y-%m-%d')}.\n\nThank you!"
+            outbox.enqueue(subject, message, [request.user.email])
+
+    if borrow is None:
+        messages.warning(request, "Sorry, this book is already borrowed. Place a hold to be next in line.")
     else:
-        due_date = timezone.now() + timedelta(days=7)
-        borrow = Borrow.objects.create(
-            user=request.user,
-            book=book,
-            borrowed_at=timezone.now(),
-            due_date=due_date
-        )
-        book.available = False
-        book.save()
         messages.success(request, f"You have successfully borrowed '{book.title}'. Due on {due_date.strftime('%Y-%m-%d')}")
 
-        # Send email notification
-        subject = f"Book Borrowed: {book.title}"
-        message = f"Hi {request.user.username},\n\nYou borrowed '{book.title}'. Please return it by {due_date.strftime('%Y-%m-%d')}.\n\nThank you!"
-        send_notification_email(subject, message, [request.user.email])
-
     return redirect('book_list')
 
 
 
 @login_required
 def borrowed_books(request):
-    active_borrows = Borrow.objects.filter(user=request.user, returned=False)
+    active_borrows = Borrow.objects.filter(user=request.user, returned=False).select_related('book')
+    holds = Hold.objects.filter(user=request.user, status__in=Hold.ACTIVE).select_related('book').order_by('created_at')
+    # Returned loans can still owe what the ledger charged them.
+    fines_due = Borrow.objects.filter(user=request.user).outstanding_fines().select_related('book').order_by('due_date', 'id')
     return render(request, 'library/borrowed_books.html', {
         'borrows': active_borrows,
+        'holds': holds,
+        'fines_due': fines_due,
         'today': timezone.now().date()
     })
 
 
+@login_required
+def hold_book(request, book_id):
+    book = get_object_or_404(Book, id=book_id)
+    if request.method != 'POST':
+        return redirect('book_list')
+
+    hold, created = place_hold(request.user, book)
+    if hold is None:
+        messages.info(request, f"A copy of '{book.title}' is on the shelf, so you can borrow it right away.")
+    elif created:
+        messages.success(request, f"Hold placed on '{book.title}'. You are number {queue_position(hold)} in line.")
+    elif hold.status == Hold.READY:
+        messages.info(request, f"A copy of '{book.title}' is already waiting for you.")
+    else:
+        messages.info(request, f"You are already number {queue_position(hold)} in line for '{book.title}'.")
+    return redirect('book_list')
+
+
+@login_required
+def cancel_hold(request, hold_id):
+    hold = get_object_or_404(Hold.objects.select_related('book'), id=hold_id, user=request.user)
+    if request.method == 'POST' and release_hold(hold):
+        messages.success(request, f"Your hold on '{hold.book.title}' has been cancelled.")
+    return redirect('borrowed_books')
+
+
 
 @login_required
 def return_book(request, borrow_id):
-    borrow = get_object_or_404(Borrow, id=borrow_id, user=request.user, returned=False)
+    borrow = get_object_or_404(Borrow.objects.select_related('book'), id=borrow_id, user=request.user, returned=False)
 
     if request.method == 'POST':
-        borrow.returned = True
-        borrow.returned_at = timezone.now()
-        borrow.book.available = True
-        borrow.book.save()
-        borrow.save()
+        with transaction.atomic():
+            if not return_borrow(borrow):
+                messages.info(request, f"'{borrow.book.title}' has already been returned.")
+                return redirect('book_list')
 
-        # Send email notification on return
-        subject = f"Book Returned: {borrow.book.title}"
-        message = f"Hi {request.user.username},\n\nYou have successfully returned '{borrow.book.title}'. Thank you!"
-        send_notification_email(subject, message, [request.user.email])
+            subject = f"Book Returned: {borrow.book.title}"
+            message = f"Hi {request.user.username},\n\nYou have successfully returned '{borrow.book.title}'. Thank you!"
+            outbox.enqueue(subject, message, [request.user.email])
 
         messages.success(request, f"You have returned '{borrow.book.title}'. Thank you!")
         return redirect('book_list')
@@ -177,28 +267,39 @@ def return_book(request, borrow_id):
     return render(request, 'library/confirm_return.html', {'borrow': borrow})
 
 
+@login_required
+def renew_book(request, borrow_id):
+    borrow = get_object_or_404(Borrow.objects.select_related('book'), id=borrow_id, user=request.user, returned=False)
+    if request.method != 'POST':
+        return redirect('borrowed_books')
+
+    if renew_borrow(borrow):
+        messages.success(request, f"'{borrow.book.title}' renewed. Now due on {borrow.due_date.strftime('%Y-%m-%d')}.")
+    else:
+        messages.warning(request, f"'{borrow.book.title}' can't be renewed: it is overdue, renewed too often, or another reader is waiting for it.")
+    return redirect('borrowed_books')
+
+
 
 
 
 @login_required
 def borrow_history(request):
-    user_history = Borrow.objects.filter(user=request.user).order_by('-borrowed_at')
+    # Spans the hot table and the archive of old returned loans.
+    user_history = Borrow.all_loans.history(user=request.user)
     return render(request, 'library/borrow_history.html', {'history': user_history})
 
 
 # Admin Dashboard
 @staff_member_required
 def admin_dashboard(request):
-    total_books = Book.objects.count()
-    total_borrowed = Borrow.objects.filter(returned=False).count()
-    total_available = Book.objects.filter(available=True).count()
-    total_users = Borrow.objects.values('user').distinct().count()
+    counts = metrics.dashboard_metrics()
 
     context = {
-        'total_books': total_books,
-        'total_borrowed': total_borrowed,
-        'total_available': total_available,
-        'total_users': total_users,
+        'total_books': counts['total_books'],
+        'total_borrowed': counts['active_loans'],
+        'total_available': counts['available_books'],
+        'total_users': counts['total_users'],
     }
     return render(request, 'library/admin_dashboard.html', context)
 
@@ -220,7 +321,7 @@ def register(request):
 # User Profile
 @login_required
 def user_profile(request):
-    borrowed = Borrow.objects.filter(user=request.user)
+    borrowed = Borrow.objects.filter(user=request.user).select_related('book')
     total_borrowed = borrowed.count()
 
     return render(request, 'library/user_profile.html', {
@@ -231,16 +332,33 @@ def user_profile(request):
 
 
 # Overdue Books
+OVERDUE_ORDERINGS = {
+    'fine': ('-fine_due', 'due_date', 'id'),
+    'due': ('due_date', 'id'),
+    'user': ('user__username', 'due_date', 'id'),
+}
+
+
 @staff_member_required
 def overdue_books(request):
-    overdue = Borrow.objects.filter(returned=False, due_date__lt=timezone.now())
-    return render(request, 'library/overdue_books.html', {'overdue': overdue})
+    now = timezone.now()
+    sort = request.GET.get('sort', 'fine')
+    overdue = (
+        Borrow.objects.overdue(now).with_fines(now).with_fine_due()
+        .select_related('book', 'user')
+        .order_by(*OVERDUE_ORDERINGS.get(sort, OVERDUE_ORDERINGS['fine']))
+    )
+    return render(request, 'library/overdue_books.html', {
+        'overdue': overdue,
+        'fine_totals': Borrow.objects.fine_totals(),
+        'sort': sort,
+    })
 
 
 # Book History View (moved from models.py)
 def book_history(request, book_id):
     book = get_object_or_404(Book, id=book_id)
-    history = BorrowHistory.objects.filter(book=book).order_by('-borrow_date')
+    history = BorrowHistory.objects.filter(book=book).select_related('user').order_by('-borrow_date')
     return render(request, 'library/book_history.html', {'book': book, 'history': history})
 
 
@@ -248,18 +366,18 @@ def book_history(request, book_id):
 @login_required
 def user_history(request):
     user = request.user
-    history = BorrowHistory.objects.filter(user=user).order_by('-borrow_date')
+    history = BorrowHistory.objects.filter(user=user).select_related('book').order_by('-borrow_date')
     return render(request, 'library/user_history.html', {'history': history})
 
 
 @staff_member_required
 def book_history(request, book_id):
     book = get_object_or_404(Book, pk=book_id)
-    borrow_history = Borrow.objects.filter(book=book)
+    history = BorrowHistory.objects.filter(book=book).select_related('user').order_by('-borrow_date', '-id')
 
     return render(request, 'library/book_history.html', {
         'book': book,
-        'borrow_history': borrow_history
+        'history': history,
     })
 
 
@@ -275,14 +393,13 @@ def reader_list(request):
     else:
         readers_queryset = Reader.objects.all()
 
-    paginator = Paginator(readers_queryset, 10)
-    page_number = request.GET.get('page')
-    readers = paginator.get_page(page_number)
+    readers, cursor_pagination = paginate(request, readers_queryset, ('name', 'id'), with_count=True)
 
     form = ReaderForm()
 
     return render(request, 'library/readers.html', {
         'readers': readers,
+        'cursor_pagination': cursor_pagination,
         'form': form,
         'search_query': query,
     })
@@ -335,39 +452,33 @@ def checkout(request):
         messages.warning(request, "Your bag is empty.")
         return redirect('my_bag')
 
-    books = Book.objects.filter(id__in=bag, available=True)
-    if not books:
+    with transaction.atomic():
+        borrows, unavailable = claim_books(request.user, bag)
+        if borrows:
+            due_date = borrows[0].due_date
+            borrowed_titles = [borrow.book.title for borrow in borrows]
+
+            # ✅ Email confirmation, queued with the loans
+            subject = "Library Checkout Confirmation"
+            message = (
+                f"Hi {request.user.username},\n\n"
+                f"You have successfully borrowed the following books:\n\n"
+                + "\n".join(f"- {title}" for title in borrowed_titles) +
+                f"\n\nPlease return them by {due_date.strftime('%Y-%m-%d')}.\n\n"
+                "Thank you and happy reading!\nPeace Library"
+            )
+            outbox.enqueue(subject, message, [request.user.email])
+
+    if not borrows:
         messages.error(request, "No available books in your bag to borrow.")
         return redirect('my_bag')
 
-    due_date = timezone.now() + timedelta(days=7)
-    borrowed_titles = []
-
-    for book in books:
-        Borrow.objects.create(
-            user=request.user,
-            book=book,
-            borrowed_at=timezone.now(),
-            due_date=due_date,
-        )
-        book.available = False
-        book.save()
-        borrowed_titles.append(book.title)
-
-    # ✅ Email confirmation
-    subject = "Library Checkout Confirmation"
-    message = (
-        f"Hi {request.user.username},\n\n"
-        f"You have successfully borrowed the following books:\n\n"
-        + "\n".join(f"- {title}" for title in borrowed_titles) +
-        f"\n\nPlease return them by {due_date.strftime('%Y-%m-%d')}.\n\n"
-        "Thank you and happy reading!\nPeace Library"
-    )
-    send_notification_email(subject, message, [request.user.email])
-
     # ✅ Clear bag and show UI message
     request.session['my_bag'] = []
-    messages.success(request, f"You successfully borrowed {len(books)} book(s). A confirmation email has been sent.")
+    messages.success(request, f"You successfully borrowed {len(borrows)} book(s). A confirmation email has been sent.")
+    if unavailable:
+        titles = ", ".join(book.title for book in unavailable)
+        messages.warning(request, f"Not borrowed because they are no longer available: {titles}.")
 
     return redirect('borrowed_books')
 
@@ -439,12 +550,10 @@ def add_reader(request):
             return redirect('reader_list')
         else:
             messages.error(request, 'Please correct the errors below.')
-            readers = Reader.objects.all()
-            paginator = Paginator(readers, 10)
-            page_number = request.GET.get('page')
-            readers_page = paginator.get_page(page_number)
+            readers_page, cursor_pagination = paginate(request, Reader.objects.all(), ('name', 'id'), with_count=True)
             return render(request, 'library/readers.html', {
                 'readers': readers_page,
+                'cursor_pagination': cursor_pagination,
                 'form': form,
                 'search_query': '',
             })
@@ -484,10 +593,10 @@ def delete_reader(request, pk):
 def pay_fine(request, borrow_id):
     borrow = get_object_or_404(Borrow, id=borrow_id, user=request.user)
 
-    if borrow.fine_amount > 0 and not borrow.fine_paid:
-        borrow.fine_paid = True
-        borrow.save()
-        messages.success(request, f"Fine of {borrow.fine_amount} has been marked as paid.")
+    # Recorded in the fine ledger; the row lock makes a double submit pay once.
+    paid = fines.record_payment(borrow)
+    if paid:
+        messages.success(request, f"Fine of {paid} has been paid.")
     else:
         messages.info(request, "No fine to pay or fine already paid.")
 
@@ -495,32 +604,55 @@ def pay_fine(request, borrow_id):
 
 
 
+EXPORT_CHUNK_SIZE = 2000
+
+
 @staff_member_required
 def export_readers_csv(request):
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="readers.csv"'
+    readers = (
+        Reader.objects.order_by('id')
+        .values_list('name', 'contact', 'reference_id', 'address')
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+    return csv_response('readers.csv', ['Name', 'Contact', 'Reference ID', 'Address'], readers)
+
+
+@staff_member_required
+def export_books_csv(request):
+    books = (
+        Book.objects.order_by('id')
+        .values_list('id', 'title', 'author', 'genre', 'available', 'description')
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+    return csv_response('books.csv', ['ID', 'Title', 'Author', 'Genre', 'Available', 'Description'], books)
 
-    writer = csv.writer(response)
-    writer.writerow(['Name', 'Contact', 'Reference ID', 'Address'])
 
-    readers = Reader.objects.all()
-    for reader in readers:
-        writer.writerow([reader.name, reader.contact, reader.reference_id, reader.address])
+@staff_member_required
+def export_borrows_csv(request):
+    borrows = (
+        Borrow.objects.order_by('id')
+        .values_list(
+            'id', 'user__username', 'user__email', 'book_id', 'book__title', 'book__author',
+            'borrowed_at', 'due_date', 'returned', 'returned_at', 'fine_paid',
+        )
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+    header = [
+        'ID', 'Username', 'Email', 'Book ID', 'Title', 'Author',
+        'Borrowed At', 'Due Date', 'Returned', 'Returned At', 'Fine Paid',
+    ]
+    return csv_response('borrows.csv', header, borrows)
 
-    return response
 
 @staff_member_required
 def reader_detail(request, pk):
     reader = get_object_or_404(Reader, pk=pk)
 
-    # All borrows by this reader's user
-    borrows = Borrow.objects.filter(user=reader.user).order_by('-borrowed_at')
+    # Active borrows (not returned) are always in the hot table
+    active_borrows = Borrow.objects.filter(user_id=reader.user_id, returned=False).select_related('book').order_by('-borrowed_at')
 
-    # Separate active borrows (not returned)
-    active_borrows = borrows.filter(returned=False)
-
-    # Separate past borrows (returned)
-    past_borrows = borrows.filter(returned=True)
+    # Past borrows (returned), including archived ones
+    past_borrows = Borrow.all_loans.history(user_id=reader.user_id, returned=True)
 
     return render(request, 'library/reader_detail.html', {
         'reader': reader,
@@ -533,37 +665,64 @@ def reader_detail(request, pk):
 
 @staff_member_required
 def admin_reports(request):
-    # Most borrowed books data
-    most_borrowed_books = (
-        Borrow.objects.values('book__title')
-        .annotate(total=Count('book'))
-        .order_by('-total')[:5]
-    )
-    borrowed_labels = [entry['book__title'] for entry in most_borrowed_books]
-    borrowed_data = [entry['total'] for entry in most_borrowed_books]
-
-    # Most active readers data
-    most_active_readers = (
-        Borrow.objects.values('user__username')
-        .annotate(total=Count('user'))
-        .order_by('-total')[:5]
-    )
-    reader_labels = [entry['user__username'] for entry in most_active_readers]
-    reader_data = [entry['total'] for entry in most_active_readers]
+    if request.method == 'POST':
+        reports.refresh_snapshot(force=True)
+        messages.success(request, "Reports recomputed from scratch.")
+        return redirect('admin_reports')
+
+    # Precomputed by refresh_reports; the page never aggregates over Borrow.
+    snapshot = reports.get_snapshot()
+    # Headline counts are live (short-lived cache), not from the snapshot.
+    counts = metrics.dashboard_metrics()
+    return render(request, 'library/admin_reports.html', {
+        **snapshot['data'],
+        'total_books': counts['total_books'],
+        'available_books': counts['available_books'],
+        'borrowed_books_count': counts['total_books'] - counts['available_books'],
+        'total_borrowed': counts['total_books'] - counts['available_books'],
+        'total_users': counts['total_users'],
+        'refreshed_at': snapshot['refreshed_at'],
+        'genres': Book.GENRE_CHOICES,
+    })
 
-    # Book availability data
-    total_books = Book.objects.count()
-    available_books = Book.objects.filter(available=True).count()
-    borrowed_books_count = total_books - available_books
 
-    return render(request, 'library/admin_reports.html', {
-        'total_books': total_books,
-        'total_borrowed': borrowed_books_count,
-        'total_users': Borrow.objects.values('user').distinct().count(),
-        'most_borrowed_books_labels': borrowed_labels,
-        'most_borrowed_books_data': borrowed_data,
-        'most_active_readers_labels': reader_labels,
-        'most_active_readers_data': reader_data,
-        'available_books': available_books,
-        'borrowed_books_count': borrowed_books_count,
+@staff_member_required
+def loan_analytics(request):
+    # Only the windows the loan_analytics command publishes; the page never computes.
+    days = request.GET.get('days', '')
+    days = int(days) if days.isdigit() and int(days) in analytics.DAY_OPTIONS else 365
+    return render(request, 'library/loan_analytics.html', {
+        'days': days,
+        'report': analytics.loan_analytics(days),
+        'day_options': analytics.DAY_OPTIONS,
     })
+
+
+# Longest series one request may ask for, in buckets.
+MAX_TREND_POINTS = 1000
+
+
+@staff_member_required
+def circulation_trends(request):
+    """Daily circulation rollups for a date range as JSON, optionally per week or month."""
+    dates = {}
+    for name in ('start', 'end'):
+        try:
+            dates[name] = parse_date(request.GET[name]) if request.GET.get(name) else ''
+        except ValueError:
+            dates[name] = None
+    if None in dates.values():
+        return JsonResponse({'error': "Dates must be YYYY-MM-DD."}, status=400)
+    end = dates['end'] or timezone.localdate()
+    start = dates['start'] or end - timedelta(days=89)
+    bucket = request.GET.get('bucket', 'day')
+    genre = request.GET.get('genre', '')
+    if bucket not in rollups.BUCKETS:
+        return JsonResponse({'error': f"bucket must be one of: {', '.join(rollups.BUCKETS)}."}, status=400)
+    if genre and genre not in dict(Book.GENRE_CHOICES):
+        return JsonResponse({'error': f"Unknown genre {genre!r}."}, status=400)
+    if start > end:
+        return JsonResponse({'error': "start must not be after end."}, status=400)
+    if rollups.bucket_count(start, end, bucket) > MAX_TREND_POINTS:
+        return JsonResponse({'error': f"At most {MAX_TREND_POINTS} {bucket}s per request; use a coarser bucket."}, status=400)
+    return JsonResponse(rollups.series(start, end, bucket, genre or None))
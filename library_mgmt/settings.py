@@ -24,6 +24,7 @@ INSTALLED_APPS = [
 
 # Middleware
 MIDDLEWARE = [
+    'library.middleware.RequestMetricsMiddleware',  # First, so it times the whole stack
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Optional for static files
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -41,7 +42,8 @@ WSGI_APPLICATION = 'library_mgmt.wsgi.application'
 # Templates (important for admin)
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates that reports render time to RequestMetricsMiddleware
+        'BACKEND': 'library.middleware.TimedDjangoTemplates',
         'DIRS': [BASE_DIR / 'library' / 'templates'],  # your templates folder
         'APP_DIRS': True,  # required to load app templates (like admin)
         'OPTIONS': {
@@ -67,6 +69,21 @@ DATABASES = {
     }
 }
 
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Writers queue on the database lock (taken at BEGIN) instead of failing,
+    # and tests use a file so concurrent-borrow tests get real connections.
+    DATABASES['default']['OPTIONS'] = {'timeout': 20, 'transaction_mode': 'IMMEDIATE'}
+    DATABASES['default']['TEST'] = {'NAME': BASE_DIR / 'test_db.sqlite3'}
+
+# Cache: shared counters (facets etc.) need a cache every worker can see,
+# e.g. django.core.cache.backends.redis.RedisCache in production.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='library-default'),
+    }
+}
+
 # Password validators
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',},
@@ -102,6 +119,20 @@ if not DEBUG:
     SECURE_BROWSER_XSS_FILTER = True
     SECURE_CONTENT_TYPE_NOSNIFF = True
 
+# Request metrics: fraction of requests that get SQL/timing instrumentation.
+REQUEST_METRICS_SAMPLE_RATE = config('REQUEST_METRICS_SAMPLE_RATE', default=0.05, cast=float)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'library.metrics': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
 # Login settings
 LOGIN_REDIRECT_URL = 'book_list'
 LOGOUT_REDIRECT_URL = '/'